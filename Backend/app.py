@@ -96,34 +96,169 @@
 
 
 
-from flask import Flask, request, jsonify, url_for, current_app
+from flask import Flask, request, jsonify, url_for, current_app, Response, stream_with_context, g, abort, send_file
 import os
 import json
 from datetime import datetime
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from model.predict import predict_diagnosis
-from model.explainers import generate_explanations
+# before numpy/OpenCV are loaded, so their pools get this worker's share (model/threads.py)
+from model import threads
+threads.configure_process()
+from model.predict import predict_diagnosis, predict_batch, batching_metrics, PREDICT_BATCH_SIZE
+from model.explainers import explanation_params, parse_explainers, render_from_maps, EXPLAINERS
+from model.registry import (warm_up, model_report, model_version, pinned, active_path, version_path,
+                            activate_in_background, watch_model_dir, versions_report,
+                            MODEL_DIR)
+from model.cache import cache_key, cache_stats, prediction_cache, explanation_cache
+from model.decode import decode_image_bytes, decode_params
+from model.backends import backend_params, backend_report, prepare_backend
+from model import telemetry
+from model import artifacts
+from model import render
+from model.telemetry import span
+from explain_jobs import ExplainJobQueue, public_job_view, JOB_DONE, JOB_FAILED
+from report_store import ReportStore
+import base64
+import io
+import hashlib
+import hmac
+import threading
+import time
 import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 # ==== PATH SETUP ====
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
-PATIENT_FOLDER = os.path.join(BASE_DIR, 'static', 'patient_data')
-EXPLANATIONS_FOLDER = os.path.join(BASE_DIR, 'static', 'explanations')
+# uploads, reports, explanation images and server state live under XAI_STORAGE_DIR (default: here)
+STORAGE_DIR = os.path.abspath(os.environ.get("XAI_STORAGE_DIR") or BASE_DIR)
+STATIC_FOLDER = os.path.join(STORAGE_DIR, 'static')
+UPLOAD_FOLDER = os.path.join(STATIC_FOLDER, 'uploads')
+PATIENT_FOLDER = os.path.join(STATIC_FOLDER, 'patient_data')
+EXPLANATIONS_FOLDER = os.path.join(STATIC_FOLDER, 'explanations')
+# server-side state that must not be served as static files
+DATA_FOLDER = os.path.join(STORAGE_DIR, 'data')
+EXPLAIN_JOBS_FOLDER = os.path.join(DATA_FOLDER, 'explain_jobs')
+REPORT_DB_PATH = os.path.join(DATA_FOLDER, 'reports.sqlite3')
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PATIENT_FOLDER, exist_ok=True)
 os.makedirs(EXPLANATIONS_FOLDER, exist_ok=True)
+os.makedirs(EXPLAIN_JOBS_FOLDER, exist_ok=True)
+
+# ==== REPORT INDEX ====
+# SQLite index over static/patient_data; seeded from the JSON files the first time it is empty
+report_store = ReportStore(REPORT_DB_PATH)
+if report_store.count() == 0:
+    report_store.migrate_json_folder(PATIENT_FOLDER)
 
 # ==== FLASK SETUP ====
-app = Flask(__name__)
+app = Flask(__name__, static_folder=STATIC_FOLDER)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # allow 5173 (vite) and 3000 (create-react-app) in dev
-CORS(app, origins=["http://localhost:5173", "http://localhost:3000"])
-
-# optionally limit upload size (uncomment if desired)
-# app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB
+CORS(app, origins=["http://localhost:5173", "http://localhost:3000"],
+     expose_headers=["X-Trace-Id", "Server-Timing"])
+
+# upper bound on a request body; larger uploads get 413 before anything is read
+MAX_UPLOAD_MB = float(os.environ.get("XAI_MAX_UPLOAD_MB", "512"))
+app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 1024 * 1024)
+
+# The model is loaded lazily on the first request; set XAI_WARMUP_ON_BOOT=1 to load and
+# warm it up at import time instead (recommended under gunicorn so workers start hot).
+WARMUP_ON_BOOT = os.environ.get("XAI_WARMUP_ON_BOOT", "0") == "1"
+
+# With XAI_MODEL_DIR (model/registry.py), each process checks the directory's "current" file this
+# often and swaps to the version it names; POST /model/activate changes that file. 0 disables.
+MODEL_WATCH_SECONDS = float(os.environ.get("XAI_MODEL_WATCH_SECONDS", "5"))
+# /model/activate needs this in X-Admin-Token; without it only local requests may call it
+ADMIN_TOKEN = os.environ.get("XAI_ADMIN_TOKEN", "")
+
+# /explain runs in a pool of worker processes; each holds its own copy of the model
+EXPLAIN_WORKERS = int(os.environ.get("XAI_EXPLAIN_WORKERS", "1"))
+
+# /predict/batch: upper bound on images per request and threads used to hash/decode them
+BATCH_MAX_FILES = int(os.environ.get("XAI_BATCH_MAX_FILES", "1000"))
+# a zip is checked against these before anything in it is decompressed
+BATCH_MAX_IMAGE_MB = float(os.environ.get("XAI_BATCH_MAX_IMAGE_MB", "50"))
+BATCH_MAX_UNZIPPED_MB = float(os.environ.get("XAI_BATCH_MAX_UNZIPPED_MB", "2048"))
+BATCH_DECODE_WORKERS = int(os.environ.get("XAI_BATCH_DECODE_WORKERS", str(min(8, os.cpu_count() or 1))))
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff"}
+
+# /explain/stream: how often the job file is checked for new events, result order, and the
+# idle interval after which a comment line keeps proxies from closing the connection
+EXPLAIN_STREAM_POLL_SECONDS = float(os.environ.get("XAI_EXPLAIN_STREAM_POLL_MS", "50")) / 1000.0
+EXPLAIN_STREAM_ORDER = ("gradcam", "occlusion", "lime")
+EXPLAIN_STREAM_KEEPALIVE_SECONDS = 15.0
+
+# /artifacts/... files are immutable (named by content hash); let browsers and proxies keep them a year
+ARTIFACT_MAX_AGE_SECONDS = 365 * 24 * 3600
+# upper bound on ?numFeatures= when redrawing a LIME image
+RENDER_MAX_FEATURES = 50
+
+# Uploads are decoded from memory; the copy kept in static/uploads is written by this
+# single background thread so the disk write is off the request's critical path.
+_archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-archive")
+
+
+# ==== TELEMETRY ====
+# Every request runs under a trace (id taken from an incoming X-Trace-Id header or generated).
+# Stage spans recorded while handling it come back in the Server-Timing header, and all of
+# them feed the histograms served by /metrics.
+
+_model_watch = {"thread": None}
+_model_watch_lock = threading.Lock()
+
+
+def _start_model_watch():
+    # started by the first request, not at import: serve.py imports this module in a master
+    # that forks (threads don't survive fork) and must never load a model itself
+    if _model_watch["thread"] is not None or not MODEL_DIR:
+        return
+    with _model_watch_lock:
+        if _model_watch["thread"] is None:
+            _model_watch["thread"] = watch_model_dir(MODEL_WATCH_SECONDS, prepare=prepare_backend) or False
+
+
+@app.before_request
+def _start_request_trace():
+    _start_model_watch()
+    g.trace, g.trace_token = telemetry.start_trace(request.headers.get("X-Trace-Id"))
+    g.endpoint_label = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    telemetry.REQUESTS_IN_FLIGHT.inc(endpoint=g.endpoint_label)
+
+
+@app.after_request
+def _add_trace_headers(response):
+    trace = g.get("trace")
+    if trace is not None:
+        g.status_code = response.status_code
+        response.headers["X-Trace-Id"] = trace.trace_id
+        timing = trace.server_timing()
+        if timing:
+            response.headers["Server-Timing"] = timing
+    return response
+
+
+@app.teardown_request
+def _finish_request_trace(error=None):
+    # stream_with_context responses tear down twice: when the view returns and again after the
+    # body has been sent; such views set g.stream_response so only the second one is recorded
+    if g.pop("stream_response", False):
+        return
+    trace = g.pop("trace", None)
+    if trace is None:
+        return
+    telemetry.REQUESTS_IN_FLIGHT.dec(endpoint=g.endpoint_label)
+    telemetry.REQUEST_DURATION.observe(time.perf_counter() - trace.started, endpoint=g.endpoint_label,
+                                       method=request.method, status=g.get("status_code", 500))
+    telemetry.end_trace(g.pop("trace_token"))
+
+
+@app.errorhandler(413)
+def _upload_too_large(error):
+    return jsonify({'error': f'Upload larger than {MAX_UPLOAD_MB:g} MB'}), 413
 
 
 def _ensure_storage_dirs():
@@ -132,30 +267,97 @@ def _ensure_storage_dirs():
     os.makedirs(EXPLANATIONS_FOLDER, exist_ok=True)
 
 
-def _save_upload_file(file_storage):
-    """Sanitize filename, add uuid suffix, save file, and return filename & path."""
-    orig = secure_filename(file_storage.filename)
-    if not orig:
-        orig = f"upload_{uuid.uuid4().hex}.jpg"
-    name, ext = os.path.splitext(orig)
-    unique_name = f"{name}_{uuid.uuid4().hex}{ext}"
-    path = os.path.join(app.config['UPLOAD_FOLDER'], unique_name)
-    file_storage.save(path)
-    return unique_name, path
+def _write_upload(path, data):
+    if os.path.exists(path):
+        return
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        app.logger.exception("Failed to archive upload: %s", path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _save_upload_bytes(data, original_filename, background=False):
+    """Store the upload under its SHA-256 so identical images share one file.
+
+    Returns (filename, path, image_hash); the write is skipped when the content already exists
+    and, with background=True, queued on the archive thread instead of done inline.
+    """
+    with span("upload_save"):
+        image_hash = hashlib.sha256(data).hexdigest()
+        ext = os.path.splitext(secure_filename(original_filename or ""))[1].lower() or ".jpg"
+        filename = f"{image_hash}{ext}"
+        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        if not os.path.exists(path):
+            if background:
+                _archive_executor.submit(_write_upload, path, data)
+            else:
+                _write_upload(path, data)
+    return filename, path, image_hash
+
+
+def _prediction_params():
+    """Everything besides the image and model version that changes a /predict result."""
+    return {**decode_params(), **backend_params()}
+
+
+def _explanation_file_path(rel):
+    rel = str(rel).replace('\\', '/').lstrip('/')
+    if rel.startswith('artifacts/'):
+        return artifacts.artifact_path(rel[len('artifacts/'):]) or os.path.join(STORAGE_DIR, rel)
+    return os.path.join(STATIC_FOLDER, rel)
+
+
+def _explanation_file_stamps(xai_result):
+    stamps = {}
+    rels = [xai_result.get(key) for key in ("gradcam", "lime", "occlusion")]
+    rels.extend((xai_result.get("thumbnails") or {}).values())
+    rels.append(xai_result.get("maps"))
+    for rel in rels:
+        if not rel:
+            continue
+        path = _explanation_file_path(rel)
+        try:
+            stamps[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+    return stamps
+
+
+def _get_cached_explanation(key):
+    """Cached xai_result for key, as long as the images it points to haven't been rewritten since."""
+    entry = explanation_cache.get(key)
+    if entry is None:
+        return None
+    for path, mtime_ns in entry["files"].items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime_ns:
+                raise OSError(path)
+        except OSError:
+            explanation_cache.discard(key)
+            return None
+    return entry["xaiResult"]
 
 
 def _report_file_path(report_id):
     return os.path.join(PATIENT_FOLDER, f"{report_id}.json")
 
 
-def _write_json(path, payload):
-    with open(path, "w", encoding="utf-8") as handle:
-        json.dump(payload, handle, indent=4)
+def _save_report(path, payload):
+    """Atomically write the report JSON and refresh its row in the report index."""
+    with span("report_write"):
+        report_store.save(payload, path)
 
 
-def _read_json(path):
-    with open(path, "r", encoding="utf-8") as handle:
-        return json.load(handle)
+def _update_report(report_id, mutate, path=None):
+    """Apply mutate(payload) to the stored report; concurrent updates from other requests or
+    workers are retried rather than overwritten (ReportStore.update). None if it doesn't exist."""
+    with span("report_write"):
+        return report_store.update(report_id, mutate, path)
 
 
 def _to_static_explanation_url(path):
@@ -186,7 +388,20 @@ def _infer_xai_urls_from_patient_id(patient_id):
     return resolved
 
 
-def _normalize_report(data, fallback_report_id=""):
+# Fields a history row can be projected to with ?fields=
+REPORT_FIELDS = (
+    "reportId", "patientName", "patientId", "patientAge", "patientGender", "imageFilename",
+    "createdAt", "updatedAt", "diagnosis", "confidence", "gradcam", "lime", "occlusion",
+    "thumbnails", "sourceImageUrl", "modelVersion",
+)
+XAI_FIELDS = ("gradcam", "lime", "occlusion")
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 500
+
+
+def _normalize_report(data, fallback_report_id="", fields=None):
+    """Client-facing report record. fields limits the keys built; URLs are only built if asked for."""
+    wanted = set(fields) if fields else set(REPORT_FIELDS)
     prediction = data.get("prediction", {}) if isinstance(data.get("prediction"), dict) else {}
     xai = data.get("xai", {}) if isinstance(data.get("xai"), dict) else {}
     patient_age = data.get("patientAge")
@@ -198,7 +413,6 @@ def _normalize_report(data, fallback_report_id=""):
         confidence = 0
 
     patient_id = data.get("patientId") or data.get("patient_id")
-    inferred_xai = _infer_xai_urls_from_patient_id(patient_id)
 
     record = {
         "reportId": data.get("reportId") or fallback_report_id,
@@ -211,72 +425,46 @@ def _normalize_report(data, fallback_report_id=""):
         "updatedAt": data.get("updatedAt") or data.get("timestamp"),
         "diagnosis": prediction.get("label", data.get("diagnosis")),
         "confidence": round(confidence, 2),
-        "gradcam": xai.get("gradcam", data.get("gradcam")) or inferred_xai.get("gradcam"),
-        "lime": xai.get("lime", data.get("lime")) or inferred_xai.get("lime"),
-        "occlusion": xai.get("occlusion", data.get("occlusion")) or inferred_xai.get("occlusion"),
+        # version of the model behind the prediction (reports from before versioning have none)
+        "modelVersion": prediction.get("modelVersion"),
     }
 
-    image_filename = record.get("imageFilename")
-    if image_filename:
-        record["sourceImageUrl"] = url_for("static", filename=f"uploads/{image_filename}", _external=True)
-    else:
-        record["sourceImageUrl"] = ""
-
+    if wanted.intersection(XAI_FIELDS):
+        for key in XAI_FIELDS:
+            record[key] = xai.get(key, data.get(key))
+        # only touch the filesystem when the report itself has no XAI URLs
+        if not all(record[key] for key in XAI_FIELDS):
+            inferred_xai = _infer_xai_urls_from_patient_id(patient_id)
+            for key in XAI_FIELDS:
+                record[key] = record[key] or inferred_xai.get(key)
+
+    if "thumbnails" in wanted:
+        # small renders of the XAI images for list views (reports made before the artifact store have none)
+        record["thumbnails"] = xai.get("thumbnails") if isinstance(xai.get("thumbnails"), dict) else {}
+
+    if "sourceImageUrl" in wanted:
+        image_filename = record.get("imageFilename")
+        if image_filename:
+            record["sourceImageUrl"] = url_for("static", filename=f"uploads/{image_filename}", _external=True)
+        else:
+            record["sourceImageUrl"] = ""
+
+    if fields:
+        record = {key: record.get(key) for key in REPORT_FIELDS if key in wanted}
     return record
 
 
-def _load_reports():
-    _ensure_storage_dirs()
-    reports = []
-    try:
-        entries = os.listdir(PATIENT_FOLDER)
-    except FileNotFoundError:
-        current_app.logger.warning("Patient folder missing, returning empty history: %s", PATIENT_FOLDER)
-        return reports
-
-    for entry in entries:
-        if not entry.endswith(".json"):
-            continue
-        path = os.path.join(PATIENT_FOLDER, entry)
-        try:
-            payload = _read_json(path)
-            report_id = os.path.splitext(entry)[0]
-            reports.append(_normalize_report(payload, report_id))
-        except Exception:
-            current_app.logger.exception("Failed to parse report file: %s", path)
-    return reports
-
+def _encode_history_cursor(updated_at, report_id):
+    raw = json.dumps([updated_at, report_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
 
-def _find_latest_report_file(patient_id):
-    _ensure_storage_dirs()
-    latest_path = ""
-    latest_time = ""
 
+def _decode_history_cursor(cursor):
     try:
-        entries = os.listdir(PATIENT_FOLDER)
-    except FileNotFoundError:
-        current_app.logger.warning("Patient folder missing while resolving latest report: %s", PATIENT_FOLDER)
-        return latest_path
-
-    for entry in entries:
-        if not entry.endswith(".json"):
-            continue
-        path = os.path.join(PATIENT_FOLDER, entry)
-        try:
-            payload = _read_json(path)
-        except Exception:
-            continue
-
-        candidate_patient_id = payload.get("patientId") or payload.get("patient_id")
-        if candidate_patient_id != patient_id:
-            continue
-
-        timestamp = payload.get("updatedAt") or payload.get("createdAt") or payload.get("timestamp") or ""
-        if timestamp >= latest_time:
-            latest_time = timestamp
-            latest_path = path
-
-    return latest_path
+        updated_at, report_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(updated_at), str(report_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
 
 
 # ==== /predict: Basic prediction only ====
@@ -289,7 +477,8 @@ def predict():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
 
-    filename, file_path = _save_upload_file(file)
+    data = file.read()
+    filename, file_path, image_hash = _save_upload_bytes(data, file.filename, background=True)
 
     # Extract patient metadata (use get so missing fields don't crash)
     patient_info = {
@@ -310,6 +499,8 @@ def predict():
         "patientAge": patient_info["patientAge"],
         "patientGender": patient_info["patientGender"],
         "imageFilename": filename,
+        "originalFilename": secure_filename(file.filename),
+        "imageHash": image_hash,
         "createdAt": created_at,
         "updatedAt": created_at,
         "prediction": {},
@@ -318,26 +509,51 @@ def predict():
 
     report_path = _report_file_path(report_id)
     try:
-        _write_json(report_path, report_data)
+        _save_report(report_path, report_data)
     except Exception as e:
         app.logger.exception("Failed to write patient JSON: %s", e)
 
-    # Run prediction (wrap in try/except in case underlying model throws)
-    try:
-        result = predict_diagnosis(file_path)
-    except Exception as e:
-        app.logger.exception("Prediction error: %s", e)
-        return jsonify({'error': 'Prediction failed', 'detail': str(e)}), 500
+    # The request runs on the model version active now, even if another one is swapped in meanwhile
+    with pinned() as model_entry:
+        # Repeat submissions of the same image (same model version) are answered from cache
+        prediction_key = cache_key(image_hash, _prediction_params(), path=model_entry["path"])
+        result = prediction_cache.get(prediction_key)
+        cached = result is not None
+
+        # Run prediction (wrap in try/except in case underlying model throws)
+        if not cached:
+            try:
+                try:
+                    with span("decode"):
+                        image_array = decode_image_bytes(data)
+                except Exception as e:
+                    result = {"error": f"Could not decode image: {e}"}
+                else:
+                    with span("predict"):
+                        result = predict_diagnosis(image_array=image_array, model_path=model_entry["path"])
+            except Exception as e:
+                app.logger.exception("Prediction error: %s", e)
+                return jsonify({'error': 'Prediction failed', 'detail': str(e)}), 500
+            if "error" not in result:
+                prediction_cache.put(prediction_key, result)
 
     report_data["prediction"] = {
         "label": result.get("label"),
         "confidence": result.get("confidence"),
+        "score": result.get("score"),
+        "modelVersion": model_entry["version"],
         "predictedAt": datetime.now().isoformat(),
     }
     report_data["updatedAt"] = datetime.now().isoformat()
 
+    # only the prediction fields: an /explain finishing meanwhile may have added its images
+    def apply_prediction(payload):
+        payload["prediction"] = report_data["prediction"]
+        payload["updatedAt"] = report_data["updatedAt"]
+
     try:
-        _write_json(report_path, report_data)
+        if _update_report(report_id, apply_prediction, report_path) is None:
+            _save_report(report_path, report_data)
     except Exception:
         app.logger.exception("Failed to update report after prediction: %s", report_path)
 
@@ -346,174 +562,476 @@ def predict():
         "confidence": result.get("confidence"),
         "patientInfo": patient_info,
         "reportId": report_id,
+        "modelVersion": model_entry["version"],
+        "cached": cached,
     })
 
 
-# ==== /explain: Run explanation only ====
-# @app.route('/explain', methods=['POST'])
-# def explain():
-#     if 'file' not in request.files:
-#         return jsonify({'error': 'No file part'}), 400
+def _collect_batch_uploads():
+    """(original filename, bytes) for every image in the request; zip archives are expanded."""
+    items = []
+    unzipped_bytes = 0
+    for file in request.files.getlist('files') + request.files.getlist('file'):
+        if not file or file.filename == '':
+            continue
+        data = file.read()
+        if file.filename.lower().endswith('.zip') or zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                members = []
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                        continue
+                    if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                        continue
+                    if info.file_size > BATCH_MAX_IMAGE_MB * 1024 * 1024:
+                        raise ValueError(f"{os.path.basename(name)} is larger than {BATCH_MAX_IMAGE_MB:g} MB unzipped")
+                    unzipped_bytes += info.file_size
+                    members.append(info)
+                if len(items) + len(members) > BATCH_MAX_FILES:
+                    raise ValueError(f"Too many images (max {BATCH_MAX_FILES})")
+                if unzipped_bytes > BATCH_MAX_UNZIPPED_MB * 1024 * 1024:
+                    raise ValueError(f"Archives unzip to more than {BATCH_MAX_UNZIPPED_MB:g} MB")
+                # read() stops at the declared file_size, so the checks above hold
+                items.extend((os.path.basename(info.filename), archive.read(info)) for info in members)
+        else:
+            items.append((file.filename, data))
+        if len(items) > BATCH_MAX_FILES:
+            raise ValueError(f"Too many images (max {BATCH_MAX_FILES})")
+    return items
+
+
+def _prepare_batch_item(index, original_filename, data, model_path=None):
+    """Runs on the decode pool: store the upload, check the cache, decode on a miss."""
+    item = {"index": index, "originalFilename": original_filename}
+    try:
+        filename, _, image_hash = _save_upload_bytes(data, original_filename, background=True)
+        item.update(filename=filename, imageHash=image_hash,
+                    cacheKey=cache_key(image_hash, _prediction_params(), path=model_path))
+        item["result"] = prediction_cache.get(item["cacheKey"])
+        if item["result"] is None:
+            with span("decode"):
+                item["array"] = decode_image_bytes(data)
+    except Exception as e:
+        item["error"] = str(e)
+    return item
 
-#     file = request.files['file']
-#     # Accept both patientId and patient_id to be robust
-#     patient_id = request.form.get('patientId') or request.form.get('patient_id')
-#     if not patient_id:
-#         # return friendly error instead of KeyError
-#         return jsonify({'error': 'Missing patientId/patient_id in form data'}), 400
 
-#     if file.filename == '':
-#         return jsonify({'error': 'No file selected'}), 400
+# ==== /predict/batch: many images (or a zip) per request, results streamed as NDJSON ====
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch_route():
+    try:
+        uploads = _collect_batch_uploads()
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e)}), 400
+    if not uploads:
+        return jsonify({'error': 'No image files in request'}), 400
 
-#     filename, file_path = _save_upload_file(file)
+    # Optional JSON object mapping original filename -> per-image patient fields
+    try:
+        overrides = json.loads(request.form.get('metadata') or '{}')
+        if not isinstance(overrides, dict):
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'metadata must be a JSON object keyed by filename'}), 400
+
+    shared_info = {
+        "patientName": request.form.get('patientName'),
+        "patientId": request.form.get('patientId') or request.form.get('patient_id'),
+        "patientAge": request.form.get('patientAge'),
+        "patientGender": request.form.get('patientGender'),
+    }
 
-#     # Run explanation pipeline safely
-#     try:
-#         # generate_explanations should save output images into EXPLANATIONS_FOLDER and return relative paths or filenames
-#         xai_result = generate_explanations(file_path, patient_id, explanations_dir=EXPLANATIONS_FOLDER)
-#     except TypeError:
-#         # if your existing generate_explanations signature doesn't accept explanations_dir, call without it
-#         try:
-#             xai_result = generate_explanations(file_path, patient_id)
-#         except Exception as e:
-#             app.logger.exception("Explanation pipeline failed: %s", e)
-#             return jsonify({'error': 'Explanation failed', 'detail': str(e)}), 500
-#     except Exception as e:
-#         app.logger.exception("Explanation pipeline failed: %s", e)
-#         return jsonify({'error': 'Explanation failed', 'detail': str(e)}), 500
+    def generate():
+        # the whole batch is scored by the model version active when it started
+        with pinned() as model_entry:
+            yield from _predict_batch_lines(uploads, overrides, shared_info, model_entry)
 
+    g.stream_response = True
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
-@app.route('/explain', methods=['POST'])
-def explain():
-    try:
-        if 'file' not in request.files:
-            current_app.logger.warning("/explain called without file")
-            return jsonify({'error': 'No file part'}), 400
-
-        file = request.files['file']
-        patient_id = request.form.get('patientId') or request.form.get('patient_id')
-        if not patient_id:
-            current_app.logger.warning("/explain missing patientId; form keys: %s", list(request.form.keys()))
-            return jsonify({'error': 'Missing patientId/patient_id in form data'}), 400
-
-        if file.filename == '':
-            current_app.logger.warning("/explain called with empty filename")
-            return jsonify({'error': 'No file selected'}), 400
-
-        # Save upload
-        filename, file_path = _save_upload_file(file)
-        current_app.logger.info("Saved upload for explain: patient_id=%s filename=%s path=%s",
-                                patient_id, filename, file_path)
-
-        # Run explanation pipeline, catch errors from the model/explainer
-        try:
-            xai_result = generate_explanations(file_path, patient_id)
-        except Exception as e:
-            current_app.logger.exception("generate_explanations threw an exception")
-            return jsonify({'error': 'Explanation pipeline failed', 'detail': str(e)}), 500
-
-        # Defensive checks: ensure xai_result is a dict with required keys
-        if not xai_result or not isinstance(xai_result, dict):
-            current_app.logger.error("generate_explanations returned invalid result: %s", repr(xai_result))
-            return jsonify({'error': 'Explanation pipeline returned invalid result'}), 500
-
-        # Log result for debugging
-        current_app.logger.debug("xai_result: %s", json.dumps(xai_result))
-
-        # Normalize/resolve images to full public URLs
-        def _resolve_img_path(img_value):
-            if not img_value:
-                return None
-            if isinstance(img_value, str) and (img_value.startswith('http://') or img_value.startswith('https://')):
-                return img_value
-            # normalize backslashes
-            rel = str(img_value).replace('\\', '/').lstrip('/')
-            if rel.startswith('static/'):
-                rel = rel[len('static/'):]
-            if not rel.startswith('explanations/'):
-                rel = f"explanations/{rel}"
-            return url_for('static', filename=rel, _external=True)
 
+def _predict_batch_lines(uploads, overrides, shared_info, model_entry):
+    """NDJSON lines of /predict/batch: one per image, then a summary."""
+    reports = []
+    started = datetime.now()
+    version = model_entry["version"]
+    model_path = model_entry["path"]
+    with ThreadPoolExecutor(max_workers=max(BATCH_DECODE_WORKERS, 1)) as pool:
+        chunks = [uploads[i:i + PREDICT_BATCH_SIZE] for i in range(0, len(uploads), PREDICT_BATCH_SIZE)]
+        # decode the next chunk while the current one is being scored
+        pending = None
+        for chunk_index in range(len(chunks) + 1):
+            current = pending
+            if chunk_index < len(chunks):
+                offset = chunk_index * PREDICT_BATCH_SIZE
+                pending = [pool.submit(_prepare_batch_item, offset + i, name, data, model_path)
+                           for i, (name, data) in enumerate(chunks[chunk_index])]
+            else:
+                pending = None
+            if current is None:
+                continue
+
+            items = [future.result() for future in current]
+            misses = [item for item in items if "array" in item]
+            if misses:
+                try:
+                    with span("predict_batch"):
+                        results = predict_batch([item.pop("array") for item in misses], model_path=model_path)
+                except Exception as e:
+                    app.logger.exception("Batch prediction failed: %s", e)
+                    results = [{"error": str(e)}] * len(misses)
+                for item, result in zip(misses, results):
+                    item["result"] = result
+                    item["cached"] = False
+                    if "error" not in result:
+                        prediction_cache.put(item["cacheKey"], result)
+
+            for item in items:
+                line = {"index": item["index"], "filename": item["originalFilename"]}
+                result = item.get("result") or {}
+                error = item.get("error") or result.get("error")
+                if error:
+                    line["error"] = error
+                    yield json.dumps(line) + "\n"
+                    continue
+
+                now = datetime.now().isoformat()
+                info = dict(shared_info)
+                extra = overrides.get(item["originalFilename"])
+                if isinstance(extra, dict):
+                    info.update({key: extra[key] for key in shared_info if key in extra})
+                report_id = uuid.uuid4().hex
+                reports.append({
+                    "reportId": report_id,
+                    **info,
+                    "imageFilename": item["filename"],
+                    "originalFilename": secure_filename(item["originalFilename"]),
+                    "imageHash": item["imageHash"],
+                    "createdAt": now,
+                    "updatedAt": now,
+                    "prediction": {
+                        "label": result.get("label"),
+                        "confidence": result.get("confidence"),
+                        "score": result.get("score"),
+                        "modelVersion": version,
+                        "predictedAt": now,
+                    },
+                    "xai": {},
+                })
+                line.update({
+                    "reportId": report_id,
+                    "patientId": info["patientId"],
+                    "label": result.get("label"),
+                    "confidence": result.get("confidence"),
+                    "cached": item.get("cached", True),
+                })
+                yield json.dumps(line) + "\n"
+
+        # JSON documents written and fsynced in parallel, then published with every index
+        # row in one transaction
+        written = 0
         try:
-            gradcam_url = _resolve_img_path(xai_result.get('gradcam'))
-            lime_url = _resolve_img_path(xai_result.get('lime'))
-            occlusion_url = _resolve_img_path(xai_result.get('occlusion'))
+            paths = [_report_file_path(report["reportId"]) for report in reports]
+            written = report_store.save_many(list(zip(reports, paths)), map_fn=pool.map)
         except Exception as e:
-            current_app.logger.exception("Failed to resolve image URLs")
-            return jsonify({'error': 'Failed to build image URLs', 'detail': str(e)}), 500
-
-        # Final sanity log: check files exist (only for local debugging)
+            app.logger.exception("Failed to write batch reports: %s", e)
+
+    yield json.dumps({
+        "done": True,
+        "images": len(uploads),
+        "reportsWritten": written,
+        "modelVersion": version,
+        "seconds": round((datetime.now() - started).total_seconds(), 3),
+    }) + "\n"
+
+
+def _merge_explanation_maps(previous, current):
+    """Maps artifact holding current's maps plus those of other explainers in previous, as long
+    as both were computed for the same image; otherwise current."""
+    if not previous or not current or previous == current:
+        return current
+    old_maps = artifacts.load_arrays(previous)
+    new_maps = artifacts.load_arrays(current)
+    if old_maps is None or new_maps is None or "image" not in old_maps or "image" not in new_maps \
+            or not np.array_equal(old_maps["image"], new_maps["image"]):
+        return current
+    return artifacts.put_arrays(**{**old_maps, **new_maps})
+
+
+def _apply_explain_result(patient_id, xai_result):
+    """Resolve XAI image URLs and store them on the patient's latest report. A run of some of
+    the explainers (e.g. explainers=gradcam) only replaces theirs; the others are kept."""
+    gradcam_url = _resolve_img_path(xai_result.get('gradcam'))
+    lime_url = _resolve_img_path(xai_result.get('lime'))
+    occlusion_url = _resolve_img_path(xai_result.get('occlusion'))
+    thumbnail_urls = {key: _resolve_img_path(value)
+                      for key, value in (xai_result.get('thumbnails') or {}).items() if value}
+    urls = {"gradcam": gradcam_url, "lime": lime_url, "occlusion": occlusion_url}
+    selected = [name for name in EXPLAINERS if urls[name]]
+
+    generated_at = datetime.now().isoformat()
+
+    def apply_xai(report_payload):
+        previous = report_payload.get("xai") if isinstance(report_payload.get("xai"), dict) else {}
+        xai = {name: previous.get(name) for name in EXPLAINERS}
+        thumbnails = {name: url for name, url in (previous.get("thumbnails") or {}).items()
+                      if name not in selected}
+        for name in selected:
+            xai[name] = urls[name]
+            if thumbnail_urls.get(name):
+                thumbnails[name] = thumbnail_urls[name]
+        xai.update({
+            "thumbnails": thumbnails,
+            # raw maps for /reports/<id>/render (an artifact name, not served)
+            "maps": _merge_explanation_maps(previous.get("maps"), xai_result.get("maps")),
+            "modelVersion": xai_result.get("modelVersion"),
+            "generatedAt": generated_at,
+        })
+        report_payload["xai"] = xai
+        if xai_result.get("label") is not None:
+            if not isinstance(report_payload.get("prediction"), dict):
+                report_payload["prediction"] = {}
+            report_payload["prediction"]["label"] = xai_result.get("label")
+        if xai_result.get("confidence") is not None:
+            if not isinstance(report_payload.get("prediction"), dict):
+                report_payload["prediction"] = {}
+            report_payload["prediction"]["confidence"] = xai_result.get("confidence")
+        report_payload["updatedAt"] = datetime.now().isoformat()
+
+    latest = report_store.latest_for_patient(patient_id)
+    if latest:
+        report_id = latest[0]
         try:
-            for rel in (xai_result.get('gradcam'), xai_result.get('lime'), xai_result.get('occlusion')):
-                if rel:
-                    p = os.path.join(BASE_DIR, 'static', str(rel).replace('\\', '/').lstrip('/').replace('explanations/', 'explanations/'))
-                    current_app.logger.debug("Checking exists -> %s : %s", p, os.path.exists(p))
+            _update_report(report_id, apply_xai, latest[1] or _report_file_path(report_id))
         except Exception:
-            current_app.logger.exception("Error while checking generated files")
+            current_app.logger.exception("Failed to update report with XAI: %s", report_id)
+
+    return {
+        "label": xai_result.get("label"),
+        "confidence": xai_result.get("confidence"),
+        "gradcam": gradcam_url,
+        "lime": lime_url,
+        "occlusion": occlusion_url,
+        "thumbnails": thumbnail_urls,
+        "modelVersion": xai_result.get("modelVersion"),
+    }
 
-        report_path = _find_latest_report_file(patient_id)
-        if report_path:
-            try:
-                report_payload = _read_json(report_path)
-                report_payload["xai"] = {
-                    "gradcam": gradcam_url,
-                    "lime": lime_url,
-                    "occlusion": occlusion_url,
-                    "generatedAt": datetime.now().isoformat(),
-                }
-                if xai_result.get("label") is not None:
-                    if not isinstance(report_payload.get("prediction"), dict):
-                        report_payload["prediction"] = {}
-                    report_payload["prediction"]["label"] = xai_result.get("label")
-                if xai_result.get("confidence") is not None:
-                    if not isinstance(report_payload.get("prediction"), dict):
-                        report_payload["prediction"] = {}
-                    report_payload["prediction"]["confidence"] = xai_result.get("confidence")
-                report_payload["updatedAt"] = datetime.now().isoformat()
-                _write_json(report_path, report_payload)
-            except Exception:
-                current_app.logger.exception("Failed to update report with XAI: %s", report_path)
-
-        # Return the JSON
+
+def _stored_prediction_score(patient_id, image_hash, model_path=None):
+    """Score of an earlier /predict of this image under the same model version, if any:
+    from the prediction cache, else from the patient's latest report."""
+    cached = prediction_cache.get(cache_key(image_hash, _prediction_params(), path=model_path))
+    if cached is not None and cached.get("score") is not None:
+        return cached["score"]
+    latest = report_store.latest_for_patient(patient_id)
+    if not latest:
+        return None
+    payload = latest[2]
+    prediction = payload.get("prediction") or {}
+    if (payload.get("imageHash") == image_hash and prediction.get("score") is not None
+            and prediction.get("modelVersion") == model_version(model_path)):
+        return prediction["score"]
+    return None
+
+
+def _complete_explain_job(job, xai_result):
+    # Runs on the job queue's callback thread, outside any request; rebuild a request
+    # context from the submitting request's host so url_for(_external=True) still works.
+    with app.test_request_context(base_url=job.get("baseUrl") or "http://localhost/"):
+        current_app.logger.debug("xai_result for job %s: %s", job.get("jobId"), json.dumps(xai_result))
+        if job.get("cacheKey"):
+            files = _explanation_file_stamps(xai_result)
+            if files is not None:
+                explanation_cache.put(tuple(job["cacheKey"]), {"xaiResult": xai_result, "files": files})
+        return _apply_explain_result(job.get("patientId"), xai_result)
+
+
+_explain_queue = None
+_explain_queue_lock = threading.Lock()
+
+
+def _get_explain_queue():
+    # Created on first use (not at import) so spawned worker processes that re-import
+    # this module never start a queue of their own.
+    global _explain_queue
+    if _explain_queue is None:
+        with _explain_queue_lock:
+            if _explain_queue is None:
+                queue = ExplainJobQueue(EXPLAIN_JOBS_FOLDER, _complete_explain_job,
+                                        max_workers=EXPLAIN_WORKERS)
+                queue.recover()
+                _explain_queue = queue
+    return _explain_queue
+
+
+def _submit_explain_request():
+    """Validate an /explain upload and answer it from the explanation cache or queue a job.
+
+    Shared by /explain and /explain/stream; returns (job, None) or (None, error response).
+    """
+    if 'file' not in request.files:
+        current_app.logger.warning("%s called without file", request.path)
+        return None, (jsonify({'error': 'No file part'}), 400)
+
+    file = request.files['file']
+    patient_id = request.form.get('patientId') or request.form.get('patient_id')
+    if not patient_id:
+        current_app.logger.warning("%s missing patientId; form keys: %s", request.path, list(request.form.keys()))
+        return None, (jsonify({'error': 'Missing patientId/patient_id in form data'}), 400)
+
+    if file.filename == '':
+        current_app.logger.warning("%s called with empty filename", request.path)
+        return None, (jsonify({'error': 'No file selected'}), 400)
+
+    # Optional subset of explainers, e.g. explainers=gradcam for a quick look
+    try:
+        explainers = parse_explainers(request.form.get('explainers') or request.args.get('explainers'))
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+
+    # Archive the upload in the background; the worker gets the decoded array instead
+    data = file.read()
+    filename, file_path, image_hash = _save_upload_bytes(data, file.filename, background=True)
+    current_app.logger.info("Received upload for explain: patient_id=%s filename=%s path=%s",
+                            patient_id, filename, file_path)
+
+    # the job explains with the version active now; its worker process switches to it if needed
+    model_path = active_path()
+    key = cache_key(image_hash, explanation_params(explainers), path=model_path)
+    cached_result = _get_cached_explanation(key)
+    if cached_result is not None:
+        result = _apply_explain_result(patient_id, cached_result)
+        job = _get_explain_queue().record_completed(patient_id, file_path, {**result, "cached": True},
+                                                    image_filename=filename,
+                                                    extra={"explainers": explainers})
+        return job, None
+
+    try:
+        with span("decode"):
+            image_array = decode_image_bytes(data)
+    except Exception as e:
+        return None, (jsonify({'error': 'Could not decode image', 'detail': str(e)}), 400)
+
+    # Hand the pipeline to the worker pool; the report is updated when the job completes.
+    # The worker's stage timings come back on the job under the same trace id.
+    job = _get_explain_queue().submit(patient_id, file_path, filename, base_url=request.host_url,
+                                      extra={"imageHash": image_hash, "cacheKey": list(key),
+                                             "explainers": explainers, "traceId": g.trace.trace_id,
+                                             "modelPath": model_path, "modelVersion": model_version(model_path),
+                                             "baselineScore": _stored_prediction_score(patient_id, image_hash,
+                                                                                       model_path)},
+                                      image_array=image_array)
+    return job, None
+
+
+@app.route('/explain', methods=['POST'])
+def explain():
+    try:
+        job, error = _submit_explain_request()
+        if error is not None:
+            return error
         return jsonify({
-            "label": xai_result.get("label"),
-            "confidence": xai_result.get("confidence"),
-            "gradcam": gradcam_url,
-            "lime": lime_url,
-            "occlusion": occlusion_url
-        }), 200
+            **public_job_view(job),
+            "statusUrl": url_for("get_explain_status", job_id=job["jobId"], _external=True),
+        }), 200 if job.get("cached") else 202
 
     except Exception as e:
         # Catch any unexpected top-level failures so Flask always gets a response
         current_app.logger.exception("Unhandled exception in /explain")
         return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
 
-    # Build stable public URLs for explain images. Adjust according to how generate_explanations returns paths.
-    # Assume xai_result returns filenames like "some_gradcam.png" stored in EXPLANATIONS_FOLDER or relative paths.
-    # def _resolve_img_path(img_value):
-    #     if not img_value:
-    #         return None
-    #     # If img_value is already absolute (starts with http), return it as-is
-    #     if img_value.startswith('http://') or img_value.startswith('https://'):
-    #         return img_value
-    #     # If it's a path relative to static (e.g., "explanations/xxx.png"), create host_url-based URL
-    #     # Prefer returning a path starting with /static/ so frontend can join with backend base if needed
-    #     rel = img_value
-    #     if not rel.startswith('static/'):
-    #         rel = os.path.join('static', 'explanations', rel)
-    #     return _make_public_url(rel)
-
-    # gradcam_url = _resolve_img_path(xai_result.get('gradcam'))
-    # lime_url = _resolve_img_path(xai_result.get('lime'))
-    # occlusion_url = _resolve_img_path(xai_result.get('occlusion'))
-
-    # return jsonify({
-    #     "label": xai_result.get("label"),
-    #     "confidence": xai_result.get("confidence"),
-    #     "gradcam": gradcam_url,
-    #     "lime": lime_url,
-    #     "occlusion": occlusion_url
-    # })
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _stream_result(name, data):
+    """Client payload for a streamed explain result (label, or an explainer's image and thumbnail)."""
+    if name == "label":
+        return {"label": data.get("label"), "confidence": data.get("confidence")}
+    return {"url": _resolve_img_path(data.get("path") or data.get("url")),
+            "thumbnail": _resolve_img_path(data.get("thumbnail"))}
+
+
+# ==== /explain/stream: /explain with results pushed as server-sent events ====
+@app.route('/explain/stream', methods=['POST'])
+def explain_stream():
+    """Same form as /explain. Events: job, label, then gradcam, occlusion and lime (the selected
+    ones, in that order) as soon as each image is written, progress {explainer, done, total}
+    while LIME samples and occlusion sweeps, and finally done (the job) or error."""
+    try:
+        job, error = _submit_explain_request()
+    except Exception as e:
+        current_app.logger.exception("Unhandled exception in /explain/stream")
+        return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
+    if error is not None:
+        return error
+
+    queue = _get_explain_queue()
+    job_id = job["jobId"]
+    status_url = url_for("get_explain_status", job_id=job_id, _external=True)
+
+    def generate():
+        yield _sse("job", {"jobId": job_id, "statusUrl": status_url, "traceId": job.get("traceId"),
+                           "explainers": job.get("explainers")})
+        # results are sent in this order even if a later one finishes first
+        pending = ["label"] + [name for name in EXPLAIN_STREAM_ORDER if name in (job.get("explainers") or ())]
+        results = {}
+        seen = 0
+        last_sent = time.monotonic()
+        current = job
+        while True:
+            events = current.get("events") or []
+            for item in events[seen:]:
+                if item["event"] == "progress":
+                    yield _sse("progress", item["data"])
+                    last_sent = time.monotonic()
+                else:
+                    results[item["event"]] = item["data"]
+            seen = len(events)
+            while pending and pending[0] in results:
+                name = pending.pop(0)
+                yield _sse(name, _stream_result(name, results[name]))
+                last_sent = time.monotonic()
+            if current.get("status") in (JOB_DONE, JOB_FAILED):
+                break
+            if time.monotonic() - last_sent >= EXPLAIN_STREAM_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(EXPLAIN_STREAM_POLL_SECONDS)
+            current = queue.get(job_id)
+            if current is None:
+                yield _sse("error", {"error": "Unknown job id"})
+                return
+
+        if current.get("status") == JOB_FAILED:
+            yield _sse("error", {"error": current.get("error") or "Explanation failed"})
+            return
+        # cached answers and jobs recovered after a restart have no events; use the finished job
+        for name in pending:
+            if current.get(name) is not None:
+                yield _sse(name, _stream_result(name, current if name == "label" else
+                                                {"url": current[name],
+                                                 "thumbnail": (current.get("thumbnails") or {}).get(name)}))
+        yield _sse("done", {**public_job_view(current), "statusUrl": status_url})
+
+    g.stream_response = True
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # don't let nginx buffer the events
+    return response
+
+
+@app.route('/explain/status/<job_id>', methods=['GET'])
+def get_explain_status(job_id):
+    job = _get_explain_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    # the job's stages (measured under its traceId) go into this response's Server-Timing
+    telemetry.attach_spans(job.get("timings"))
+    return jsonify(public_job_view(job)), 200
+
 
 def _resolve_img_path(img_value):
     """
@@ -537,6 +1055,10 @@ def _resolve_img_path(img_value):
     if rel.startswith('static/'):
         rel = rel[len('static/'):]
 
+    # content-addressed artifacts (model/artifacts.py) have their own immutable route
+    if rel.startswith('artifacts/'):
+        return url_for('get_artifact', name=rel[len('artifacts/'):], _external=True)
+
     # Ensure path starts with 'explanations/'
     if not rel.startswith('explanations/'):
         rel = f"explanations/{rel}"
@@ -545,24 +1067,211 @@ def _resolve_img_path(img_value):
     return url_for('static', filename=rel, _external=True)
 
 
+# ==== /artifacts: explanation images by content hash ====
+@app.route('/artifacts/<path:name>', methods=['GET'])
+def get_artifact(name):
+    """Serve a stored explanation image. The name is the SHA-256 of the file, so the response
+    never changes: it is cached for a year as immutable and revalidates by ETag (304)."""
+    parsed = artifacts.parse_name(name)
+    path = artifacts.artifact_path(name)
+    # .npz map files are valid artifact names but stay on the server
+    if parsed is None or parsed[1] not in artifacts.MIME_TYPES or not os.path.isfile(path):
+        abort(404)
+    digest, ext = parsed
+    response = send_file(path, mimetype=artifacts.MIME_TYPES[ext], etag=digest, conditional=True,
+                         max_age=ARTIFACT_MAX_AGE_SECONDS)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def _render_params(explainer, args):
+    """Display settings for a re-render from the query string; raises ValueError."""
+    params = {}
+    if explainer == "lime":
+        if args.get("numFeatures"):
+            params["num_features"] = int(args["numFeatures"])
+            if not 1 <= params["num_features"] <= RENDER_MAX_FEATURES:
+                raise ValueError(f"numFeatures must be between 1 and {RENDER_MAX_FEATURES}")
+        return params
+    if args.get("alpha"):
+        params["alpha"] = float(args["alpha"])
+        if not 0.0 <= params["alpha"] <= 1.0:
+            raise ValueError("alpha must be between 0 and 1")
+    if args.get("colormap"):
+        if args["colormap"] not in render.COLORMAPS:
+            raise ValueError(f"Unknown colormap: {args['colormap']} (expected one of {', '.join(render.COLORMAPS)})")
+        params["colormap"] = args["colormap"]
+    return params
+
+
+# ==== /reports/<id>/render: redraw an explanation from its stored maps ====
+@app.route('/reports/<report_id>/render/<explainer>', methods=['GET'])
+def render_report_explanation(report_id, explainer):
+    """The report's gradcam/occlusion image with ?alpha= and ?colormap=, or its lime image with
+    ?numFeatures=, drawn from the maps saved when it was explained (no model call, a few ms).
+    The ETag covers the maps and the settings, so repeated views revalidate with a 304."""
+    if explainer not in EXPLAINERS:
+        return jsonify({'error': f"Unknown explainer: {explainer}"}), 404
+    try:
+        params = _render_params(explainer, request.args)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid render parameter', 'detail': str(e)}), 400
+
+    payload = report_store.get(report_id)
+    if payload is None:
+        return jsonify({'error': 'Unknown report id'}), 404
+    maps_path = (payload.get("xai") or {}).get("maps") if isinstance(payload.get("xai"), dict) else None
+    if not maps_path:
+        return jsonify({'error': 'Report has no stored explanation maps; run /explain again'}), 404
+
+    etag = hashlib.sha256(json.dumps([maps_path, explainer, params, artifacts.artifact_params()],
+                                     sort_keys=True).encode("utf-8")).hexdigest()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        maps = artifacts.load_arrays(maps_path)
+        if maps is None:
+            return jsonify({'error': 'Stored explanation maps are missing'}), 404
+        try:
+            with span("rerender"):
+                data, ext = artifacts.encode_image(render_from_maps(maps, explainer, **params))
+        except KeyError:
+            return jsonify({'error': f"Report was explained without {explainer}"}), 404
+        response = Response(data, mimetype=artifacts.MIME_TYPES.get(ext, f"image/{ext}"))
+    response.set_etag(etag)
+    # the report can be explained again, so revalidate every time (cheap with the ETag)
+    response.cache_control.no_cache = True
+    return response
+
+
+def _admin_allowed():
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN)
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+@app.route('/model/versions', methods=['GET'])
+def get_model_versions():
+    """Model versions in XAI_MODEL_DIR, the one this process serves and the last swap."""
+    return jsonify(versions_report()), 200
+
+
+@app.route('/model/activate', methods=['POST'])
+def activate_model_version():
+    """Switch to another model version without a restart. JSON/form: {"version": "<name>"}.
+
+    This process loads and warms the new version in the background and swaps it in between
+    batches; requests already running finish on the old one. Once it is active, the version is
+    written to XAI_MODEL_DIR/current, which every other worker process follows
+    (XAI_MODEL_WATCH_SECONDS); a version that fails to load is never written there. Answers 202;
+    GET /model/versions shows when the swap is done.
+    """
+    if not _admin_allowed():
+        return jsonify({'error': 'Not allowed'}), 403
+    if not MODEL_DIR:
+        return jsonify({'error': 'XAI_MODEL_DIR is not set; there are no model versions to switch to'}), 409
+    payload = request.get_json(silent=True) or request.form
+    version = str(payload.get("version") or "")
+    try:
+        version_path(version)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not activate_in_background(version, prepare=prepare_backend, select=True):
+        return jsonify({'error': 'A model swap is already running', **versions_report()}), 409
+    return jsonify(versions_report()), 202
+
+
+@app.route('/model/report', methods=['GET'])
+def get_model_report():
+    """Per-process memory/latency report for the loaded model(s) and /predict batching."""
+    report = model_report()
+    report["backend"] = backend_report()
+    report["batching"] = batching_metrics()
+    report["caches"] = cache_stats()
+    report["threads"] = threads.thread_report()
+    return jsonify(report), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text metrics for this process. Explain stages measured in the worker processes
+    are recorded here when their jobs finish."""
+    extra = []
+    for name, stats in cache_stats().items():
+        extra.append((f"xai_{name}_cache_entries", "gauge", f"Entries in the {name} cache.", stats["entries"]))
+        extra.append((f"xai_{name}_cache_hits_total", "counter", f"{name} cache hits.", stats["hits"]))
+        extra.append((f"xai_{name}_cache_misses_total", "counter", f"{name} cache misses.", stats["misses"]))
+    batching = batching_metrics()
+    if batching:
+        extra.append(("xai_microbatch_queue_depth", "gauge", "Images waiting for the /predict microbatcher.",
+                      batching["queueDepth"]))
+    return Response(telemetry.render_metrics(extra), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/patients/history', methods=['GET'])
 def get_patients_history():
-    _ensure_storage_dirs()
-    requested_patient_id = request.args.get("patientId")
-    reports = _load_reports()
+    """One page of reports, newest first.
 
-    if requested_patient_id:
-        reports = [report for report in reports if report.get("patientId") == requested_patient_id]
+    Query params: patientId, diagnosis, from/to (ISO dates, inclusive, on updatedAt),
+    minConfidence (percent), limit, cursor (nextCursor of the previous page) and
+    fields (comma-separated projection, e.g. fields=reportId,patientId,diagnosis).
+    """
+    _ensure_storage_dirs()
+    args = request.args
+    try:
+        limit = int(args.get("limit", HISTORY_DEFAULT_LIMIT))
+        min_confidence = args.get("minConfidence")
+        min_confidence = float(min_confidence) if min_confidence not in (None, "") else None
+        after = _decode_history_cursor(args["cursor"]) if args.get("cursor") else None
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameter', 'detail': str(e)}), 400
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+    fields = [f.strip() for f in args.get("fields", "").split(",") if f.strip()]
+    unknown = [f for f in fields if f not in REPORT_FIELDS]
+    if unknown:
+        return jsonify({'error': 'Unknown fields', 'detail': unknown}), 400
+
+    updated_to = args.get("to") or None
+    if updated_to and len(updated_to) == 10:
+        # bare date: include the whole day
+        updated_to = f"{updated_to}T23:59:59.999999"
+
+    # fetch one extra row to know whether another page exists
+    rows = report_store.query_reports(
+        patient_id=args.get("patientId"),
+        diagnosis=args.get("diagnosis"),
+        updated_from=args.get("from") or None,
+        updated_to=updated_to,
+        min_confidence=min_confidence,
+        after=after,
+        limit=limit + 1,
+    )
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last_report_id, last_updated_at, _ = page[-1]
+        next_cursor = _encode_history_cursor(last_updated_at, last_report_id)
 
-    reports.sort(key=lambda item: item.get("updatedAt") or item.get("createdAt") or "", reverse=True)
+    reports = []
+    for report_id, _, payload in page:
+        try:
+            reports.append(_normalize_report(payload, report_id, fields or None))
+        except Exception:
+            current_app.logger.exception("Failed to normalize report: %s", report_id)
 
     return jsonify({
         "count": len(reports),
         "reports": reports,
+        "nextCursor": next_cursor,
     }), 200
 
 
 # ==== START APP ====
+if WARMUP_ON_BOOT:
+    warm_up()
+
 print("Starting Flask App...")
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,196 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+# Finds the worker x thread layout with the best throughput on this machine. For every
+# combination it starts W worker processes, each with T threads for TensorFlow, OpenCV and BLAS
+# (model/threads.py), loads the model in each, then lets all of them run forward passes for the
+# same window and measures per-call latency. Combinations that need more threads than cores are
+# skipped unless --oversubscribe. The recommendation is the highest throughput whose p95 latency
+# is within --latency-ms (or the lowest p95 if none is).
+#
+#   python -m benchmarks.autotune --workers 1,2,4 --threads 1,2,4 --latency-ms 250
+#   python -m benchmarks.autotune --batch-size 128          # LIME/occlusion-sized batches
+#   python -m benchmarks.autotune --stand-in --seconds 3    # without the real weights
+#
+# Each worker keeps one call in flight, like a worker serving one request at a time. The model
+# is the one the app serves (XAI_MODEL_DIR/XAI_MODEL_PATH) unless --model or --stand-in is given.
+
+
+def _int_list(value):
+    return [int(part) for part in str(value).split(",") if part.strip()]
+
+
+def _percentile(values, pct):
+    return round(float(np.percentile(np.asarray(values, dtype=np.float64), pct)), 3) if values else None
+
+
+def child_main(args):
+    """One worker: load, warm up, report ready, wait for "go", run for --seconds, print samples."""
+    from model.registry import get_model
+    from model.backends import get_backend
+    from model import threads
+
+    threads.configure_process()
+    model = get_model(args.model)
+    backend = get_backend(path=args.model)
+    input_shape = tuple(dim or 1 for dim in model.input_shape[1:])
+    rng = np.random.default_rng(os.getpid())
+    batch = rng.random((args.batch_size,) + input_shape, dtype=np.float32)
+    for _ in range(3):
+        backend.predict_on_batch(batch)
+
+    print(json.dumps({"ready": os.getpid()}), flush=True)
+    sys.stdin.readline()
+    samples = []
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        backend.predict_on_batch(batch)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    print(json.dumps({"samples": samples, "threads": threads.thread_report()["applied"]}), flush=True)
+
+
+def run_layout(workers, thread_count, args, model_path):
+    """Start `workers` processes with thread_count threads each; aggregate their measurements."""
+    from model.threads import blas_environment
+
+    env = dict(os.environ)
+    for name in ("XAI_TF_INTRA_OP_THREADS", "XAI_TF_INTER_OP_THREADS", "XAI_CV2_THREADS", "XAI_BLAS_THREADS"):
+        env.pop(name, None)
+    env.update(blas_environment(thread_count))
+    env.update({"XAI_THREADS_PER_WORKER": str(thread_count), "XAI_MODEL_PATH": model_path,
+                "XAI_MODEL_DIR": "", "TF_CPP_MIN_LOG_LEVEL": "3"})
+    if args.inter_op:
+        env["XAI_TF_INTER_OP_THREADS"] = str(args.inter_op)
+    command = [sys.executable, "-m", "benchmarks.autotune", "--child", "--model", model_path,
+               "--seconds", str(args.seconds), "--batch-size", str(args.batch_size)]
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    processes = [subprocess.Popen(command, cwd=backend_dir, env=env, stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                 for _ in range(workers)]
+    try:
+        for process in processes:
+            line = process.stdout.readline()
+            if not line:
+                raise RuntimeError(f"autotune worker exited before it was ready ({workers}x{thread_count})")
+        # every worker is loaded and warm; start them together
+        for process in processes:
+            process.stdin.write("go\n")
+            process.stdin.flush()
+        reports = [json.loads(process.stdout.readline()) for process in processes]
+    except BaseException:
+        for process in processes:
+            process.kill()
+        raise
+    finally:
+        for process in processes:
+            process.wait()
+
+    samples = [value for report in reports for value in report["samples"]]
+    calls = len(samples)
+    return {
+        "workers": workers,
+        "threadsPerWorker": thread_count,
+        "totalThreads": workers * thread_count,
+        "calls": calls,
+        "imagesPerSecond": round(calls * args.batch_size / args.seconds, 2),
+        "p50Ms": _percentile(samples, 50),
+        "p95Ms": _percentile(samples, 95),
+        "p99Ms": _percentile(samples, 99),
+        "applied": reports[0].get("threads") if reports else {},
+    }
+
+
+def recommend(results, latency_ms):
+    """Best throughput within the latency target; else the lowest p95."""
+    measured = [r for r in results if r.get("calls")]
+    if not measured:
+        return None
+    within = [r for r in measured if r["p95Ms"] <= latency_ms]
+    if within:
+        best = max(within, key=lambda r: r["imagesPerSecond"])
+        reason = f"highest throughput with p95 <= {latency_ms:g} ms"
+    else:
+        best = min(measured, key=lambda r: r["p95Ms"])
+        reason = f"no layout meets p95 <= {latency_ms:g} ms; lowest p95"
+    return {
+        "workers": best["workers"],
+        "threadsPerWorker": best["threadsPerWorker"],
+        "imagesPerSecond": best["imagesPerSecond"],
+        "p95Ms": best["p95Ms"],
+        "reason": reason,
+        "environment": {"XAI_SERVE_WORKERS": str(best["workers"]),
+                        "XAI_THREADS_PER_WORKER": str(best["threadsPerWorker"])},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark worker x thread layouts for the model.")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--threads", default="1,2,4,8", help="comma-separated threads per worker")
+    parser.add_argument("--inter-op", type=int, default=0,
+                        help="TensorFlow inter-op threads per worker (default: model/threads.py's)")
+    parser.add_argument("--latency-ms", type=float, default=250.0, help="p95 latency target per call")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="images per call: 1 for /predict, XAI_LIME_BATCH_SIZE for LIME/occlusion")
+    parser.add_argument("--seconds", type=float, default=10.0, help="measurement window per layout")
+    parser.add_argument("--oversubscribe", action="store_true", help="also try workers x threads > cores")
+    parser.add_argument("--model", help="model file (default: the version the app serves)")
+    parser.add_argument("--stand-in", action="store_true", help="use benchmarks/stand_in.py's model")
+    parser.add_argument("--output", help="write the full results as JSON")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child_main(args)
+        return
+
+    if args.stand_in:
+        from benchmarks.stand_in import save_stand_in_model
+        model_path = save_stand_in_model(os.path.join(tempfile.mkdtemp(prefix="xai-autotune-"), "stand_in.keras"))
+    else:
+        from model.registry import active_path
+        model_path = os.path.abspath(args.model or active_path())
+        if not os.path.isfile(model_path):
+            sys.exit(f"Model file not found: {model_path} (pass --model or --stand-in)")
+
+    cores = os.cpu_count() or 1
+    layouts = [(w, t) for w in _int_list(args.workers) for t in _int_list(args.threads)
+               if w > 0 and t > 0 and (args.oversubscribe or w * t <= cores)]
+    if not layouts:
+        sys.exit(f"No layout fits in {cores} cores; lower --workers/--threads or pass --oversubscribe")
+
+    results = []
+    for workers, thread_count in layouts:
+        print(f"{workers} worker(s) x {thread_count} thread(s)...", file=sys.stderr, flush=True)
+        try:
+            result = run_layout(workers, thread_count, args, model_path)
+        except Exception as e:
+            result = {"workers": workers, "threadsPerWorker": thread_count, "error": str(e)}
+        print(f"  {json.dumps({k: v for k, v in result.items() if k != 'applied'})}", file=sys.stderr, flush=True)
+        results.append(result)
+
+    summary = {
+        "cpuCount": cores,
+        "model": model_path,
+        "batchSize": args.batch_size,
+        "seconds": args.seconds,
+        "latencyTargetMs": args.latency_ms,
+        "results": results,
+        "recommendation": recommend(results, args.latency_ms),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(summary, handle, indent=2)
+    print(json.dumps(summary["recommendation"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+import io
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+
+# Offline benchmark for the predict/explain hot paths. Everything runs against the stand-in
+# model from benchmarks/stand_in.py and a throwaway storage dir, so it needs neither the real
+# weights nor a GPU and never touches static/ or data/.
+#
+#   python -m benchmarks.run --output bench.json
+#   python -m benchmarks.run --save-baseline benchmarks/baseline.json
+#   python -m benchmarks.run --baseline benchmarks/baseline.json --max-slowdown 0.25
+#
+# Stage timings are per call (ms percentiles); endpoint numbers come from Flask test clients
+# driven by N threads. Baselines are only comparable on the same machine.
+
+STAGES = ("decode", "predict_diagnosis", "predict_batch", "gradcam", "lime", "occlusion",
+          "render", "generate_explanations")
+ENDPOINTS = ("/predict", "/predict/batch", "/explain")
+
+
+def _percentiles(samples):
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    return {
+        "count": int(ms.size),
+        "meanMs": round(float(ms.mean()), 3),
+        "p50Ms": round(float(np.percentile(ms, 50)), 3),
+        "p90Ms": round(float(np.percentile(ms, 90)), 3),
+        "p95Ms": round(float(np.percentile(ms, 95)), 3),
+        "p99Ms": round(float(np.percentile(ms, 99)), 3),
+        "maxMs": round(float(ms.max()), 3),
+    }
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def synthetic_images(count, size=1024, seed=0):
+    """JPEG bytes of smooth grey X-ray-sized images, all different."""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        coarse = rng.integers(0, 256, size=(16, 16), dtype=np.uint8)
+        img = Image.fromarray(coarse, "L").resize((size, size), Image.BICUBIC)
+        noisy = np.asarray(img, dtype=np.int16) + rng.integers(-8, 9, size=(size, size))
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8), "L").save(buffer, "JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def prepare_environment(workdir, seed=0):
+    """Point storage and model path at workdir and write the stand-in model.
+
+    Must run before anything from model/ or app is imported; spawned /explain workers inherit
+    the same environment.
+    """
+    from benchmarks.stand_in import save_stand_in_model
+
+    model_path = save_stand_in_model(os.path.join(workdir, "stand_in.keras"), seed)
+    os.environ["XAI_MODEL_PATH"] = model_path
+    os.environ["XAI_STORAGE_DIR"] = os.path.join(workdir, "storage")
+    # measure the work itself, not cache hits
+    os.environ["XAI_PREDICTION_CACHE_SIZE"] = "0"
+    os.environ["XAI_EXPLANATION_CACHE_SIZE"] = "0"
+    os.environ["XAI_LIME_SEGMENT_CACHE_SIZE"] = "0"
+    return model_path
+
+
+def _time_calls(fn, inputs, iterations, warmup):
+    for i in range(warmup):
+        fn(inputs[i % len(inputs)])
+    samples = []
+    for i in range(iterations):
+        item = inputs[i % len(inputs)]
+        started = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - started)
+    return _percentiles(samples)
+
+
+def run_stages(images, stages, iterations, warmup):
+    from model import render
+    from model import artifacts
+    from model.decode import decode_image_bytes, to_model_input
+    from model.registry import get_model, get_last_conv_layer_name
+    from model.backends import get_backend
+    from model.predict import predict_diagnosis, predict_batch, PREDICT_BATCH_SIZE
+    from model.explainers import (make_gradcam_heatmap, apply_lime, occlusion_sensitivity,
+                                  generate_explanations, OCCLUSION_PATCH_SIZE, OCCLUSION_STRIDE)
+
+    model = get_model()
+    backend = get_backend()
+    layer = get_last_conv_layer_name()
+    arrays = [decode_image_bytes(data) for data in images]
+    floats = [to_model_input(array) for array in arrays]
+    batches = [np.stack([arrays[(i + j) % len(arrays)] for j in range(PREDICT_BATCH_SIZE)])
+               for i in range(0, len(arrays), PREDICT_BATCH_SIZE)]
+    heatmaps = [make_gradcam_heatmap(img[np.newaxis], model, layer) for img in floats[:4]]
+    occlusion_maps = [occlusion_sensitivity(img, backend, patch_size=OCCLUSION_PATCH_SIZE,
+                                            stride=OCCLUSION_STRIDE) for img in floats[:4]]
+
+    def render_all(i):
+        # overlay + artifact encoding, as generate_explanations stores them
+        img = floats[i % len(floats)]
+        artifacts.encode_image(render.gradcam_overlay(img, heatmaps[i % len(heatmaps)]))
+        artifacts.encode_image(render.figure_heatmap_overlay(img, render.quantize_map(occlusion_maps[i % len(occlusion_maps)])))
+
+    indexes = list(range(len(images)))
+    funcs = {
+        "decode": (lambda data: decode_image_bytes(data), images),
+        "predict_diagnosis": (lambda array: predict_diagnosis(image_array=array), arrays),
+        "predict_batch": (lambda batch: predict_batch(batch), batches),
+        "gradcam": (lambda img: make_gradcam_heatmap(img[np.newaxis], model, layer), floats),
+        "lime": (lambda img: apply_lime(img, backend), floats),
+        "occlusion": (lambda img: occlusion_sensitivity(img, backend, patch_size=OCCLUSION_PATCH_SIZE,
+                                                        stride=OCCLUSION_STRIDE), floats),
+        "render": (render_all, indexes),
+        "generate_explanations": (lambda i: generate_explanations(None, f"bench-{i % 4}", image_array=arrays[i]),
+                                  indexes),
+    }
+
+    results = {}
+    for name in stages:
+        fn, inputs = funcs[name]
+        # the heavy explain stages get fewer iterations
+        count = iterations if name not in ("lime", "generate_explanations") else max(iterations // 4, 3)
+        started = time.perf_counter()
+        results[name] = _time_calls(fn, inputs, count, warmup)
+        print(f"  {name:22s} p50 {results[name]['p50Ms']:9.2f} ms  p95 {results[name]['p95Ms']:9.2f} ms  "
+              f"({time.perf_counter() - started:.1f}s)", file=sys.stderr, flush=True)
+    return results
+
+
+def _drive(concurrency, requests, send):
+    """Run send(client, i) for i in range(requests) over `concurrency` threads with their own clients."""
+    from app import app
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            try:
+                error = None if send(client, i) else f"request {i} failed"
+            except Exception as e:
+                error = str(e)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if error:
+                    errors.append(error)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "seconds": round(wall, 3),
+        "throughput": round(requests / wall, 3) if wall > 0 else 0.0,
+        **_percentiles(latencies),
+    }
+
+
+def run_endpoints(images, endpoints, concurrency_levels, requests, batch_size, explain_jobs):
+    results = {}
+    if not endpoints:
+        return results
+    from app import app
+
+    def send_predict(client, i):
+        data = images[i % len(images)]
+        response = client.post("/predict", data={"file": (io.BytesIO(data), f"bench{i}.jpg"),
+                                                 "patientId": f"bench-{i % 8}"})
+        return response.status_code == 200 and "label" in response.get_json()
+
+    def send_batch(client, i):
+        files = [(io.BytesIO(images[(i * batch_size + j) % len(images)]), f"bench{j}.jpg")
+                 for j in range(batch_size)]
+        response = client.post("/predict/batch", data={"files": files, "patientId": "bench-batch"})
+        lines = response.get_data(as_text=True).strip().splitlines()
+        return response.status_code == 200 and json.loads(lines[-1]).get("reportsWritten") == batch_size
+
+    def send_explain(client, i):
+        data = images[i % len(images)]
+        response = client.post("/explain", data={"file": (io.BytesIO(data), f"bench{i}.jpg"),
+                                                 "patientId": f"bench-{i % 8}"})
+        if response.status_code not in (200, 202):
+            return False
+        status_url = "/explain/status/" + response.get_json()["jobId"]
+        while True:
+            job = client.get(status_url).get_json()
+            if job["status"] in ("done", "failed"):
+                return job["status"] == "done"
+            time.sleep(0.05)
+
+    # one untimed request each so model load, tracing and worker start-up are excluded
+    client = app.test_client()
+    if "/predict" in endpoints:
+        send_predict(client, 0)
+        results["/predict"] = {}
+        for level in concurrency_levels:
+            results["/predict"][str(level)] = _drive(level, requests, send_predict)
+            _print_endpoint("/predict", results["/predict"][str(level)])
+    if "/predict/batch" in endpoints:
+        send_batch(client, 0)
+        stats = _drive(1, max(requests // batch_size, 2), send_batch)
+        stats["imagesPerSecond"] = round(stats["throughput"] * batch_size, 3)
+        results["/predict/batch"] = {"1": stats}
+        _print_endpoint("/predict/batch", stats)
+    if "/explain" in endpoints:
+        send_explain(client, 0)
+        results["/explain"] = {}
+        for level in concurrency_levels:
+            results["/explain"][str(level)] = _drive(level, max(explain_jobs, level), send_explain)
+            _print_endpoint("/explain", results["/explain"][str(level)])
+    return results
+
+
+def _print_endpoint(name, stats):
+    print(f"  {name:15s} x{stats['concurrency']:<3d} {stats['throughput']:9.2f} req/s  "
+          f"p50 {stats['p50Ms']:9.2f} ms  p95 {stats['p95Ms']:9.2f} ms  errors {stats['errors']}",
+          file=sys.stderr, flush=True)
+
+
+def compare(current, baseline, max_slowdown=0.2, metric="p50Ms"):
+    """Regressions of current against baseline: stage latency up, or endpoint throughput down,
+    by more than max_slowdown (0.2 = 20%)."""
+    regressions = []
+    limit = 1.0 + max_slowdown
+    for name, base in baseline.get("stages", {}).items():
+        now = current.get("stages", {}).get(name)
+        if now and base.get(metric) and now[metric] > base[metric] * limit:
+            regressions.append({"kind": "stage", "name": name, "metric": metric,
+                                "baseline": base[metric], "current": now[metric],
+                                "ratio": round(now[metric] / base[metric], 3)})
+    for endpoint, levels in baseline.get("endpoints", {}).items():
+        for level, base in levels.items():
+            now = current.get("endpoints", {}).get(endpoint, {}).get(level)
+            if now and base.get("throughput") and now["throughput"] * limit < base["throughput"]:
+                regressions.append({"kind": "endpoint", "name": endpoint, "concurrency": int(level),
+                                    "metric": "throughput", "baseline": base["throughput"],
+                                    "current": now["throughput"],
+                                    "ratio": round(now["throughput"] / base["throughput"], 3)})
+    return regressions
+
+
+def _meta(args):
+    import tensorflow as tf
+    from model.backends import INFERENCE_BACKEND
+
+    return {
+        "createdAt": datetime.now().isoformat(),
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "tensorflow": tf.__version__,
+        "cpuCount": os.cpu_count(),
+        "inferenceBackend": INFERENCE_BACKEND,
+        "iterations": args.iterations,
+        "images": args.images,
+    }
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark predict/explain stages and endpoints.")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"subset of {','.join(STAGES)}")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="subset of endpoints, or 'none'")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--images", type=int, default=16, help="distinct synthetic images to cycle through")
+    parser.add_argument("--concurrency", default="1,4,8")
+    parser.add_argument("--requests", type=int, default=64, help="requests per /predict concurrency level")
+    parser.add_argument("--batch-size", type=int, default=32, help="images per /predict/batch request")
+    parser.add_argument("--explain-jobs", type=int, default=4, help="jobs per /explain concurrency level")
+    parser.add_argument("--workdir", help="scratch dir (default: a new temp dir)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--save-baseline", help="write results JSON as a baseline")
+    parser.add_argument("--baseline", help="compare against this baseline JSON")
+    parser.add_argument("--max-slowdown", type=float, default=0.2, help="allowed slowdown before failing (0.2 = 20%%)")
+    parser.add_argument("--metric", default="p50Ms", help="stage metric compared against the baseline")
+    args = parser.parse_args(argv)
+
+    stages = [s for s in _csv(args.stages) if s in STAGES]
+    endpoints = [] if args.endpoints == "none" else [e for e in _csv(args.endpoints) if e in ENDPOINTS]
+    concurrency_levels = [int(level) for level in _csv(args.concurrency)]
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="xai-bench-")
+    prepare_environment(workdir)
+    images = synthetic_images(args.images)
+
+    print(f"Benchmarking in {workdir}", file=sys.stderr)
+    results = {"meta": _meta(args)}
+    results["stages"] = run_stages(images, stages, args.iterations, args.warmup)
+    results["endpoints"] = run_endpoints(images, endpoints, concurrency_levels, args.requests,
+                                         args.batch_size, args.explain_jobs)
+    results["peakRssBytes"] = peak_rss_bytes()
+
+    if endpoints and "/explain" in endpoints:
+        from app import _get_explain_queue
+        _get_explain_queue().shutdown()
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as handle:
+                json.dump(results, handle, indent=2)
+    print(f"Peak RSS {results['peakRssBytes'] / 2**20:.1f} MB", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        if baseline.get("meta", {}).get("host") != results["meta"]["host"]:
+            print("warning: baseline was recorded on a different host", file=sys.stderr)
+        regressions = compare(results, baseline, args.max_slowdown, args.metric)
+        for item in regressions:
+            print(f"REGRESSION {item['kind']} {item['name']}: {item['metric']} "
+                  f"{item['baseline']} -> {item['current']} (x{item['ratio']})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.max_slowdown:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
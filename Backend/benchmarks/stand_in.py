@@ -0,0 +1,27 @@
+import os
+
+# Small Keras model with the production model's interface (224x224x3 in, one sigmoid out,
+# a Conv2D as the last conv layer for Grad-CAM), so benchmarks run without the real weights.
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+def build_stand_in_model(seed=0, filters=(16, 32, 64)):
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed)
+    inputs = tf.keras.Input(shape=INPUT_SHAPE)
+    x = inputs
+    for i, count in enumerate(filters):
+        name = "last_conv" if i == len(filters) - 1 else f"conv_{i}"
+        x = tf.keras.layers.Conv2D(count, 3, strides=2, padding="same", activation="relu", name=name)(x)
+    x = tf.keras.layers.GlobalAveragePooling2D()(x)
+    outputs = tf.keras.layers.Dense(1, activation="sigmoid")(x)
+    return tf.keras.Model(inputs, outputs, name="stand_in")
+
+
+def save_stand_in_model(path, seed=0):
+    """Build the stand-in model and write it to path (a .keras file); returns path."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    build_stand_in_model(seed).save(path)
+    return path
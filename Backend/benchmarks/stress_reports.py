@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+# Concurrency stress test for report persistence. Several processes act like gunicorn workers
+# serving the same patient at once: "predict" workers create a report and then record its
+# prediction, "explain" workers attach results to the patient's latest report (the two
+# read-modify-writes /predict and /explain do), and readers keep parsing the JSON files.
+# Every applied update leaves a token in the report; the run fails if a token is missing
+# afterwards (lost update), a file could not be parsed (torn read) or a file and its
+# index row disagree.
+#
+#   python -m benchmarks.stress_reports --processes 8 --seconds 10
+#   python -m benchmarks.stress_reports --legacy    # the old plain open("w") writes, for comparison
+#
+# No model is loaded; only report_store is exercised.
+
+PATIENT_ID = "stress-patient"
+
+
+def _now():
+    return datetime.now().isoformat()
+
+
+def _legacy_write(store, payload, path):
+    # what app.py did before: truncate-and-write in place, then refresh the index row
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=4)
+    store.upsert(payload, path)
+
+
+def _predict_once(store, folder, worker, legacy):
+    report_id = uuid.uuid4().hex
+    path = os.path.join(folder, f"{report_id}.json")
+    created_at = _now()
+    report = {"reportId": report_id, "patientId": PATIENT_ID, "createdAt": created_at,
+              "updatedAt": created_at, "prediction": {}, "xai": {}, "predictTokens": [], "explainTokens": []}
+    token = f"p{worker}-{report_id[:8]}"
+    prediction = {"label": "NORMAL", "confidence": 90.0, "predictedAt": _now()}
+    if legacy:
+        _legacy_write(store, report, path)
+        report["prediction"] = prediction
+        report["predictTokens"].append(token)
+        report["updatedAt"] = _now()
+        _legacy_write(store, report, path)
+        return report_id, token
+
+    store.save(report, path)
+
+    def apply_prediction(payload):
+        payload["prediction"] = prediction
+        payload.setdefault("predictTokens", []).append(token)
+        payload["updatedAt"] = _now()
+
+    store.update(report_id, apply_prediction, path)
+    return report_id, token
+
+
+def _explain_once(store, folder, worker, legacy, sequence):
+    latest = store.latest_for_patient(PATIENT_ID)
+    if not latest:
+        return None
+    report_id, path = latest[0], latest[1] or os.path.join(folder, f"{latest[0]}.json")
+    token = f"e{worker}-{sequence}"
+
+    def apply_xai(payload):
+        payload["xai"] = {"gradcam": f"artifacts/{token}.webp", "generatedAt": _now()}
+        payload.setdefault("explainTokens", []).append(token)
+        payload["updatedAt"] = _now()
+
+    if legacy:
+        with open(path, "r", encoding="utf-8") as handle:
+            payload = json.load(handle)
+        apply_xai(payload)
+        _legacy_write(store, payload, path)
+    elif store.update(report_id, apply_xai, path) is None:
+        return None
+    return report_id, token
+
+
+def _read_all(folder):
+    torn = 0
+    for name in os.listdir(folder):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(folder, name), "r", encoding="utf-8") as handle:
+                json.load(handle)
+        except FileNotFoundError:
+            continue
+        except ValueError:
+            torn += 1
+    return torn
+
+
+def worker_main(role, worker, folder, db_path, seconds, legacy, results):
+    from report_store import ReportStore, ReportConflict
+    from model import telemetry
+
+    store = ReportStore(db_path)
+    deadline = time.monotonic() + seconds
+    applied = []
+    ops = errors = torn = reads = 0
+    sequence = 0
+    while time.monotonic() < deadline:
+        sequence += 1
+        try:
+            if role == "predict":
+                applied.append(("predict",) + _predict_once(store, folder, worker, legacy))
+            elif role == "explain":
+                item = _explain_once(store, folder, worker, legacy, sequence)
+                if item:
+                    applied.append(("explain",) + item)
+            else:
+                torn += _read_all(folder)
+                reads += 1
+                continue
+            ops += 1
+        except (ValueError, ReportConflict):
+            # legacy mode: json.load of a half-written file inside the read-modify-write
+            errors += 1
+    conflicts = telemetry.REPORT_UPDATE_CONFLICTS.value()
+    results.put({"role": role, "worker": worker, "ops": ops, "errors": errors, "torn": torn,
+                 "reads": reads, "conflicts": conflicts, "applied": applied})
+
+
+def verify(folder, db_path, applied):
+    """(lost tokens, file/index mismatches, unparseable files) once all workers have stopped."""
+    from report_store import ReportStore
+
+    store = ReportStore(db_path)
+    lost = []
+    mismatched = corrupt = 0
+    expected = {}
+    for kind, report_id, token in applied:
+        expected.setdefault(report_id, []).append((kind, token))
+    for report_id, tokens in expected.items():
+        try:
+            with open(os.path.join(folder, f"{report_id}.json"), "r", encoding="utf-8") as handle:
+                on_disk = json.load(handle)
+        except ValueError:
+            # two truncating writers interleaved; the report is gone
+            corrupt += 1
+            lost.extend((report_id, kind, token) for kind, token in tokens)
+            continue
+        if on_disk != store.get(report_id):
+            mismatched += 1
+        for kind, token in tokens:
+            if token not in on_disk.get(f"{kind}Tokens", []):
+                lost.append((report_id, kind, token))
+    return lost, mismatched, corrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hammer report writes from many processes.")
+    parser.add_argument("--processes", type=int, default=8, help="predict + explain writer processes")
+    parser.add_argument("--readers", type=int, default=2, help="processes re-reading every JSON file")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--legacy", action="store_true", help="use the old non-atomic, unversioned writes")
+    parser.add_argument("--workdir", help="scratch dir (default: a new temp dir)")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="xai-stress-")
+    folder = os.path.join(workdir, "patient_data")
+    db_path = os.path.join(workdir, "reports.sqlite3")
+    os.makedirs(folder, exist_ok=True)
+
+    from report_store import ReportStore
+    ReportStore(db_path)  # create the schema before the workers race for it
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    roles = [("predict" if i % 2 == 0 else "explain") for i in range(max(args.processes, 2))]
+    roles += ["read"] * args.readers
+    processes = [context.Process(target=worker_main,
+                                 args=(role, i, folder, db_path, args.seconds, args.legacy, results))
+                 for i, role in enumerate(roles)]
+    print(f"{len(roles)} processes for {args.seconds:.0f}s in {workdir}"
+          f"{' (legacy writes)' if args.legacy else ''}", file=sys.stderr)
+    for process in processes:
+        process.start()
+    stats = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    applied = [tuple(item) for entry in stats for item in entry["applied"]]
+    lost, mismatched, corrupt = verify(folder, db_path, applied)
+    totals = {key: sum(entry[key] for entry in stats) for key in ("ops", "errors", "torn", "reads", "conflicts")}
+    by_role = {role: sum(entry["ops"] for entry in stats if entry["role"] == role) for role in ("predict", "explain")}
+    summary = {
+        "legacy": args.legacy,
+        "predictOps": by_role["predict"],
+        "explainOps": by_role["explain"],
+        "opsPerSecond": round(totals["ops"] / args.seconds, 1),
+        "retriedConflicts": totals["conflicts"],
+        "writerErrors": totals["errors"],
+        "readerPasses": totals["reads"],
+        "tornReads": totals["torn"],
+        "lostUpdates": len(lost),
+        "fileIndexMismatches": mismatched,
+        "corruptFiles": corrupt,
+    }
+    print(json.dumps(summary, indent=2))
+    if lost or mismatched or corrupt or totals["torn"] or totals["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
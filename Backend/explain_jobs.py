@@ -0,0 +1,303 @@
+import os
+import json
+import uuid
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from model import telemetry
+
+try:
+    import fcntl
+except ImportError:  # Windows: one server process, which owns every job
+    fcntl = None
+
+# Job states persisted in <jobs_folder>/<job_id>.json
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Every queue (one per HTTP process; serve.py runs several on one jobs folder) holds an exclusive
+# lock on <jobs_folder>/owners/<token>.lock while it lives and stamps its jobs with that token.
+# recover() only takes over unfinished jobs whose owner's lock is free, i.e. whose process is
+# gone, and holds RECOVER_LOCK meanwhile so two new processes don't both take the same job.
+OWNERS_FOLDER = "owners"
+RECOVER_LOCK = "recover.lock"
+
+logger = logging.getLogger(__name__)
+
+
+def _job_path(jobs_folder, job_id):
+    return os.path.join(jobs_folder, f"{job_id}.json")
+
+
+def _write_job(path, job):
+    # replace-on-write so a status poll never sees a half-written file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(job, handle, indent=4)
+    os.replace(tmp_path, path)
+
+
+def _read_job(path):
+    with open(path, "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _lock_file(path, blocking=True):
+    """Open path and take an exclusive flock on it; None if blocking=False and it is held."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle = open(path, "a")
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return None
+    return handle
+
+
+def _init_worker():
+    # Load the shared model once per worker process instead of once per job
+    from model.registry import get_model
+    get_model()
+
+
+def _run_job(job_path, image_path, patient_id, image_array=None, baseline_score=None, image_hash=None,
+             explainers=None, model_path=None, trace_id=None):
+    """Runs inside a worker process. image_array is the decoded upload, if the request had one;
+    baseline_score is a stored /predict score for the same image and model version; model_path
+    is the model version the request was served with; trace_id is the submitting request's."""
+    from model.explainers import generate_explanations
+    from model.registry import activate, active_path
+
+    # follow the parent's model swaps; a version that has since been deleted falls back to
+    # whatever this worker serves
+    if model_path and model_path != active_path() and os.path.isfile(model_path):
+        activate(path=model_path, warm=False)
+    else:
+        model_path = None
+
+    job = None
+    try:
+        job = _read_job(job_path)
+        job["status"] = JOB_RUNNING
+        job["startedAt"] = datetime.now().isoformat()
+        job["workerPid"] = os.getpid()
+        job["events"] = []
+        _write_job(job_path, job)
+    except Exception:
+        logger.exception("Could not mark explain job running: %s", job_path)
+
+    # Partial results are appended to the job file as they arrive (read by /explain/stream);
+    # the parent is the only other writer and only writes once the job has finished.
+    events_lock = threading.Lock()
+
+    def on_event(event, data):
+        if job is None:
+            return
+        with events_lock:
+            job["events"].append({"event": event, "data": data})
+            try:
+                _write_job(job_path, job)
+            except Exception:
+                logger.exception("Could not record explain job event: %s", job_path)
+
+    # stage spans are measured here, under the submitting request's trace, and recorded by the
+    # parent, which serves /metrics
+    with telemetry.collect_spans(trace_id) as spans:
+        result = generate_explanations(image_path, patient_id, image_array=image_array,
+                                       baseline_score=baseline_score, image_hash=image_hash,
+                                       explainers=explainers, on_event=on_event, model_path=model_path)
+    if isinstance(result, dict):
+        result["timings"] = spans
+    return result
+
+
+class ExplainJobQueue:
+    """Process-pool backed /explain jobs with on-disk status.
+
+    on_complete(job, xai_result) runs in the parent process when a job succeeds and returns
+    the fields (URLs, label, confidence) to store on the finished job.
+    """
+
+    def __init__(self, jobs_folder, on_complete, max_workers=1):
+        self.jobs_folder = jobs_folder
+        self.on_complete = on_complete
+        self.max_workers = max(int(max_workers), 1)
+        self._lock = threading.Lock()
+        self._executor = None
+        os.makedirs(self.jobs_folder, exist_ok=True)
+        self.owner = {"pid": os.getpid(), "token": uuid.uuid4().hex}
+        # released by the OS when this process exits, however it exits
+        self._owner_lock = _lock_file(self._owner_lock_path(self.owner["token"]))
+
+    def _owner_lock_path(self, token):
+        return os.path.join(self.jobs_folder, OWNERS_FOLDER, f"{os.path.basename(str(token))}.lock")
+
+    def _owner_alive(self, owner):
+        token = (owner or {}).get("token")
+        if not token:
+            return False
+        if token == self.owner["token"]:
+            return True
+        if fcntl is None:
+            return False
+        path = self._owner_lock_path(token)
+        if not os.path.exists(path):
+            return False
+        handle = _lock_file(path, blocking=False)
+        if handle is None:
+            return True
+        # the owner is gone; its lock file is no longer needed
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        handle.close()
+        return False
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: TensorFlow state in the parent is not fork-safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _new_job(self, status, patient_id, image_path, image_filename, base_url, extra):
+        job = {
+            "jobId": uuid.uuid4().hex,
+            "status": status,
+            "patientId": str(patient_id),
+            "imagePath": image_path,
+            "imageFilename": image_filename,
+            "baseUrl": base_url,
+            "createdAt": datetime.now().isoformat(),
+            "owner": dict(self.owner),
+        }
+        job.update(extra or {})
+        return job
+
+    def submit(self, patient_id, image_path, image_filename=None, base_url=None, extra=None, image_array=None):
+        """Queue a job. image_array (the decoded upload) is handed to the worker directly, so the
+        job doesn't depend on image_path being written yet; recovered jobs read image_path."""
+        job = self._new_job(JOB_QUEUED, patient_id, image_path, image_filename, base_url, extra)
+        _write_job(_job_path(self.jobs_folder, job["jobId"]), job)
+        self._dispatch(job, image_array)
+        return job
+
+    def record_completed(self, patient_id, image_path, result, image_filename=None, extra=None):
+        """Persist an already-finished job (e.g. served from cache) so status polling still works."""
+        job = self._new_job(JOB_DONE, patient_id, image_path, image_filename, None, extra)
+        job["finishedAt"] = job["createdAt"]
+        job.update(result)
+        _write_job(_job_path(self.jobs_folder, job["jobId"]), job)
+        return job
+
+    def _dispatch(self, job, image_array=None):
+        path = _job_path(self.jobs_folder, job["jobId"])
+        args = (_run_job, path, job["imagePath"], job["patientId"], image_array,
+                job.get("baselineScore"), job.get("imageHash"), job.get("explainers"), job.get("modelPath"),
+                job.get("traceId"))
+        try:
+            future = self._get_executor().submit(*args)
+        except (BrokenProcessPool, RuntimeError):
+            self._reset_executor()
+            future = self._get_executor().submit(*args)
+        future.add_done_callback(lambda fut, job_id=job["jobId"]: self._finish(job_id, fut))
+
+    def _finish(self, job_id, future):
+        path = _job_path(self.jobs_folder, job_id)
+        try:
+            job = _read_job(path)
+        except Exception:
+            logger.exception("Explain job file vanished: %s", path)
+            return
+
+        job["finishedAt"] = datetime.now().isoformat()
+        try:
+            xai_result = future.result()
+            if not xai_result or not isinstance(xai_result, dict):
+                raise ValueError(f"generate_explanations returned invalid result: {xai_result!r}")
+            # the worker's spans and those of on_complete share the job's trace; /explain/status
+            # reports them in its Server-Timing header
+            with telemetry.collect_spans(job.get("traceId")) as spans:
+                telemetry.record_spans(xai_result.pop("timings", []))
+                job.update(self.on_complete(job, xai_result) or {})
+            job["timings"] = spans
+            job["status"] = JOB_DONE
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self._reset_executor()
+            logger.exception("Explain job %s failed", job_id)
+            job["status"] = JOB_FAILED
+            job["error"] = str(e)
+
+        telemetry.EXPLAIN_JOBS.inc(status=job["status"])
+        _write_job(path, job)
+
+    def get(self, job_id):
+        path = _job_path(self.jobs_folder, os.path.basename(str(job_id)))
+        if not os.path.isfile(path):
+            return None
+        return _read_job(path)
+
+    def recover(self):
+        """Re-dispatch jobs that were queued or running when their owning process stopped.
+
+        Jobs of processes that are still running (other serve.py workers) are left alone.
+        """
+        recovered = 0
+        recover_lock = _lock_file(os.path.join(self.jobs_folder, RECOVER_LOCK))
+        try:
+            for entry in os.listdir(self.jobs_folder):
+                if not entry.endswith(".json"):
+                    continue
+                path = os.path.join(self.jobs_folder, entry)
+                try:
+                    job = _read_job(path)
+                except Exception:
+                    logger.exception("Skipping unreadable explain job: %s", path)
+                    continue
+                if job.get("status") not in (JOB_QUEUED, JOB_RUNNING) or self._owner_alive(job.get("owner")):
+                    continue
+                job["status"] = JOB_QUEUED
+                job["recoveredAt"] = datetime.now().isoformat()
+                job["owner"] = dict(self.owner)
+                # written before the lock is released, so the next process sees the new owner
+                _write_job(path, job)
+                self._dispatch(job)
+                recovered += 1
+        finally:
+            recover_lock.close()
+        if recovered:
+            logger.info("Re-queued %d unfinished explain job(s)", recovered)
+        return recovered
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def public_job_view(job):
+    """Job fields safe to return to clients (no server paths)."""
+    keys = ("jobId", "status", "patientId", "createdAt", "startedAt", "finishedAt",
+            "label", "confidence", "gradcam", "lime", "occlusion", "cached", "error",
+            "thumbnails", "explainers", "traceId", "timings", "modelVersion")
+    return {key: job.get(key) for key in keys if key in job}
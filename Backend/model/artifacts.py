@@ -0,0 +1,138 @@
+import io
+import os
+import re
+import uuid
+import hashlib
+import cv2
+import numpy as np
+
+from model.cache import LRUCache
+
+# Content-addressed store for rendered explanation images. Every artifact is saved once as
+# <ARTIFACTS_DIR>/<aa>/<sha256>.<ext>, where the hash is of the encoded file. A name never
+# changes meaning, so its URL can be cached forever (Cache-Control: immutable, ETag = hash)
+# and a new study never overwrites an earlier one. The raw maps behind the images are kept the
+# same way, as one compressed .npz per explanation run, so overlays can be re-rendered later.
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))              # backend/model
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))       # backend
+STORAGE_DIR = os.path.abspath(os.environ.get("XAI_STORAGE_DIR") or PROJECT_ROOT)  # same setting as app.py
+ARTIFACTS_DIR = os.path.join(STORAGE_DIR, "artifacts")
+
+# webp (lossy at ARTIFACT_WEBP_QUALITY; 101 = lossless) or png (max zlib compression)
+ARTIFACT_FORMAT = os.environ.get("XAI_ARTIFACT_FORMAT", "webp").lower()
+ARTIFACT_WEBP_QUALITY = int(os.environ.get("XAI_ARTIFACT_WEBP_QUALITY", "90"))
+# longest side of the list-view thumbnails; 0 disables them
+THUMBNAIL_SIZE = int(os.environ.get("XAI_ARTIFACT_THUMBNAIL_SIZE", "96"))
+THUMBNAIL_WEBP_QUALITY = 80
+
+# served by /artifacts; .npz map files are only read server-side
+MIME_TYPES = {"webp": "image/webp", "png": "image/png"}
+_NAME_PATTERN = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{64})\.(webp|png|npz)$")
+
+# decoded .npz files (immutable, so never stale); re-renders of one report hit the same maps
+maps_cache = LRUCache(int(os.environ.get("XAI_MAPS_CACHE_SIZE", "32")))
+
+os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+
+
+def artifact_params():
+    """Settings that change the stored files; part of the explanation cache key."""
+    return {"artifactFormat": ARTIFACT_FORMAT, "artifactQuality": ARTIFACT_WEBP_QUALITY,
+            "thumbnailSize": THUMBNAIL_SIZE}
+
+
+def encode_image(image_rgb, fmt=None, quality=None):
+    """uint8 RGB (H, W, 3) -> (encoded bytes, extension)."""
+    fmt = (fmt or ARTIFACT_FORMAT).lower()
+    bgr = cv2.cvtColor(np.ascontiguousarray(image_rgb, dtype=np.uint8), cv2.COLOR_RGB2BGR)
+    if fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(quality or ARTIFACT_WEBP_QUALITY)]
+    elif fmt == "png":
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 9]
+    else:
+        raise ValueError(f"Unknown artifact format: {fmt}")
+    ok, encoded = cv2.imencode(f".{fmt}", bgr, params)
+    if not ok:
+        raise ValueError(f"Could not encode artifact as {fmt}")
+    return encoded.tobytes(), fmt
+
+
+def make_thumbnail(image_rgb, size=THUMBNAIL_SIZE):
+    height, width = image_rgb.shape[:2]
+    scale = size / float(max(height, width))
+    if scale >= 1.0:
+        return image_rgb
+    target = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+    return cv2.resize(image_rgb, target, interpolation=cv2.INTER_AREA)
+
+
+def put_bytes(data, ext):
+    """Store encoded bytes; returns the artifact name. Existing content is not rewritten."""
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"{digest[:2]}/{digest}.{ext}"
+    path = os.path.join(ARTIFACTS_DIR, name)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+    return name
+
+
+def put_image(image_rgb, thumbnail=True):
+    """Encode and store a rendered image (and its thumbnail).
+
+    Returns {"path": "artifacts/<name>", "thumbnail": "artifacts/<name>" or None, "bytes": n}.
+    """
+    data, ext = encode_image(image_rgb)
+    entry = {"path": f"artifacts/{put_bytes(data, ext)}", "thumbnail": None, "bytes": len(data)}
+    if thumbnail and THUMBNAIL_SIZE > 0:
+        quality = THUMBNAIL_WEBP_QUALITY if ext == "webp" else None
+        thumb_data, thumb_ext = encode_image(make_thumbnail(image_rgb), ext, quality)
+        entry["thumbnail"] = f"artifacts/{put_bytes(thumb_data, thumb_ext)}"
+    return entry
+
+
+def put_arrays(**arrays):
+    """Store named arrays as one compressed .npz; returns "artifacts/<name>"."""
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return f"artifacts/{put_bytes(buffer.getvalue(), 'npz')}"
+
+
+def load_arrays(rel):
+    """Arrays of a stored .npz ("artifacts/<name>"), or None if it is missing or invalid."""
+    name = str(rel or "").replace("\\", "/").lstrip("/")
+    if name.startswith("artifacts/"):
+        name = name[len("artifacts/"):]
+    parsed = parse_name(name)
+    if parsed is None or parsed[1] != "npz":
+        return None
+    arrays = maps_cache.get(name)
+    if arrays is None:
+        try:
+            with np.load(os.path.join(ARTIFACTS_DIR, name), allow_pickle=False) as data:
+                arrays = {key: data[key] for key in data.files}
+        except (OSError, ValueError):
+            return None
+        for value in arrays.values():
+            value.setflags(write=False)
+        maps_cache.put(name, arrays)
+    return arrays
+
+
+def parse_name(name):
+    """(digest, extension) for a valid artifact name ("ab/<sha256>.webp"), else None."""
+    match = _NAME_PATTERN.match(str(name or ""))
+    if not match or not match.group(2).startswith(match.group(1)):
+        return None
+    return match.group(2), match.group(3)
+
+
+def artifact_path(name):
+    """Absolute file path for a valid artifact name, else None (also guards against traversal)."""
+    if parse_name(name) is None:
+        return None
+    return os.path.join(ARTIFACTS_DIR, name)
@@ -0,0 +1,310 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+import numpy as np
+
+from model.registry import get_model, model_version, active_path, on_release
+from model.decode import decode_image_bytes, to_model_input
+from model.telemetry import span, observe_batch_size
+
+# Forward-pass backends for the model in the registry. Every backend has the Keras-style
+# predict_on_batch(batch) / predict(batch, batch_size, verbose), so prediction, occlusion and
+# LIME can take either a Keras model or a backend. Grad-CAM needs gradients and always runs
+# on the Keras model.
+#
+#   keras   model.predict_on_batch (reference)
+#   xla     model call wrapped in tf.function(jit_compile=True)
+#   tflite  converted flatbuffer run by the TFLite interpreter; optional dynamic-range or
+#           full int8 quantization (int8 calibrates on images from XAI_TFLITE_CALIBRATION_DIR)
+
+INFERENCE_BACKEND = os.environ.get("XAI_INFERENCE_BACKEND", "keras").lower()
+TFLITE_QUANTIZATION = os.environ.get("XAI_TFLITE_QUANTIZATION", "none").lower()  # none | dynamic | int8
+TFLITE_CALIBRATION_DIR = os.environ.get("XAI_TFLITE_CALIBRATION_DIR", "")
+TFLITE_CALIBRATION_SAMPLES = int(os.environ.get("XAI_TFLITE_CALIBRATION_SAMPLES", "200"))
+TFLITE_THREADS = int(os.environ.get("XAI_TFLITE_THREADS", "0")) or None
+
+BACKEND_NAMES = ("keras", "xla", "tflite")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif"}
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_backends = {}
+
+
+class InferenceBackend:
+    name = "base"
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict_on_batch(self, batch):
+        observe_batch_size(len(batch), self.name)
+        with span("inference"):
+            return self._forward(batch)
+
+    def _forward(self, batch):
+        raise NotImplementedError
+
+    def predict(self, batch, batch_size=32, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        outputs = [np.asarray(self.predict_on_batch(batch[i:i + batch_size]))
+                   for i in range(0, len(batch), batch_size)]
+        return np.concatenate(outputs, axis=0)
+
+    def describe(self):
+        return {"name": self.name}
+
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def _forward(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class XLABackend(InferenceBackend):
+    name = "xla"
+
+    def __init__(self, model):
+        import tensorflow as tf
+
+        super().__init__(model)
+        self._tf = tf
+        # XLA compiles once per input shape; the microbatcher only produces a few sizes
+        self._fn = tf.function(lambda x: model(x, training=False), jit_compile=True)
+
+    def _forward(self, batch):
+        batch = self._tf.convert_to_tensor(np.asarray(batch, dtype=np.float32))
+        return self._fn(batch).numpy()
+
+
+def _interpreter_class():
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def list_images(folder, limit=None):
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(root, name))
+                if limit and len(paths) >= limit:
+                    return paths
+    return paths
+
+
+def _load_image(path):
+    with open(path, "rb") as handle:
+        return to_model_input(decode_image_bytes(handle.read()))
+
+
+def convert_to_tflite(model, quantization="none", calibration_dir=None, calibration_samples=200):
+    """TFLite flatbuffer for model. int8 is full-integer post-training quantization with float I/O."""
+    import tensorflow as tf
+
+    if quantization not in ("none", "dynamic", "int8"):
+        raise ValueError(f"Unknown TFLite quantization: {quantization}")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ("dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "int8":
+        paths = list_images(calibration_dir, calibration_samples) if calibration_dir else []
+        if not paths:
+            raise ValueError("int8 quantization needs a calibration folder with images "
+                             "(XAI_TFLITE_CALIBRATION_DIR)")
+
+        def representative_dataset():
+            for path in paths:
+                yield [np.expand_dims(_load_image(path), axis=0)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+class TFLiteBackend(InferenceBackend):
+    name = "tflite"
+
+    def __init__(self, model, quantization=TFLITE_QUANTIZATION, calibration_dir=TFLITE_CALIBRATION_DIR,
+                 calibration_samples=TFLITE_CALIBRATION_SAMPLES, num_threads=TFLITE_THREADS):
+        super().__init__(model)
+        self.quantization = quantization
+        started = time.perf_counter()
+        self.flatbuffer = convert_to_tflite(model, quantization, calibration_dir, calibration_samples)
+        self.convert_seconds = time.perf_counter() - started
+        # one interpreter per backend; it is not thread-safe, so calls are serialized
+        self._lock = threading.Lock()
+        self._interpreter = _interpreter_class()(model_content=self.flatbuffer, num_threads=num_threads)
+        self._input_index = self._interpreter.get_input_details()[0]["index"]
+        self._output_index = self._interpreter.get_output_details()[0]["index"]
+        self._batch_size = None
+
+    def _forward(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(batch):
+                self._interpreter.resize_tensor_input(self._input_index, batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self._interpreter.set_tensor(self._input_index, batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "quantization": self.quantization,
+            "modelBytes": len(self.flatbuffer),
+            "convertSeconds": round(self.convert_seconds, 3),
+        }
+
+
+def build_backend(name, model, **options):
+    name = name.lower()
+    if name == "keras":
+        return KerasBackend(model)
+    if name == "xla":
+        return XLABackend(model)
+    if name == "tflite":
+        return TFLiteBackend(model, **options)
+    raise ValueError(f"Unknown inference backend: {name}")
+
+
+def get_backend(name=None, path=None):
+    """Shared backend for the registry model at path; rebuilt if that model is replaced.
+
+    A configured backend that fails to build (e.g. int8 without calibration images) is logged
+    and the Keras backend is used instead, so the app still serves.
+    """
+    name = (name or INFERENCE_BACKEND).lower()
+    path = path or active_path()
+    model = get_model(path)
+    entry = _backends.get((path, name))
+    if entry is not None and entry[0] is model:
+        return entry[1]
+    with _lock:
+        entry = _backends.get((path, name))
+        if entry is None or entry[0] is not model:
+            try:
+                backend = build_backend(name, model)
+            except Exception:
+                if name == "keras":
+                    raise
+                logger.exception("Could not build %s inference backend; using keras", name)
+                backend = KerasBackend(model)
+            entry = (model, backend)
+            _backends[(path, name)] = entry
+        return entry[1]
+
+
+@on_release
+def _drop_backends(path, model):
+    with _lock:
+        for key in [key for key in _backends if key[0] == path]:
+            del _backends[key]
+
+
+def prepare_backend(path=None):
+    """Build the configured backend for path's model and run one batch through it (used before
+    a model version is switched in, so its first request doesn't pay for tracing/conversion)."""
+    backend = get_backend(path=path)
+    input_shape = tuple(dim or 1 for dim in get_model(path).input_shape[1:])
+    backend.predict_on_batch(np.zeros((1,) + input_shape, dtype=np.float32))
+    return backend
+
+
+def backend_params():
+    """Settings that change model outputs; part of the prediction/explanation cache keys."""
+    params = {"inferenceBackend": INFERENCE_BACKEND}
+    if INFERENCE_BACKEND == "tflite":
+        params["tfliteQuantization"] = TFLITE_QUANTIZATION
+    return params
+
+
+def backend_report(path=None):
+    entry = _backends.get((path or active_path(), INFERENCE_BACKEND))
+    if entry is None:
+        return {"name": INFERENCE_BACKEND, "built": False}
+    return {**entry[1].describe(), "built": True}
+
+
+def parity_check(backends, image_paths, reference="keras", batch_size=32, path=None, **options):
+    """Compare each backend's scores and labels with the reference backend on image_paths."""
+    model = get_model(path)
+    images = np.stack([_load_image(p) for p in image_paths])
+    results = {}
+    ref_backend = build_backend(reference, model)
+    ref_backend.predict(images[:batch_size], batch_size=batch_size)  # warm-up
+    started = time.perf_counter()
+    ref_scores = ref_backend.predict(images, batch_size=batch_size)[:, 0]
+    ref_seconds = time.perf_counter() - started
+    ref_labels = ref_scores > 0.5
+
+    for name in backends:
+        backend = ref_backend if name == reference else build_backend(
+            name, model, **(options if name == "tflite" else {}))
+        backend.predict(images[:batch_size], batch_size=batch_size)
+        started = time.perf_counter()
+        scores = backend.predict(images, batch_size=batch_size)[:, 0]
+        seconds = time.perf_counter() - started
+        diff = np.abs(scores - ref_scores)
+        results[name] = {
+            **backend.describe(),
+            "images": len(image_paths),
+            "maxAbsDiff": float(diff.max()),
+            "meanAbsDiff": float(diff.mean()),
+            "labelAgreement": float(np.mean((scores > 0.5) == ref_labels)),
+            "imagesPerSecond": round(len(image_paths) / seconds, 2) if seconds > 0 else 0.0,
+            "speedup": round(ref_seconds / seconds, 2) if seconds > 0 else 0.0,
+        }
+    return {"modelVersion": model_version(path), "reference": reference, "backends": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check inference backends against the Keras reference.")
+    parser.add_argument("command", choices=["parity"])
+    parser.add_argument("--images", required=True, help="folder of sample images")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--backends", default=",".join(BACKEND_NAMES))
+    parser.add_argument("--quantization", default=TFLITE_QUANTIZATION, choices=["none", "dynamic", "int8"])
+    parser.add_argument("--calibration-dir", default=TFLITE_CALIBRATION_DIR or None,
+                        help="images for int8 calibration (defaults to --images)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-abs-diff", type=float, default=0.02)
+    parser.add_argument("--min-label-agreement", type=float, default=0.99)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    paths = list_images(args.images, args.samples)
+    if not paths:
+        parser.error(f"no images found in {args.images}")
+    report = parity_check(
+        [name.strip() for name in args.backends.split(",") if name.strip()], paths,
+        batch_size=args.batch_size, quantization=args.quantization,
+        calibration_dir=args.calibration_dir or args.images,
+        calibration_samples=args.samples,
+    )
+
+    ok = True
+    for name, result in report["backends"].items():
+        passed = (result["maxAbsDiff"] <= args.max_abs_diff
+                  and result["labelAgreement"] >= args.min_label_agreement)
+        ok = ok and passed
+        print(f"{name:8s} {'PASS' if passed else 'FAIL'}  max|diff| {result['maxAbsDiff']:.5f}  "
+              f"mean|diff| {result['meanAbsDiff']:.5f}  labels {result['labelAgreement'] * 100:.2f}%  "
+              f"{result['imagesPerSecond']} img/s ({result['speedup']}x)")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
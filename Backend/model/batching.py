@@ -0,0 +1,140 @@
+import threading
+import time
+import queue
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    return float(np.percentile(np.asarray(values, dtype=np.float64), pct))
+
+
+class MicroBatcher:
+    """Groups single-image requests into one forward pass.
+
+    Callers submit one preprocessed tensor (no batch axis) and get a Future for its output
+    row. A background thread collects queued tensors until max_batch_size is reached or
+    max_wait_ms has passed since the first one arrived, then runs predict_fn once on the
+    stacked batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0, name="predict", history=512):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._recent = deque(maxlen=history)
+        self._totals = {"batches": 0, "items": 0, "errors": 0}
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"microbatcher-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, tensor):
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError(f"MicroBatcher '{self.name}' is closed")
+            self._queue.put((np.asarray(tensor), future, time.perf_counter()))
+        return future
+
+    def predict(self, tensor, timeout=None):
+        """Blocking helper: submit one tensor and wait for its output row."""
+        return self.submit(tensor).result(timeout=timeout)
+
+    def close(self):
+        """Serve what was submitted before, then stop; later submits raise."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        items = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                return
+
+            started = time.perf_counter()
+            waits = [started - enqueued for _, _, enqueued in items]
+            try:
+                outputs = np.asarray(self.predict_fn(np.stack([tensor for tensor, _, _ in items])))
+                if len(outputs) != len(items):
+                    # zip() would leave the extra callers waiting forever
+                    raise ValueError(f"predict_fn returned {len(outputs)} rows for a batch of {len(items)}")
+                for (_, future, _), row in zip(items, outputs):
+                    future.set_result(row)
+                failed = False
+            except Exception as e:
+                logger.exception("MicroBatcher '%s' batch of %d failed", self.name, len(items))
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                failed = True
+            self._record(len(items), waits, time.perf_counter() - started, failed)
+
+    def _record(self, size, waits, inference_seconds, failed):
+        with self._stats_lock:
+            self._totals["batches"] += 1
+            self._totals["items"] += size
+            if failed:
+                self._totals["errors"] += 1
+            self._recent.append({
+                "size": size,
+                "fill": size / self.max_batch_size,
+                "maxQueueWaitMs": max(waits) * 1000.0,
+                "meanQueueWaitMs": sum(waits) / len(waits) * 1000.0,
+                "inferenceMs": inference_seconds * 1000.0,
+            })
+
+    def metrics(self):
+        """Totals plus percentiles over the most recent batches."""
+        with self._stats_lock:
+            recent = list(self._recent)
+            totals = dict(self._totals)
+        return {
+            "name": self.name,
+            "maxBatchSize": self.max_batch_size,
+            "maxWaitMs": self.max_wait * 1000.0,
+            "queueDepth": self._queue.qsize(),
+            **totals,
+            "recentBatches": len(recent),
+            "meanBatchSize": (sum(b["size"] for b in recent) / len(recent)) if recent else 0.0,
+            "meanFill": (sum(b["fill"] for b in recent) / len(recent)) if recent else 0.0,
+            "queueWaitMsP50": _percentile([b["maxQueueWaitMs"] for b in recent], 50),
+            "queueWaitMsP95": _percentile([b["maxQueueWaitMs"] for b in recent], 95),
+            "inferenceMsP50": _percentile([b["inferenceMs"] for b in recent], 50),
+            "inferenceMsP95": _percentile([b["inferenceMs"] for b in recent], 95),
+        }
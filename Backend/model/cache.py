@@ -0,0 +1,93 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+from model.registry import model_version, on_release
+
+# Per-process result caches keyed by (image hash, model version, explainer params).
+PREDICTION_CACHE_SIZE = int(os.environ.get("XAI_PREDICTION_CACHE_SIZE", "4096"))
+EXPLANATION_CACHE_SIZE = int(os.environ.get("XAI_EXPLANATION_CACHE_SIZE", "512"))
+
+
+class LRUCache:
+    """Small thread-safe LRU map with a fixed entry limit."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max(int(max_entries), 0)
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "maxEntries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+prediction_cache = LRUCache(PREDICTION_CACHE_SIZE)
+explanation_cache = LRUCache(EXPLANATION_CACHE_SIZE)
+
+
+@on_release
+def _clear_results(path, model):
+    # a version name can come back with other weights (a model file overwritten while another
+    # version served), so results don't outlive the model that computed them
+    prediction_cache.clear()
+    explanation_cache.clear()
+
+
+def cache_key(image_hash, params=None, path=None):
+    """Key for a result of path's model version (default: the active one) on image_hash.
+
+    The version is the one of the model actually loaded for path, not the file on disk: a model
+    file overwritten in place keeps its cached results until the process loads it again. Both
+    caches are emptied whenever registry.activate releases a replaced model, so a reloaded
+    version never sees results of the weights it replaced.
+    """
+    params_key = json.dumps(params or {}, sort_keys=True)
+    return (image_hash, model_version(path), params_key)
+
+
+def cache_stats():
+    return {
+        "prediction": prediction_cache.stats(),
+        "explanation": explanation_cache.stats(),
+    }
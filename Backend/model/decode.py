@@ -0,0 +1,41 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+
+# Upload decoding shared by /predict, /predict/batch and /explain: request bytes go straight
+# to a uint8 RGB array at the model's input size, so nothing is re-read from disk.
+
+TARGET_SIZE = (224, 224)  # (height, width), like load_img's target_size
+
+# Let libjpeg downscale by 1/2, 1/4 or 1/8 while decoding (never below TARGET_SIZE) before the
+# nearest resize. Pixels differ slightly from a full decode; set XAI_JPEG_DRAFT=0 to match
+# preprocess_image / score_dir.py bit for bit.
+JPEG_DRAFT = os.environ.get("XAI_JPEG_DRAFT", "1") == "1"
+
+
+def decode_params():
+    """Settings that change the decoded pixels; part of the prediction/explanation cache keys."""
+    return {"jpegDraft": JPEG_DRAFT}
+
+
+def decode_image_bytes(data, target_size=TARGET_SIZE, draft=None):
+    """Image file bytes -> (H, W, 3) uint8 RGB, resized with nearest like load_img."""
+    draft = JPEG_DRAFT if draft is None else draft
+    size = (target_size[1], target_size[0])
+    img = Image.open(io.BytesIO(data))
+    if draft and img.format == "JPEG":
+        img.draft(img.mode, size)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != size:
+        img = img.resize(size, Image.NEAREST)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def to_model_input(image_array):
+    """uint8 RGB -> float32 in [0, 1]; float arrays are assumed to be scaled already."""
+    image_array = np.asarray(image_array)
+    if image_array.dtype == np.uint8:
+        return image_array.astype(np.float32) / 255.0
+    return image_array.astype(np.float32, copy=False)
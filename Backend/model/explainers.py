@@ -138,175 +138,533 @@
 
 
 import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import tensorflow as tf
-# Use non-interactive backend for server-side image creation
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+
 import cv2
-from lime import lime_image
-from skimage.segmentation import mark_boundaries
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
+# TensorFlow, lime and scikit-image are imported in the functions that use them: app.py imports
+# this module for explanation_params/render_from_maps, and a predict-only worker should not pay
+# for them (see serve.py)
+from model.registry import pinned, on_release
+from model.backends import get_backend, backend_params
+from model import render
+from model import artifacts
+from model import fast_lime
+from model.decode import decode_params, to_model_input
+from model.telemetry import span
 
 # === GLOBAL SETTINGS ===
 XAI_VERBOSE = 0
 img_height, img_width = 224, 224
 
+# Occlusion: variants are scored in stacked batches of at most OCCLUSION_MAX_BATCH_BYTES.
+# A stride below the patch size overlaps the patches: a finer map for (patch / stride)^2 the calls
+OCCLUSION_PATCH_SIZE = 32
+OCCLUSION_STRIDE = int(os.environ.get("XAI_OCCLUSION_STRIDE", str(OCCLUSION_PATCH_SIZE)))
+if not 0 < OCCLUSION_STRIDE <= OCCLUSION_PATCH_SIZE:
+    raise ValueError(f"XAI_OCCLUSION_STRIDE must be between 1 and {OCCLUSION_PATCH_SIZE}, got {OCCLUSION_STRIDE}")
+OCCLUSION_MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+LIME_NUM_SAMPLES = 500
+LIME_NUM_FEATURES = 5
+# "fast": model/fast_lime.py with cached superpixels and batched scoring; "adaptive": same, but
+# stops sampling once the weights converge (LIME_NUM_SAMPLES is the cap); "reference": lime package
+LIME_MODE = os.environ.get("XAI_LIME_MODE", "fast").lower()
+
+# The explainers of one request run concurrently on EXPLAIN_THREADS threads. Their model calls
+# share MODEL_CALL_SLOTS slots, so parallel explainers queue for TensorFlow's intra-op pool
+# instead of oversubscribing it; segmentation, masking and rendering overlap with inference.
+EXPLAINERS = ("gradcam", "lime", "occlusion")
+EXPLAIN_THREADS = int(os.environ.get("XAI_EXPLAIN_THREADS", "3"))
+MODEL_CALL_SLOTS = int(os.environ.get("XAI_MODEL_CALL_SLOTS", "1"))
+
+# The raw maps behind the images (Grad-CAM heatmap, occlusion map, LIME superpixels and weights)
+# are kept with each run, so an overlay can be redrawn with other display settings without the model
+KEEP_EXPLANATION_MAPS = os.environ.get("XAI_KEEP_EXPLANATION_MAPS", "1") == "1"
+# display settings of the stored images; render_from_maps starts from these
+RENDER_DEFAULTS = {
+    "gradcam": {"alpha": 0.6, "colormap": "jet"},
+    "occlusion": {"alpha": 0.5, "colormap": "hot"},
+    "lime": {"numFeatures": LIME_NUM_FEATURES},
+}
+
 # compute STATIC_OUTPUT_DIR relative to this module, so it's absolute and correct
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))              # backend/model
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, ".."))       # backend
-STATIC_OUTPUT_DIR = os.path.join(PROJECT_ROOT, "static", "explanations")  # backend/static/explanations
+STORAGE_DIR = os.path.abspath(os.environ.get("XAI_STORAGE_DIR") or PROJECT_ROOT)  # same setting as app.py
+# images of reports made before the artifact store (still served from static/)
+STATIC_OUTPUT_DIR = os.path.join(STORAGE_DIR, "static", "explanations")  # backend/static/explanations
 
 os.makedirs(STATIC_OUTPUT_DIR, exist_ok=True)
 
-# Load model
-MODEL_PATH = os.path.join(CURRENT_DIR, "pneumonia_model_final.keras")
-model = load_model(MODEL_PATH)
+_model_call_slots = threading.BoundedSemaphore(max(MODEL_CALL_SLOTS, 1))
+_explain_pool = None
+_explain_pool_lock = threading.Lock()
 
-# Find last conv layer for Grad-CAM
-last_conv_layer_name = next(
-    (layer.name for layer in reversed(model.layers) if isinstance(layer, tf.keras.layers.Conv2D)),
-    None
-)
 
+def _get_explain_pool():
+    global _explain_pool
+    if _explain_pool is None:
+        with _explain_pool_lock:
+            if _explain_pool is None:
+                _explain_pool = ThreadPoolExecutor(max_workers=max(EXPLAIN_THREADS, 1),
+                                                   thread_name_prefix="explainer")
+    return _explain_pool
+
+
+class _GatedModel:
+    """Inference backend wrapper whose forward passes each take a model-call slot."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict_on_batch(self, batch):
+        with _model_call_slots:
+            return self.model.predict_on_batch(batch)
+
+    def predict(self, batch, batch_size=32, verbose=0):
+        with _model_call_slots:
+            return self.model.predict(batch, batch_size=batch_size, verbose=verbose)
+
+
+def parse_explainers(value=None):
+    """Explainer names (list or comma-separated string) in EXPLAINERS order; all of them if empty."""
+    if isinstance(value, str):
+        value = value.split(",")
+    names = {str(name).strip().lower() for name in (value or ()) if str(name).strip()}
+    unknown = names - set(EXPLAINERS)
+    if unknown:
+        raise ValueError(f"Unknown explainers: {', '.join(sorted(unknown))} (choose from {', '.join(EXPLAINERS)})")
+    return [name for name in EXPLAINERS if name in names] or list(EXPLAINERS)
+
+
+# Grad-CAM gradient functions, built and traced once per (model, layer)
+_gradcam_lock = threading.Lock()
+_gradcam_functions = {}
+
+
+def _build_gradcam_function(model, last_conv_layer_name):
+    import tensorflow as tf
 
-def make_gradcam_heatmap(img_array, model, last_conv_layer_name, pred_index=None):
     grad_model = tf.keras.models.Model(
-        [model.inputs],
+        model.inputs,
         [model.get_layer(last_conv_layer_name).output, model.output]
     )
-    with tf.GradientTape() as tape:
-        conv_output, preds = grad_model(img_array)
-        preds = tf.convert_to_tensor(preds)
-        if pred_index is None:
-            # For binary classification with single output (sigmoid), use the prediction value
-            # If prediction > 0.5, we're explaining class 1 (PNEUMONIA), else class 0 (NORMAL)
+    input_spec = tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32)
+
+    @tf.function(input_signature=[input_spec, tf.TensorSpec([], tf.int32)])
+    def gradcam(images, pred_index):
+        with tf.GradientTape() as tape:
+            conv_output, preds = grad_model(images, training=False)
             if preds.shape[-1] == 1:
-                pred_index = 0  # Single output neuron - always use index 0
+                # Single sigmoid output neuron - always explain index 0
+                class_output = preds[:, 0]
+            else:
+                # pred_index < 0 means "explain each image's top class"
+                top = tf.cast(tf.argmax(preds, axis=-1), tf.int32)
+                index = tf.where(pred_index < 0, top, tf.fill(tf.shape(top), pred_index))
+                class_output = tf.gather(preds, index, axis=1, batch_dims=1)
+
+        grads = tape.gradient(class_output, conv_output)
+        pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+        heatmaps = tf.einsum("bhwc,bc->bhw", conv_output, pooled_grads)
+        # Normalize each heatmap to [0, 1]
+        heatmaps = tf.maximum(heatmaps, 0) / (tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True) + 1e-8)
+        return heatmaps, preds
+
+    return gradcam
+
+
+def get_gradcam_function(model, last_conv_layer_name):
+    key = (id(model), last_conv_layer_name)
+    cached = _gradcam_functions.get(key)
+    if cached is not None and cached[0] is model:
+        return cached[1]
+    with _gradcam_lock:
+        cached = _gradcam_functions.get(key)
+        if cached is None or cached[0] is not model:
+            cached = (model, _build_gradcam_function(model, last_conv_layer_name))
+            _gradcam_functions[key] = cached
+        return cached[1]
+
+
+def clear_gradcam_cache(model=None):
+    with _gradcam_lock:
+        for key in list(_gradcam_functions):
+            if model is None or _gradcam_functions[key][0] is model:
+                del _gradcam_functions[key]
+
+
+@on_release
+def _drop_gradcam_functions(path, model):
+    clear_gradcam_cache(model)
+
+
+def make_gradcam_heatmaps(img_batch, model, last_conv_layer_name, pred_index=None):
+    """One Grad-CAM heatmap per image in img_batch, shape (N, h, w)."""
+    import tensorflow as tf
+
+    gradcam = get_gradcam_function(model, last_conv_layer_name)
+    images = tf.convert_to_tensor(np.asarray(img_batch, dtype=np.float32))
+    index = tf.constant(-1 if pred_index is None else int(pred_index), dtype=tf.int32)
+    heatmaps, _ = gradcam(images, index)
+    return heatmaps.numpy()
+
+
+def make_gradcam_heatmap(img_array, model, last_conv_layer_name, pred_index=None):
+    return make_gradcam_heatmaps(img_array, model, last_conv_layer_name, pred_index)[0]
+
+
+class ExplanationContext:
+    """State for one image shared by the explainers.
+
+    The unperturbed image goes through the network once: the Grad-CAM pass (forward through
+    the conv activations, then backward) yields both the heatmap and the baseline outputs that
+    the label, occlusion and LIME reuse. score is the baseline from an earlier /predict of the
+    same image and model version; when given it is used instead of the Grad-CAM outputs.
+    Without Grad-CAM (use_gradcam=False) the baseline is one forward pass through backend.
+    Safe to share between explainer threads; each pass runs at most once.
+    """
+
+    def __init__(self, img_array, model, last_conv_layer_name, score=None, image_hash=None,
+                 backend=None, use_gradcam=True):
+        self.img_array = np.asarray(img_array, dtype=np.float32)
+        self.model = model
+        self.last_conv_layer_name = last_conv_layer_name
+        self.image_hash = image_hash
+        self.backend = backend or model
+        self.use_gradcam = use_gradcam
+        self.reused_score = score is not None
+        self._outputs = None if score is None else np.array([float(score)], dtype=np.float32)
+        self._heatmap = None
+        self._lock = threading.Lock()
+
+    def _run_gradcam(self):
+        import tensorflow as tf
+
+        with self._lock:
+            if self._heatmap is not None:
+                return
+            gradcam = get_gradcam_function(self.model, self.last_conv_layer_name)
+            images = tf.convert_to_tensor(self.img_array[np.newaxis, ...])
+            with _model_call_slots:
+                heatmaps, preds = gradcam(images, tf.constant(-1, dtype=tf.int32))
+            self._heatmap = heatmaps.numpy()[0]
+            if self._outputs is None:
+                self._outputs = np.asarray(preds.numpy()[0], dtype=np.float32)
+
+    def _run_forward(self):
+        with self._lock:
+            if self._outputs is None:
+                preds = self.backend.predict_on_batch(self.img_array[np.newaxis, ...])
+                self._outputs = np.asarray(preds, dtype=np.float32)[0]
+
+    @property
+    def heatmap(self):
+        if self._heatmap is None:
+            self._run_gradcam()
+        return self._heatmap
+
+    @property
+    def outputs(self):
+        """Model outputs for the unperturbed image, shape (n_outputs,)."""
+        if self._outputs is None:
+            if self.use_gradcam:
+                self._run_gradcam()
             else:
-                pred_index = tf.argmax(preds[0]).numpy().item()
-        class_output = preds[:, pred_index]
+                self._run_forward()
+        return self._outputs
 
-    grads = tape.gradient(class_output, conv_output)
-    pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-    conv_output = conv_output[0]
-    heatmap = conv_output @ pooled_grads[..., tf.newaxis]
-    heatmap = tf.squeeze(heatmap)
-    # FIX: Properly normalize the heatmap to [0, 1] range
-    heatmap = tf.maximum(heatmap, 0) / (tf.math.reduce_max(heatmap) + 1e-8)
-    return heatmap.numpy()
+    @property
+    def score(self):
+        return float(self.outputs[0])
 
 
 def display_gradcam(original_img, heatmap, alpha=0.6):
-    # Convert heatmap to 0-255 range
-    heatmap = np.uint8(255 * heatmap)
-    
-    # Apply colormap
-    jet = plt.cm.get_cmap("jet")
-    jet_colors = jet(np.arange(256))[:, :3]
-    jet_heatmap = jet_colors[heatmap]
-    
-    # Convert to PIL image and resize to match original
-    jet_heatmap = tf.keras.preprocessing.image.array_to_img(jet_heatmap)
-    jet_heatmap = jet_heatmap.resize((original_img.shape[1], original_img.shape[0]))
-    jet_heatmap = img_to_array(jet_heatmap)
-    
-    # FIX: Convert original_img from [0, 1] to [0, 255] range for proper superimposition
-    original_img_scaled = original_img * 255.0
-    
-    # Superimpose with alpha blending
-    superimposed = jet_heatmap * alpha + original_img_scaled * (1 - alpha)
-    
-    # Ensure values are in valid range [0, 255]
-    superimposed = np.clip(superimposed, 0, 255).astype(np.uint8)
-    
-    return tf.keras.preprocessing.image.array_to_img(superimposed)
-
-
-def apply_lime(img_array, model):
+    # Jet colormap lookup + alpha blend; original_img is float RGB in [0, 1].
+    # Returns a uint8 RGB array (see model/render.py), no pyplot involved.
+    return render.gradcam_overlay(original_img, heatmap, alpha=alpha, colormap="jet")
+
+
+def lime_weights(img_array, model, mode=None, image_hash=None, baseline=None, progress=None):
+    # (segments, weights): the superpixel label image and one LIME weight per superpixel
+    # for the top predicted output.
+    # model: Keras model or inference backend (model/backends.py)
+    # baseline: outputs for the unperturbed image (ExplanationContext.outputs), so the
+    # all-superpixels sample is not scored again; progress(scored, total) follows the sampling.
+    # The reference mode ignores both.
+    mode = (mode or LIME_MODE).lower()
+    if mode in ("fast", "adaptive"):
+        result = fast_lime.explain(
+            img_array, model.predict_on_batch, num_samples=LIME_NUM_SAMPLES,
+            num_features=LIME_NUM_FEATURES, hide_color=0.0, adaptive=(mode == "adaptive"),
+            image_hash=image_hash, baseline=baseline, progress=progress,
+        )
+        return result["segments"], result["weights"]
+    if mode != "reference":
+        raise ValueError(f"Unknown LIME mode: {mode}")
+
     def predict_fn(images):
         return model.predict(np.array(images), verbose=XAI_VERBOSE)
 
+    from lime import lime_image
+
     explainer = lime_image.LimeImageExplainer(verbose=XAI_VERBOSE)
     explanation = explainer.explain_instance(
-        img_array, predict_fn, top_labels=1, hide_color=0, num_samples=500
-    )
-    lime_img, mask = explanation.get_image_and_mask(
-        explanation.top_labels[0], positive_only=True, num_features=5, hide_rest=False
+        img_array, predict_fn, top_labels=1, hide_color=0, num_samples=LIME_NUM_SAMPLES
     )
-    return mark_boundaries(lime_img, mask)
+    # local_exp lists (superpixel, weight) pairs; get_image_and_mask(positive_only=True,
+    # hide_rest=False) picks the same superpixels as fast_lime.positive_mask does from these
+    weights = np.zeros(int(explanation.segments.max()) + 1, dtype=np.float64)
+    for feature, weight in explanation.local_exp[explanation.top_labels[0]]:
+        weights[feature] = weight
+    return explanation.segments, weights
 
 
-def occlusion_sensitivity(img, model, patch_size=16):
-    orig_pred = model.predict(np.expand_dims(img, axis=0), verbose=XAI_VERBOSE)[0, 0]
-    height, width, _ = img.shape
-    sensitivity_map = np.zeros((height, width))
+def render_lime(img_array, segments, weights, num_features=LIME_NUM_FEATURES):
+    # boundaries of the num_features most positive superpixels over the image; float RGB
+    from skimage.segmentation import mark_boundaries
+
+    mask = fast_lime.positive_mask(segments, weights, num_features)
+    return mark_boundaries(img_array, mask)
+
+
+def apply_lime(img_array, model, mode=None, image_hash=None, baseline=None, progress=None):
+    # LIME image for img_array; see lime_weights for the arguments
+    segments, weights = lime_weights(img_array, model, mode=mode, image_hash=image_hash,
+                                     baseline=baseline, progress=progress)
+    return render_lime(img_array, segments, weights)
+
+
+def _occlusion_positions(height, width, stride):
+    return [(h, w) for h in range(0, height, stride) for w in range(0, width, stride)]
+
 
-    for h in range(0, height, patch_size):
-        for w in range(0, width, patch_size):
-            occluded = img.copy()
-            occluded[h:h+patch_size, w:w+patch_size, :] = 0.5
-            pred = model.predict(np.expand_dims(occluded, 0), verbose=XAI_VERBOSE)[0, 0]
-            sensitivity_map[h:h+patch_size, w:w+patch_size] = orig_pred - pred
+def _occlusion_chunk_size(img, max_batch_bytes):
+    # each occluded variant is a full float32 copy of the image
+    per_variant = max(int(img.size) * 4, 1)
+    return max(1, int(max_batch_bytes // per_variant))
 
+
+def occlusion_sensitivity(img, model, patch_size=16, stride=None, fill_value=0.5,
+                          max_batch_bytes=OCCLUSION_MAX_BATCH_BYTES, orig_pred=None, progress=None):
+    """Occlusion map scored in a few stacked forward passes instead of one predict per patch.
+
+    stride defaults to patch_size (non-overlapping grid). With a smaller stride the patches
+    overlap and every pixel gets the mean score drop of the patches that covered it.
+    orig_pred is the score of the unoccluded image if already known (ExplanationContext.score).
+    progress(done, total) is called after each scored chunk of patch positions.
+    """
+    stride = int(stride or patch_size)
+    if patch_size <= 0 or stride <= 0:
+        raise ValueError("patch_size and stride must be positive")
+
+    img = np.asarray(img, dtype=np.float32)
+    if orig_pred is None:
+        orig_pred = np.asarray(model.predict_on_batch(np.expand_dims(img, axis=0)))[0, 0]
+    height, width, _ = img.shape
+    positions = _occlusion_positions(height, width, stride)
+    chunk_size = _occlusion_chunk_size(img, max_batch_bytes)
+
+    sensitivity_map = np.zeros((height, width))
+    coverage = np.zeros((height, width))
+
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start:start + chunk_size]
+        batch = np.repeat(img[np.newaxis, ...], len(chunk), axis=0)
+        for i, (h, w) in enumerate(chunk):
+            batch[i, h:h+patch_size, w:w+patch_size, :] = fill_value
+        preds = np.asarray(model.predict_on_batch(batch))[:, 0]
+        for (h, w), pred in zip(chunk, preds):
+            sensitivity_map[h:h+patch_size, w:w+patch_size] += orig_pred - pred
+            coverage[h:h+patch_size, w:w+patch_size] += 1
+        if progress is not None:
+            progress(start + len(chunk), len(positions))
+
+    sensitivity_map /= np.maximum(coverage, 1)
     norm_map = (sensitivity_map - sensitivity_map.min()) / (sensitivity_map.max() - sensitivity_map.min() + 1e-8)
     return norm_map
 
 
-def generate_explanations(image_path, patient_id):
-    # ensure patient_id is string
-    patient_id = str(patient_id)
-    # Create per-patient subdirectory under static/explanations
-    output_dir = os.path.join(STATIC_OUTPUT_DIR, patient_id)
-    os.makedirs(output_dir, exist_ok=True)
+def explanation_params(explainers=None):
+    """Settings that change the rendered explanations; part of the explanation cache key."""
+    return {
+        "explainers": parse_explainers(explainers),
+        "occlusionPatchSize": OCCLUSION_PATCH_SIZE,
+        "occlusionStride": OCCLUSION_STRIDE,
+        "limeNumSamples": LIME_NUM_SAMPLES,
+        "limeNumFeatures": LIME_NUM_FEATURES,
+        "limeMode": LIME_MODE,
+        **artifacts.artifact_params(),
+        **decode_params(),
+        **backend_params(),
+    }
 
-    # Load and preprocess image
-    img = load_img(image_path, target_size=(img_width, img_height))
-    img_array = img_to_array(img) / 255.0
-    img_batch = np.expand_dims(img_array, axis=0)
 
-    # Prediction
-    prediction = model.predict(img_batch, verbose=XAI_VERBOSE)[0, 0]
+def render_from_maps(maps, explainer, alpha=None, colormap=None, num_features=None):
+    """Redraw one explainer's image from the maps stored with a run (artifacts.load_arrays),
+    optionally with another alpha/colormap (Grad-CAM, occlusion) or numFeatures (LIME).
+    Returns uint8 RGB; the model is not involved. KeyError if the run has no such map."""
+    defaults = RENDER_DEFAULTS[explainer]
+    img = to_model_input(maps["image"])
+    if explainer == "lime":
+        num_features = defaults["numFeatures"] if num_features is None else num_features
+        return render.figure_image(render_lime(img, maps["lime_segments"], maps["lime_weights"], num_features))
+    alpha = defaults["alpha"] if alpha is None else alpha
+    colormap = colormap or defaults["colormap"]
+    if explainer == "gradcam":
+        return render.gradcam_overlay(img, maps["gradcam"], alpha=alpha, colormap=colormap)
+    return render.figure_heatmap_overlay(img, maps["occlusion"], alpha=alpha, colormap=colormap)
+
+
+def _label_for_score(prediction):
+    """(label, confidence in percent) for a sigmoid score."""
     label = "PNEUMONIA" if prediction > 0.5 else "NORMAL"
     confidence = prediction if prediction > 0.5 else 1 - prediction
+    return label, round(float(confidence) * 100, 2)
+
+
+def generate_explanations(image_path, patient_id, image_array=None, baseline_score=None, image_hash=None,
+                          explainers=None, on_event=None, model_path=None):
+    # model_path: model version to explain with (default: the active one); the result's
+    # modelVersion names it
+    with pinned(model_path) as model_entry:
+        result = _generate_explanations(image_path, patient_id, model_entry, image_array=image_array,
+                                        baseline_score=baseline_score, image_hash=image_hash,
+                                        explainers=explainers, on_event=on_event)
+    result["modelVersion"] = model_entry["version"]
+    return result
+
+
+def _generate_explanations(image_path, patient_id, model_entry, image_array=None, baseline_score=None,
+                           image_hash=None, explainers=None, on_event=None):
+    # image_array: the upload already decoded by the request (model/decode.py); when given,
+    # image_path is not read at all
+    # baseline_score: the /predict score stored for this image and model version, if any
+    # explainers: subset of EXPLAINERS to run (e.g. "gradcam" for a quick look); default all
+    # on_event(event, data): called from the explainer threads as results become available:
+    #   "label" {label, confidence} once the prediction is known, then one event per explainer
+    #   {path, thumbnail} as its image is stored, plus "progress" {explainer, done, total} for LIME/occlusion
+    # Images go to the content-addressed artifact store (model/artifacts.py); the returned paths
+    # are "artifacts/<aa>/<sha256>.webp" names, never reused for different content. "maps" names
+    # the .npz with the raw maps (see render_from_maps).
+    selected = parse_explainers(explainers)
+    event_lock = threading.Lock()
+    label_sent = []
+    maps = {}
+
+    def emit(event, **data):
+        if on_event is not None:
+            on_event(event, data)
+
+    def announce_label():
+        with event_lock:
+            if label_sent:
+                return
+            label_sent.append(True)
+        label, confidence = _label_for_score(context.score)
+        emit("label", label=label, confidence=confidence)
+    # ensure patient_id is string
+    patient_id = str(patient_id)
 
-    # 1. Grad-CAM
-    heatmap = make_gradcam_heatmap(img_batch, model, last_conv_layer_name)
-    gradcam_img = display_gradcam(img_array, heatmap)
-    gradcam_path = os.path.join(output_dir, "gradcam.png")
-    gradcam_img.save(gradcam_path)
+    # Shared model instance from the registry (loaded once per process); forward-only passes
+    # go through the configured inference backend, Grad-CAM needs the Keras model's gradients
+    model = model_entry["model"]
+    backend = get_backend(path=model_entry["path"])
+    last_conv_layer_name = model_entry["lastConvLayerName"]
+
+    # Load and preprocess image; image_hash (of the upload) keys LIME's superpixel cache, so it is
+    # only used for the in-memory decode it was computed for
+    if image_array is None:
+        image_hash = None
+    if image_array is not None:
+        img_array = to_model_input(image_array)
+    else:
+        from tensorflow.keras.preprocessing.image import load_img, img_to_array
+
+        with span("decode"):
+            img = load_img(image_path, target_size=(img_width, img_height))
+            img_array = img_to_array(img) / 255.0
+    gated = _GatedModel(backend)
+    context = ExplanationContext(img_array, model, last_conv_layer_name, score=baseline_score,
+                                 image_hash=image_hash, backend=gated, use_gradcam="gradcam" in selected)
+
+    # 1. Grad-CAM; its forward pass also gives the prediction unless one was passed in
+    def run_gradcam():
+        with span("gradcam"):
+            heatmap = context.heatmap
+        announce_label()
+        maps["gradcam"] = np.asarray(heatmap, dtype=np.float32)
+        with span("render"):
+            entry = artifacts.put_image(display_gradcam(img_array, heatmap, alpha=RENDER_DEFAULTS["gradcam"]["alpha"]))
+        emit("gradcam", path=entry["path"], thumbnail=entry["thumbnail"])
+        return entry
 
     # 2. LIME
-    lime_vis = apply_lime(img_array, model)
-    lime_path = os.path.join(output_dir, "lime.png")
-    plt.figure(figsize=(6, 6))
-    plt.imshow(lime_vis)
-    plt.axis('off')
-    plt.savefig(lime_path, bbox_inches='tight', pad_inches=0)
-    plt.close()
+    def run_lime():
+        with span("lime"):
+            if LIME_MODE in ("fast", "adaptive"):
+                # superpixels don't need the model; segment while Grad-CAM has it
+                fast_lime.get_segments(img_array, image_hash)
+            baseline = context.outputs
+            announce_label()
+            segments, weights = lime_weights(img_array, gated, image_hash=image_hash, baseline=baseline,
+                                             progress=lambda done, total: emit("progress", explainer="lime",
+                                                                               done=done, total=total))
+        maps["lime_segments"] = segments.astype(np.uint16 if segments.max() < 2 ** 16 else np.int32)
+        maps["lime_weights"] = np.asarray(weights, dtype=np.float32)
+        with span("render"):
+            lime_vis = render_lime(img_array, segments, weights, RENDER_DEFAULTS["lime"]["numFeatures"])
+            entry = artifacts.put_image(render.figure_image(lime_vis))
+        emit("lime", path=entry["path"], thumbnail=entry["thumbnail"])
+        return entry
 
     # 3. Occlusion Sensitivity
-    occ_map = occlusion_sensitivity(img_array, model, patch_size=32)
-    plt.figure(figsize=(6, 6))
-    plt.imshow(img_array)
-    plt.imshow(occ_map, cmap='hot', alpha=0.5)
-    occlusion_path = os.path.join(output_dir, "occlusion.png")
-    plt.axis('off')
-    plt.savefig(occlusion_path, bbox_inches='tight', pad_inches=0)
-    plt.close()
-
-    # Sanity: ensure files exist
-    assert os.path.exists(gradcam_path), f"gradcam missing: {gradcam_path}"
-    assert os.path.exists(lime_path), f"lime missing: {lime_path}"
-    assert os.path.exists(occlusion_path), f"occlusion missing: {occlusion_path}"
-
-    # Return relative paths under static/ so Flask can use url_for('static', filename=...)
-    return {
+    def run_occlusion():
+        with span("occlusion"):
+            orig_pred = context.score
+            announce_label()
+            occ_map = occlusion_sensitivity(img_array, gated, patch_size=OCCLUSION_PATCH_SIZE,
+                                            stride=OCCLUSION_STRIDE, orig_pred=orig_pred,
+                                            progress=lambda done, total: emit("progress", explainer="occlusion",
+                                                                              done=done, total=total))
+        # uint8 colormap indexes: a quarter of the float size; drawn from here so redraws are exact
+        maps["occlusion"] = render.quantize_map(occ_map)
+        with span("render"):
+            entry = artifacts.put_image(render.figure_heatmap_overlay(img_array, maps["occlusion"],
+                                                                      **RENDER_DEFAULTS["occlusion"]))
+        emit("occlusion", path=entry["path"], thumbnail=entry["thumbnail"])
+        return entry
+
+    tasks = {"gradcam": run_gradcam, "lime": run_lime, "occlusion": run_occlusion}
+    if len(selected) == 1:
+        entries = {selected[0]: tasks[selected[0]]()}
+    else:
+        # copy the context so spans from the explainer threads land on the caller's trace
+        pool = _get_explain_pool()
+        futures = {name: pool.submit(contextvars.copy_context().run, tasks[name]) for name in selected}
+        entries = {name: future.result() for name, future in futures.items()}
+
+    label, confidence = _label_for_score(context.score)
+
+    maps_path = None
+    if KEEP_EXPLANATION_MAPS:
+        with span("maps"):
+            image = np.clip(np.round(img_array * 255.0), 0, 255).astype(np.uint8)
+            maps_path = artifacts.put_arrays(image=image, **maps)
+
+    # Return artifact names; app.py turns them into immutable /artifacts/... URLs
+    result = {
         "label": label,
-        "confidence": round(confidence * 100, 2),
-        "gradcam": os.path.join("explanations", patient_id, "gradcam.png"),
-        "lime": os.path.join("explanations", patient_id, "lime.png"),
-        "occlusion": os.path.join("explanations", patient_id, "occlusion.png")
+        "confidence": confidence,
+        "reusedPrediction": context.reused_score,
+        "thumbnails": {},
+        "maps": maps_path,
     }
+    for name in selected:
+        result[name] = entries[name]["path"]
+        if entries[name]["thumbnail"]:
+            result["thumbnails"][name] = entries[name]["thumbnail"]
+    return result
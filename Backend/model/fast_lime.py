@@ -0,0 +1,198 @@
+import os
+import hashlib
+import numpy as np
+
+from model.cache import LRUCache
+
+# LIME for a single image without the per-sample Python loop of lime_image:
+# superpixels are cached per image, perturbations are one boolean (samples, segments) matrix
+# expanded to pixel masks in chunks, and the model sees fixed-size batches. Defaults mirror
+# LimeImageExplainer (quickshift 4/200/0.2, cosine distance, kernel width 0.25, Ridge alpha=1).
+
+QUICKSHIFT_KERNEL_SIZE = 4
+QUICKSHIFT_MAX_DIST = 200
+QUICKSHIFT_RATIO = 0.2
+
+KERNEL_WIDTH = 0.25
+RIDGE_ALPHA = 1.0
+
+# Perturbed images scored per model call; the last chunk is padded so the batch shape never changes
+LIME_BATCH_SIZE = int(os.environ.get("XAI_LIME_BATCH_SIZE", "128"))
+
+# Adaptive mode: sample in steps of ADAPTIVE_STEP and stop once the weights move less than
+# ADAPTIVE_TOLERANCE (relative to the largest weight) and the top features are unchanged
+ADAPTIVE_STEP = int(os.environ.get("XAI_LIME_ADAPTIVE_STEP", "100"))
+ADAPTIVE_MIN_SAMPLES = int(os.environ.get("XAI_LIME_ADAPTIVE_MIN_SAMPLES", "200"))
+ADAPTIVE_TOLERANCE = float(os.environ.get("XAI_LIME_ADAPTIVE_TOLERANCE", "0.05"))
+
+segment_cache = LRUCache(int(os.environ.get("XAI_LIME_SEGMENT_CACHE_SIZE", "128")))
+
+
+def image_digest(img):
+    img = np.ascontiguousarray(img)
+    return hashlib.sha1(str(img.shape).encode("utf-8") + img.tobytes()).hexdigest()
+
+
+def get_segments(img, image_hash=None):
+    """Quickshift superpixels for img, cached by image_hash (content digest if not given)."""
+    key = (image_hash or image_digest(img), QUICKSHIFT_KERNEL_SIZE, QUICKSHIFT_MAX_DIST, QUICKSHIFT_RATIO)
+    segments = segment_cache.get(key)
+    if segments is None:
+        from skimage.segmentation import quickshift
+
+        segments = quickshift(
+            np.asarray(img),
+            kernel_size=QUICKSHIFT_KERNEL_SIZE,
+            max_dist=QUICKSHIFT_MAX_DIST,
+            ratio=QUICKSHIFT_RATIO,
+        )
+        # compact labels 0..n-1 so they index the feature columns directly
+        _, segments = np.unique(segments, return_inverse=True)
+        segments = segments.reshape(img.shape[:2]).astype(np.int32)
+        segments.setflags(write=False)
+        segment_cache.put(key, segments)
+    return segments
+
+
+def sample_masks(num_samples, num_segments, rng, include_original=True):
+    """Boolean (num_samples, num_segments) matrix; True keeps the superpixel."""
+    masks = rng.integers(0, 2, size=(num_samples, num_segments)).astype(bool)
+    if include_original and num_samples:
+        masks[0, :] = True
+    return masks
+
+
+def score_masks(img, segments, masks, predict_fn, hide_color=0.0, batch_size=LIME_BATCH_SIZE, progress=None):
+    """Model outputs (len(masks), n_outputs) for img with masked-out superpixels set to hide_color.
+
+    progress(count) is called after each model batch with the number of masks it scored.
+    """
+    img = np.asarray(img, dtype=np.float32)
+    batch = np.empty((batch_size,) + img.shape, dtype=np.float32)
+    outputs = []
+    for start in range(0, len(masks), batch_size):
+        chunk = masks[start:start + batch_size]
+        count = len(chunk)
+        pixel_keep = chunk[:, segments]  # (count, H, W)
+        np.copyto(batch[:count], img)
+        batch[:count][~pixel_keep] = hide_color
+        if count < batch_size:
+            batch[count:] = img
+        preds = np.asarray(predict_fn(batch))
+        outputs.append(preds[:count].reshape(count, -1))
+        if progress is not None:
+            progress(count)
+    return np.concatenate(outputs, axis=0)
+
+
+def _kernel_weights(masks):
+    # cosine distance of every sample to the all-ones row, then LIME's exponential kernel
+    data = masks.astype(np.float64)
+    norms = np.sqrt(data.sum(axis=1)) * np.sqrt(data.shape[1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        similarity = np.where(norms > 0, data.sum(axis=1) / norms, 0.0)
+    distances = 1.0 - similarity
+    return np.sqrt(np.exp(-(distances ** 2) / KERNEL_WIDTH ** 2))
+
+
+def weighted_ridge(data, target, sample_weight, alpha=RIDGE_ALPHA):
+    """(coef, intercept) of a Ridge fit with intercept and sample weights, as sklearn computes it."""
+    data = np.asarray(data, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    w = np.asarray(sample_weight, dtype=np.float64)
+    w_sum = w.sum()
+    x_mean = (w[:, None] * data).sum(axis=0) / w_sum
+    y_mean = (w * target).sum() / w_sum
+    xc = data - x_mean
+    yc = target - y_mean
+    gram = xc.T @ (w[:, None] * xc)
+    gram[np.diag_indices_from(gram)] += alpha
+    coef = np.linalg.solve(gram, xc.T @ (w * yc))
+    return coef, y_mean - x_mean @ coef
+
+
+def _top_positive(weights, num_features):
+    order = np.argsort(-np.abs(weights), kind="stable")
+    return [int(f) for f in order if weights[f] > 0][:num_features]
+
+
+def _fit(masks, outputs, label):
+    return weighted_ridge(masks, outputs[:, label], _kernel_weights(masks))
+
+
+def _score_initial(img, segments, masks, predict_fn, hide_color, batch_size, baseline, progress):
+    # row 0 keeps every superpixel, i.e. it is the original image; use its known outputs if given
+    if baseline is None or not len(masks):
+        return score_masks(img, segments, masks, predict_fn, hide_color, batch_size, progress)
+    first = np.asarray(baseline, dtype=np.float32).reshape(1, -1)
+    if progress is not None:
+        progress(1)
+    if len(masks) == 1:
+        return first
+    return np.concatenate([first, score_masks(img, segments, masks[1:], predict_fn, hide_color, batch_size, progress)])
+
+
+def explain(img, predict_fn, num_samples=500, num_features=5, hide_color=0.0, adaptive=False,
+            image_hash=None, batch_size=LIME_BATCH_SIZE, random_state=None, baseline=None, progress=None):
+    """LIME weights for the top predicted output of img.
+
+    baseline is the model output for img itself, if the caller already has it.
+    progress(scored, num_samples) is called as perturbed samples are scored.
+    Returns a dict with segments, label, weights (one per superpixel), intercept, numSamples
+    and converged. In adaptive mode num_samples is an upper bound.
+    """
+    rng = np.random.default_rng(random_state)
+    segments = get_segments(img, image_hash)
+    num_segments = int(segments.max()) + 1
+
+    scored = [0]
+
+    def on_batch(count):
+        scored[0] += count
+        if progress is not None:
+            progress(scored[0], num_samples)
+
+    if not adaptive:
+        masks = sample_masks(num_samples, num_segments, rng)
+        outputs = _score_initial(img, segments, masks, predict_fn, hide_color, batch_size, baseline, on_batch)
+        label = int(np.argmax(outputs[0]))
+        weights, intercept = _fit(masks, outputs, label)
+        converged = True
+    else:
+        step = max(ADAPTIVE_STEP, 1)
+        masks = sample_masks(min(max(ADAPTIVE_MIN_SAMPLES, step), num_samples), num_segments, rng)
+        outputs = _score_initial(img, segments, masks, predict_fn, hide_color, batch_size, baseline, on_batch)
+        label = int(np.argmax(outputs[0]))
+        weights, intercept = _fit(masks, outputs, label)
+        converged = False
+        while len(masks) < num_samples:
+            extra = sample_masks(min(step, num_samples - len(masks)), num_segments, rng, include_original=False)
+            masks = np.concatenate([masks, extra])
+            extra_outputs = score_masks(img, segments, extra, predict_fn, hide_color, batch_size, on_batch)
+            outputs = np.concatenate([outputs, extra_outputs])
+            new_weights, intercept = _fit(masks, outputs, label)
+            scale = max(np.abs(new_weights).max(), 1e-12)
+            change = np.abs(new_weights - weights).max() / scale
+            same_top = _top_positive(new_weights, num_features) == _top_positive(weights, num_features)
+            weights = new_weights
+            if same_top and change < ADAPTIVE_TOLERANCE:
+                converged = True
+                break
+
+    return {
+        "segments": segments,
+        "label": label,
+        "weights": weights,
+        "intercept": float(intercept),
+        "numSamples": int(len(masks)),
+        "converged": converged,
+    }
+
+
+def positive_mask(segments, weights, num_features=5):
+    """Mask of the num_features superpixels with the largest positive weight (get_image_and_mask positive_only)."""
+    mask = np.zeros(segments.shape, dtype=segments.dtype)
+    top = _top_positive(np.asarray(weights), num_features)
+    if top:
+        mask[np.isin(segments, top)] = 1
+    return mask
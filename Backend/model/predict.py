@@ -1,71 +1,115 @@
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
 import os
-from flask import Flask, request, jsonify
-from model.explainers import generate_explanations # You should have this function
-
-# Load model
-MODEL_PATH = os.path.join(os.path.dirname(__file__), 'pneumonia_model_final.keras')
-model = load_model(MODEL_PATH)
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from model.registry import active_path, on_release
+from model.backends import get_backend
+from model.batching import MicroBatcher
+from model.decode import to_model_input
 
 # Class labels
 class_labels = {0: "Normal", 1: "Pneumonia"}
 
+# Micro-batching for concurrent single-image predictions: requests arriving within
+# BATCH_MAX_WAIT_MS of each other share one forward pass of up to BATCH_MAX_SIZE images.
+MICROBATCHING = os.environ.get("XAI_MICROBATCHING", "1") == "1"
+BATCH_MAX_SIZE = int(os.environ.get("XAI_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("XAI_BATCH_MAX_WAIT_MS", "5"))
+# longest a /predict waits for its batch; a stuck batcher fails requests instead of hanging them
+BATCH_RESULT_TIMEOUT_SECONDS = float(os.environ.get("XAI_BATCH_RESULT_TIMEOUT_SECONDS", "60"))
+
+# Bulk scoring (/predict/batch): images per model call; short chunks are padded to this size
+PREDICT_BATCH_SIZE = int(os.environ.get("XAI_PREDICT_BATCH_SIZE", "32"))
+
+# One batcher per model version: a batch never mixes versions, and after a model swap the old
+# version's batcher finishes what was queued on it
+_batchers = {}
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(path=None):
+    path = path or active_path()
+    batcher = _batchers.get(path)
+    if batcher is None:
+        with _batcher_lock:
+            batcher = _batchers.get(path)
+            if batcher is None:
+                batcher = MicroBatcher(lambda batch: get_backend(path=path).predict_on_batch(batch),
+                                       max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                                       name="predict")
+                _batchers[path] = batcher
+    return batcher
+
+
+@on_release
+def _close_batcher(path, model):
+    with _batcher_lock:
+        batcher = _batchers.pop(path, None)
+    if batcher is not None:
+        batcher.close()
+
+
+def batching_metrics():
+    batcher = _batchers.get(active_path())
+    return batcher.metrics() if batcher is not None else {}
+
+
+def _predict_scores(img_tensor, path=None):
+    if MICROBATCHING:
+        try:
+            return get_batcher(path).predict(img_tensor[0], timeout=BATCH_RESULT_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            raise TimeoutError(f"No prediction within {BATCH_RESULT_TIMEOUT_SECONDS:g}s") from None
+    return get_backend(path=path).predict_on_batch(img_tensor)[0]
+
+
 def preprocess_image(img_path, target_size=(224, 224)):
+    # imported here so the serving path (in-memory decode) never needs TensorFlow's image utils
+    from tensorflow.keras.preprocessing import image
+
     img = image.load_img(img_path, target_size=target_size)
     img_array = image.img_to_array(img)
     img_array = img_array / 255.0
     img_array = np.expand_dims(img_array, axis=0)
     return img_array
 
-def predict_diagnosis(img_path):
-    try:
-        img_tensor = preprocess_image(img_path)
-        prediction = model.predict(img_tensor)[0][0]
-        predicted_class = int(prediction > 0.5)
-        confidence = float(prediction) if predicted_class == 1 else 1 - float(prediction)
-        label = class_labels[predicted_class]
-        return {
-            "label": label,
-            "confidence": round(confidence * 100, 2)
-        }
-    except Exception as e:
-        return {"error": str(e)}
-
-# Flask app and route
-app = Flask(__name__)
-
-@app.route('/explain', methods=['POST'])
-def explain_route():
-    image_file = request.files.get('image')
-    patient_id = request.form.get('patientId')
-
-    if not image_file or not patient_id:
-        return jsonify({'error': 'Missing image or patientId'}), 400
 
-    # Create directory for this patient
-    save_dir = os.path.join('static', 'patient_data', patient_id)
-    os.makedirs(save_dir, exist_ok=True)
-
-    # Save image
-    img_path = os.path.join(save_dir, image_file.filename)
-    image_file.save(img_path)
+def format_prediction(prediction):
+    prediction = float(prediction)
+    predicted_class = int(prediction > 0.5)
+    confidence = prediction if predicted_class == 1 else 1 - prediction
+    return {
+        "label": class_labels[predicted_class],
+        "confidence": round(confidence * 100, 2),
+        "score": prediction,
+    }
 
-    # Predict
-    prediction = predict_diagnosis(img_path)
 
-    # Generate explanation images
-    generate_explanations(model, img_path, save_dir)  # Saves gradcam.png, lime.png, occlusion.png
+def predict_diagnosis(img_path=None, image_array=None, model_path=None):
+    """Prediction for an image file, or for an already decoded (H, W, 3) image_array.
+    model_path picks the model version (default: the active one)."""
+    try:
+        if image_array is not None:
+            img_tensor = np.expand_dims(to_model_input(image_array), axis=0)
+        else:
+            img_tensor = preprocess_image(img_path)
+        return format_prediction(_predict_scores(img_tensor, model_path)[0])
+    except Exception as e:
+        return {"error": str(e)}
 
-    # Add image paths to response
-    response = {
-        "label": prediction["label"],
-        "confidence": prediction["confidence"],
-        "gradcam": f"/static/patient_data/{patient_id}/gradcam.png",
-        "lime": f"/static/patient_data/{patient_id}/lime.png",
-        "occlusion": f"/static/patient_data/{patient_id}/occlusion.png"
-    }
 
-    return jsonify(response)
+def predict_batch(images, batch_size=PREDICT_BATCH_SIZE, model_path=None):
+    """Predictions for a stack of images (N, H, W, 3), uint8 or preprocessed, scored in full batches."""
+    images = to_model_input(images)
+    if len(images) == 0:
+        return []
+    model = get_backend(path=model_path)
+    batch = np.zeros((batch_size,) + images.shape[1:], dtype=np.float32)
+    results = []
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        batch[:len(chunk)] = chunk
+        batch[len(chunk):] = 0
+        scores = np.asarray(model.predict_on_batch(batch))[:len(chunk)]
+        results.extend(format_prediction(score[0]) for score in scores)
+    return results
@@ -0,0 +1,430 @@
+import os
+import re
+import hashlib
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+# One model instance per path per process, shared by predict.py, explainers.py and Grad-CAM.
+#
+# Versioned models: with XAI_MODEL_DIR set, every <version>.keras (or .h5) file in that directory
+# is a model version, and the version named in its "current" file (else the last name in sort
+# order) is served. activate() loads and warms another version next to the active one, then
+# switches to it; requests pin the version they started on (pinned()), and an old version is
+# released once its last pinned request has finished. Without XAI_MODEL_DIR the single file at
+# MODEL_PATH is served and its version is a fingerprint of the file.
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get("XAI_MODEL_PATH") or os.path.join(CURRENT_DIR, "pneumonia_model_final.keras")
+MODEL_DIR = os.environ.get("XAI_MODEL_DIR", "")
+CURRENT_VERSION_FILE = "current"
+MODEL_EXTENSIONS = (".keras", ".h5")
+_VERSION_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_load_lock = threading.Lock()
+_swap_lock = threading.Lock()
+_entries = {}
+_active = {"path": None}
+_release_hooks = []
+_swap_status = {"state": "idle", "target": None, "error": None, "startedAt": None, "finishedAt": None}
+
+
+def _rss_bytes():
+    """Current resident set size of this process (0 if it can't be read)."""
+    try:
+        with open("/proc/self/statm", "r") as handle:
+            pages = int(handle.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is KB on Linux, bytes on macOS; this is peak, not current
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except Exception:
+        return 0
+
+
+def _find_last_conv_layer_name(model):
+    import tensorflow as tf
+    return next(
+        (layer.name for layer in reversed(model.layers) if isinstance(layer, tf.keras.layers.Conv2D)),
+        None
+    )
+
+
+def model_file_version(path=None):
+    """Cheap fingerprint of the model file on disk (size + mtime); None if it doesn't exist."""
+    path = path or active_path()
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    raw = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:12]
+
+
+def list_versions():
+    """Model versions in MODEL_DIR, in sort order (empty without a model directory)."""
+    if not MODEL_DIR or not os.path.isdir(MODEL_DIR):
+        return []
+    versions = []
+    for name in os.listdir(MODEL_DIR):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in MODEL_EXTENSIONS and _VERSION_PATTERN.match(stem):
+            versions.append(stem)
+    return sorted(versions)
+
+
+def version_path(version):
+    """File of a model version in MODEL_DIR; ValueError if there is no such version."""
+    version = str(version or "")
+    if MODEL_DIR and _VERSION_PATTERN.match(version):
+        for ext in MODEL_EXTENSIONS:
+            path = os.path.join(MODEL_DIR, version + ext)
+            if os.path.isfile(path):
+                return path
+    raise ValueError(f"Unknown model version: {version}")
+
+
+def selected_version():
+    """Version MODEL_DIR asks to serve: its "current" file, else the last version; None if empty."""
+    try:
+        with open(os.path.join(MODEL_DIR, CURRENT_VERSION_FILE), "r", encoding="utf-8") as handle:
+            version = handle.read().strip()
+        if version:
+            return version
+    except OSError:
+        pass
+    versions = list_versions()
+    return versions[-1] if versions else None
+
+
+def select_version(version):
+    """Point MODEL_DIR's "current" file at version, so every worker (and the next start) serves it."""
+    version_path(version)
+    path = os.path.join(MODEL_DIR, CURRENT_VERSION_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        handle.write(version + "\n")
+    os.replace(tmp_path, path)
+
+
+def _version_for_path(path):
+    stem, ext = os.path.splitext(os.path.basename(path))
+    if MODEL_DIR and os.path.dirname(os.path.abspath(path)) == os.path.abspath(MODEL_DIR) \
+            and ext.lower() in MODEL_EXTENSIONS:
+        return stem
+    return model_file_version(path)
+
+
+def active_path():
+    """Path of the model new requests are served with."""
+    path = _active["path"]
+    if path is None:
+        with _lock:
+            if _active["path"] is None:
+                version = selected_version() if MODEL_DIR else None
+                try:
+                    _active["path"] = version_path(version) if version else MODEL_PATH
+                except ValueError:
+                    logger.error("Model version %r is not in %s; serving %s", version, MODEL_DIR, MODEL_PATH)
+                    _active["path"] = MODEL_PATH
+            path = _active["path"]
+    return path
+
+
+def _new_entry(model, path, load_seconds=0.0, rss_before=0, rss_after=0, version=None):
+    return {
+        "path": path,
+        "model": model,
+        "version": version or f"mem-{id(model):x}",
+        "lastConvLayerName": _find_last_conv_layer_name(model),
+        "loadedAt": time.time(),
+        "loadSeconds": load_seconds,
+        "rssBeforeLoad": rss_before,
+        "rssAfterLoad": rss_after,
+        "warmup": {},
+        "pins": 0,
+    }
+
+
+def _load(path):
+    from model.threads import configure_tensorflow
+    # the first TensorFlow work in this process; thread pools can only be sized before it
+    configure_tensorflow()
+    from tensorflow.keras.models import load_model
+
+    rss_before = _rss_bytes()
+    version = _version_for_path(path)
+    started = time.perf_counter()
+    model = load_model(path)
+    load_seconds = time.perf_counter() - started
+    entry = _new_entry(model, path, load_seconds, rss_before, _rss_bytes(), version)
+    logger.info("Loaded model %s in %.2fs (rss %.1f MB -> %.1f MB)", path, load_seconds,
+                rss_before / 2**20, entry["rssAfterLoad"] / 2**20)
+    return entry
+
+
+def _get_entry(path=None):
+    path = path or active_path()
+    entry = _entries.get(path)
+    if entry is not None:
+        return entry
+    # loads happen outside _lock, so a version loading in the background never blocks requests
+    with _load_lock:
+        entry = _entries.get(path)
+        if entry is None:
+            entry = _load(path)
+            with _lock:
+                _entries[path] = entry
+        return entry
+
+
+def get_model(path=None):
+    """Return the shared model for path (default: the active version), loading it on first use."""
+    return _get_entry(path)["model"]
+
+
+def get_last_conv_layer_name(path=None):
+    return _get_entry(path)["lastConvLayerName"]
+
+
+def set_model(model, path=None):
+    """Register an already-built model under path (stand-in models, benchmarks)."""
+    with _lock:
+        path = path or active_path()
+        _entries[path] = _new_entry(model, path)
+    return model
+
+
+def model_version(path=None):
+    """Version of the model this process serves for path; the file's version if not loaded yet."""
+    path = path or active_path()
+    entry = _entries.get(path)
+    if entry is not None:
+        return entry["version"]
+    return _version_for_path(path)
+
+
+def is_loaded(path=None):
+    return (path or active_path()) in _entries
+
+
+@contextmanager
+def pinned(path=None):
+    """Entry of the active model (or path), kept loaded until the block exits.
+
+    A request runs everything on the version it pinned, even if activate() switches to
+    another one meanwhile.
+    """
+    while True:
+        entry = _get_entry(path)
+        with _lock:
+            # released between the lookup and the pin: look it up (or load it) again
+            if _entries.get(entry["path"]) is entry:
+                entry["pins"] += 1
+                if entry["path"] != _active["path"]:
+                    # an explicitly pinned other version is dropped again once unpinned
+                    entry["retired"] = True
+                break
+    try:
+        yield entry
+    finally:
+        with _lock:
+            entry["pins"] -= 1
+        _release_retired()
+
+
+def on_release(hook):
+    """hook(path, model) runs when a replaced version is dropped (per-model caches clean up here)."""
+    _release_hooks.append(hook)
+    return hook
+
+
+def _release_retired():
+    released = []
+    with _lock:
+        for path, entry in list(_entries.items()):
+            if path != _active["path"] and entry.get("retired") and entry["pins"] <= 0:
+                del _entries[path]
+                released.append(entry)
+    for entry in released:
+        for hook in _release_hooks:
+            try:
+                hook(entry["path"], entry["model"])
+            except Exception:
+                logger.exception("Release hook failed for %s", entry["path"])
+        logger.info("Released model version %s (%s)", entry["version"], entry["path"])
+
+
+def activate(version=None, path=None, prepare=None, warm=True, select=False):
+    """Load (and warm up) a model version, then make it the one new requests get.
+
+    version names a file in MODEL_DIR (default: selected_version()); path activates any model
+    file instead. prepare(path) runs after the warm-up and before the switch (e.g. building
+    the inference backend). select=True also writes version to the "current" file, once it
+    is active, so other workers only follow a version that loaded. The version being replaced
+    is released when its pins are gone. Returns the new active version.
+    """
+    with _swap_lock:
+        if path is None:
+            version = version or selected_version()
+            if version is None:
+                raise ValueError(f"No model versions in {MODEL_DIR or '(XAI_MODEL_DIR not set)'}")
+            path = version_path(version)
+        previous = active_path()
+        if path == previous and path in _entries:
+            if select and version:
+                select_version(version)
+            return model_version(path)
+        _swap_status.update(state="loading", target=version or path, error=None,
+                            startedAt=time.time(), finishedAt=None)
+        try:
+            _get_entry(path)
+            if warm:
+                warm_up(path)
+            if prepare is not None:
+                prepare(path)
+        except Exception as e:
+            _swap_status.update(state="failed", error=str(e), finishedAt=time.time())
+            raise
+        with _lock:
+            _active["path"] = path
+            if previous in _entries and previous != path:
+                _entries[previous]["retired"] = True
+            _entries[path].pop("retired", None)
+        if select and version:
+            select_version(version)
+        _swap_status.update(state="idle", finishedAt=time.time())
+        logger.info("Activated model version %s (%s)", model_version(path), path)
+    _release_retired()
+    return model_version(path)
+
+
+def activate_in_background(version=None, prepare=None, select=False):
+    """activate() on a daemon thread; False if a swap is already running."""
+    with _lock:
+        # claimed before the thread starts, so two callers can't both get True
+        if _swap_status["state"] == "loading":
+            return False
+        _swap_status.update(state="loading", target=version, error=None,
+                            startedAt=time.time(), finishedAt=None)
+
+    def run():
+        try:
+            activate(version, prepare=prepare, select=select)
+        except Exception as e:
+            _swap_status.update(state="failed", error=str(e), finishedAt=time.time())
+            logger.exception("Could not activate model version %s", version)
+        else:
+            with _lock:
+                # activate() returns early, without touching the status, if version is already active
+                if _swap_status["state"] == "loading":
+                    _swap_status.update(state="idle", finishedAt=time.time())
+
+    threading.Thread(target=run, name="model-activate", daemon=True).start()
+    return True
+
+
+def watch_model_dir(interval_seconds, prepare=None):
+    """Poll MODEL_DIR every interval_seconds and activate the selected version when it changes.
+
+    This is how every worker process follows a change of the "current" file. Returns the
+    daemon thread, or None without a model directory.
+    """
+    if not MODEL_DIR or interval_seconds <= 0:
+        return None
+
+    def run():
+        failed = None
+        while True:
+            time.sleep(interval_seconds)
+            version = selected_version()
+            if version is None or version == failed:
+                continue
+            try:
+                if version_path(version) != active_path():
+                    # no version argument: activate() reads "current" again under its lock, so
+                    # a swap that /model/activate finishes meanwhile isn't undone
+                    activate(prepare=prepare)
+                failed = None
+            except Exception:
+                # retried once the selection changes again
+                logger.exception("Could not activate model version %s", version)
+                failed = version
+
+    thread = threading.Thread(target=run, name="model-watch", daemon=True)
+    thread.start()
+    return thread
+
+
+def versions_report():
+    """Versions on disk, the active one and the state of the last swap."""
+    with _lock:
+        loaded = {entry["version"]: entry["pins"] for entry in _entries.values()}
+    return {
+        "modelDir": MODEL_DIR or None,
+        "versions": list_versions(),
+        "selected": selected_version() if MODEL_DIR else None,
+        "active": model_version(),
+        "loaded": loaded,
+        "swap": dict(_swap_status),
+    }
+
+
+def warm_up(path=None, batch_sizes=(1,)):
+    """Load the model if needed and run dummy inference so the first request doesn't pay tracing cost."""
+    import numpy as np
+
+    entry = _get_entry(path)
+    model = entry["model"]
+    input_shape = tuple(dim or 1 for dim in model.input_shape[1:])
+    for batch_size in batch_sizes:
+        dummy = np.zeros((batch_size,) + input_shape, dtype=np.float32)
+        started = time.perf_counter()
+        model.predict(dummy, batch_size=batch_size, verbose=0)
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        model.predict(dummy, batch_size=batch_size, verbose=0)
+        steady = time.perf_counter() - started
+        entry["warmup"][int(batch_size)] = {"firstSeconds": round(first, 4), "steadySeconds": round(steady, 4)}
+    logger.info("Warmed up model %s: %s", path, entry["warmup"])
+    return entry["warmup"]
+
+
+def model_report():
+    """Memory/latency summary for every loaded model, used to size worker counts."""
+    models = []
+    active = _active["path"]
+    for path, entry in list(_entries.items()):
+        model = entry["model"]
+        try:
+            params = int(model.count_params())
+        except Exception:
+            params = 0
+        try:
+            param_bytes = int(sum(w.size * w.dtype.itemsize for w in model.get_weights()))
+        except Exception:
+            param_bytes = 0
+        models.append({
+            "path": path,
+            "version": entry["version"],
+            "active": path == active,
+            "pins": entry["pins"],
+            "lastConvLayerName": entry["lastConvLayerName"],
+            "loadSeconds": round(entry["loadSeconds"], 4),
+            "params": params,
+            "paramBytes": param_bytes,
+            "rssBeforeLoadBytes": entry["rssBeforeLoad"],
+            "rssAfterLoadBytes": entry["rssAfterLoad"],
+            "warmup": dict(entry["warmup"]),
+        })
+    return {
+        "pid": os.getpid(),
+        "rssBytes": _rss_bytes(),
+        "models": models,
+    }
@@ -0,0 +1,165 @@
+import functools
+import numpy as np
+import cv2
+from PIL import Image
+
+# Overlay rendering without pyplot: colormaps are precomputed 256-entry lookup tables and
+# blending is plain NumPy, so every function here is safe to call from several threads.
+
+# Segment data of matplotlib's "jet" and "hot" colormaps: (x, value) control points per
+# channel. Both are continuous, so sampling them with np.interp reproduces matplotlib's
+# 256-entry tables.
+_COLORMAP_SEGMENTS = {
+    "jet": (
+        ((0.0, 0.0), (0.35, 0.0), (0.66, 1.0), (0.89, 1.0), (1.0, 0.5)),
+        ((0.0, 0.0), (0.125, 0.0), (0.375, 1.0), (0.64, 1.0), (0.91, 0.0), (1.0, 0.0)),
+        ((0.0, 0.5), (0.11, 1.0), (0.34, 1.0), (0.65, 0.0), (1.0, 0.0)),
+    ),
+    "hot": (
+        ((0.0, 0.0416), (0.365079, 1.0), (1.0, 1.0)),
+        ((0.0, 0.0), (0.365079, 0.0), (0.746032, 1.0), (1.0, 1.0)),
+        ((0.0, 0.0), (0.746032, 0.0), (1.0, 1.0)),
+    ),
+}
+
+
+def _build_lut(segments, n=256):
+    x = np.linspace(0.0, 1.0, n)
+    channels = []
+    for points in segments:
+        xs, ys = zip(*points)
+        channels.append(np.interp(x, xs, ys))
+    return np.clip(np.stack(channels, axis=-1), 0.0, 1.0)
+
+
+# Extra colormaps offered when re-rendering stored maps; read once from OpenCV's tables
+_CV2_COLORMAPS = {
+    "viridis": cv2.COLORMAP_VIRIDIS,
+    "inferno": cv2.COLORMAP_INFERNO,
+    "magma": cv2.COLORMAP_MAGMA,
+    "plasma": cv2.COLORMAP_PLASMA,
+    "turbo": cv2.COLORMAP_TURBO,
+    "bone": cv2.COLORMAP_BONE,
+}
+
+
+def _cv2_lut(colormap):
+    bgr = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), colormap).reshape(256, 3)
+    return bgr[:, ::-1].astype(np.float64) / 255.0
+
+
+# float64 RGB in [0, 1], shape (256, 3)
+COLORMAP_LUTS = {name: _build_lut(segments) for name, segments in _COLORMAP_SEGMENTS.items()}
+COLORMAP_LUTS.update((name, _cv2_lut(colormap)) for name, colormap in _CV2_COLORMAPS.items())
+for _lut in COLORMAP_LUTS.values():
+    _lut.setflags(write=False)
+COLORMAPS = tuple(sorted(COLORMAP_LUTS))
+
+
+def get_colormap_lut(name):
+    try:
+        return COLORMAP_LUTS[name]
+    except KeyError:
+        raise ValueError(f"Unknown colormap: {name}")
+
+
+def _float_to_uint8(img):
+    # same truncation pyplot applies when drawing float RGB data
+    return (np.clip(img, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def gradcam_overlay(original_img, heatmap, alpha=0.6, colormap="jet"):
+    """Grad-CAM heatmap blended over original_img (float RGB in [0, 1]); uint8 RGB array.
+
+    Mirrors the previous Keras/PIL pipeline step for step (min-max scaled colormap image,
+    bicubic resize, float32 blend, truncation) so the output is pixel-identical.
+    """
+    heatmap = np.uint8(255 * heatmap)
+    colored = get_colormap_lut(colormap)[heatmap].astype(np.float32)
+
+    colored -= colored.min()
+    colored_max = colored.max()
+    if colored_max != 0:
+        colored /= colored_max
+    colored *= 255
+    colored = Image.fromarray(colored.astype(np.uint8), "RGB")
+    colored = colored.resize((original_img.shape[1], original_img.shape[0]), Image.BICUBIC)
+    colored = np.asarray(colored, dtype=np.float32)
+
+    original_scaled = np.asarray(original_img, dtype=np.float32) * 255.0
+    superimposed = colored * alpha + original_scaled * (1 - alpha)
+    return np.clip(superimposed, 0, 255).astype(np.uint8)
+
+
+def _autoscale(value_map):
+    # imshow's default Normalize: min/max to [0, 1]
+    values = np.asarray(value_map, dtype=np.float64)
+    vmin, vmax = values.min(), values.max()
+    return (values - vmin) / (vmax - vmin) if vmax > vmin else np.zeros_like(values)
+
+
+def _to_colormap_index(scaled):
+    return np.clip((scaled * 256).astype(np.int64), 0, 255).astype(np.uint8)
+
+
+def quantize_map(value_map):
+    """Colormap index (uint8) of every value, after imshow's min/max autoscaling. This is what
+    gets stored; figure_heatmap_overlay draws it to within a colormap entry of value_map itself."""
+    return _to_colormap_index(_autoscale(value_map))
+
+
+def image_to_uint8(img):
+    """Float RGB image in [0, 1] (e.g. LIME's mark_boundaries output) to uint8."""
+    return _float_to_uint8(np.asarray(img, dtype=np.float64))
+
+
+# LIME and occlusion images used to be drawn with imshow into a 6x6 inch, 100 dpi pyplot figure
+# and saved with bbox_inches="tight", which crops the PNG to the image inside the default axes
+# (465 x 462 px): a 224 px image came out 462 px wide. The figure_* functions keep that size.
+FIGURE_AXES_SIZE = (465, 462)
+
+
+def figure_shape(shape):
+    """(height, width) imshow gave an image of this shape in the old figure."""
+    height, width = shape[:2]
+    scale = min(FIGURE_AXES_SIZE[0] / width, FIGURE_AXES_SIZE[1] / height)
+    return int(round(height * scale)), int(round(width * scale))
+
+
+@functools.lru_cache(maxsize=16)
+def _hanning_weights(size_out, size_in):
+    # imshow upsamples by less than 3x with a Hanning filter of radius 1; one row per output pixel
+    centers = (np.arange(size_out) + 0.5) * (size_in / size_out) - 0.5
+    distance = np.abs(centers[:, None] - np.arange(size_in)[None, :])
+    weights = np.where(distance < 1.0, 0.5 + 0.5 * np.cos(np.pi * distance), 0.0)
+    weights /= weights.sum(axis=1, keepdims=True)
+    weights.setflags(write=False)
+    return weights
+
+
+def resample_like_imshow(values, shape):
+    """(H, W) or (H, W, C) float values resampled to shape = (height, width) as imshow does."""
+    values = np.asarray(values, dtype=np.float64)
+    rows = _hanning_weights(shape[0], values.shape[0])
+    cols = _hanning_weights(shape[1], values.shape[1])
+    if values.ndim == 3:
+        return np.stack([rows @ values[..., c] @ cols.T for c in range(values.shape[2])], axis=-1)
+    return rows @ values @ cols.T
+
+
+def figure_image(img):
+    """image_to_uint8 at the size the old pyplot figure drew img."""
+    return image_to_uint8(resample_like_imshow(img, figure_shape(img.shape)))
+
+
+def figure_heatmap_overlay(original_img, value_map, alpha=0.5, colormap="hot"):
+    """value_map drawn with colormap at alpha over original_img (float RGB in [0, 1]), as
+    imshow(img); imshow(map, alpha) did in the old pyplot figure, and at its size; uint8 RGB.
+    Like imshow, both layers are resampled before the map is colormapped and blended; matches
+    the old PNGs to within a few intensity levels on the edges of occlusion patches."""
+    shape = figure_shape(np.shape(original_img))
+    scaled = resample_like_imshow(_autoscale(value_map), shape)
+    colored = get_colormap_lut(colormap)[_to_colormap_index(scaled)]
+    blended = colored * alpha + resample_like_imshow(original_img, shape) * (1 - alpha)
+    return _float_to_uint8(blended)
+
@@ -0,0 +1,244 @@
+import os
+import re
+import time
+import uuid
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Request-scoped span timing and Prometheus text metrics without extra dependencies.
+# span(name) always feeds the per-stage histogram and, inside a request, also records the
+# span on the current trace (returned to the client as X-Trace-Id / Server-Timing). A span
+# costs two perf_counter calls and one short lock, so it stays on in production.
+
+TELEMETRY_ENABLED = os.environ.get("XAI_TELEMETRY", "1") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+_TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def expose(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}"
+                                for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def expose(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, [("le", _format_number(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(float(total))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REQUEST_DURATION = Histogram("xai_request_duration_seconds", "HTTP request latency by endpoint.",
+                             ("endpoint", "method", "status"))
+REQUESTS_IN_FLIGHT = Gauge("xai_requests_in_flight", "Requests currently being handled.", ("endpoint",))
+STAGE_DURATION = Histogram("xai_stage_duration_seconds", "Latency of pipeline stages (spans).", ("stage",))
+INFERENCE_BATCH_SIZE = Histogram("xai_inference_batch_size", "Images per model forward pass.",
+                                 ("backend",), buckets=SIZE_BUCKETS)
+REPORT_STORE_ROWS = Histogram("xai_report_store_rows", "Rows read per report-store query.",
+                              ("query",), buckets=SIZE_BUCKETS)
+EXPLAIN_JOBS = Counter("xai_explain_jobs_total", "Finished /explain jobs by status.", ("status",))
+REPORT_UPDATE_CONFLICTS = Counter("xai_report_update_conflicts_total",
+                                  "Report updates retried because another writer committed first.")
+
+METRICS = [REQUEST_DURATION, REQUESTS_IN_FLIGHT, STAGE_DURATION, INFERENCE_BATCH_SIZE, REPORT_STORE_ROWS,
+           EXPLAIN_JOBS, REPORT_UPDATE_CONFLICTS]
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id if trace_id and _TRACE_ID_PATTERN.match(trace_id) else uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, start, duration):
+        self.spans.append({"name": name, "startMs": round((start - self.started) * 1000, 3),
+                           "durationMs": round(duration * 1000, 3)})
+
+    def server_timing(self):
+        """Server-Timing header value; repeated stages are summed."""
+        totals = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["durationMs"]
+        return ", ".join(f"{re.sub(r'[^A-Za-z0-9_-]', '_', name)};dur={value:.1f}" for name, value in totals.items())
+
+
+_current_trace = contextvars.ContextVar("xai_trace", default=None)
+
+
+def start_trace(trace_id=None):
+    trace = Trace(trace_id)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    try:
+        _current_trace.reset(token)
+    except ValueError:
+        # ended from a different context (e.g. a streamed response's teardown)
+        _current_trace.set(None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+class span:
+    """with span("lime"): ... times the block (a class, not @contextmanager, to keep it cheap)."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if TELEMETRY_ENABLED:
+            duration = time.perf_counter() - self.start
+            STAGE_DURATION.observe(duration, stage=self.name)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.add(self.name, self.start, duration)
+        return False
+
+
+@contextmanager
+def collect_spans(trace_id=None):
+    """Record spans into a fresh trace (trace_id: e.g. the one of the request that queued the
+    work) and yield its span list. Used in explain worker processes, whose spans are shipped
+    back to the parent with the result."""
+    trace, token = start_trace(trace_id)
+    try:
+        yield trace.spans
+    finally:
+        end_trace(token)
+
+
+def record_spans(spans, trace=None):
+    """Feed spans measured in another process into this process's histograms (and trace)."""
+    for item in spans or ():
+        duration = item.get("durationMs", 0.0) / 1000.0
+        STAGE_DURATION.observe(duration, stage=item.get("name", "unknown"))
+    attach_spans(spans, trace)
+
+
+def attach_spans(spans, trace=None):
+    """Add already recorded spans to trace (default: the current one), so they show up in its
+    Server-Timing header, without observing them again."""
+    trace = trace if trace is not None else _current_trace.get()
+    if trace is not None:
+        trace.spans.extend(dict(item) for item in spans or ())
+
+
+def observe_batch_size(size, backend):
+    if TELEMETRY_ENABLED:
+        INFERENCE_BATCH_SIZE.observe(size, backend=backend)
+
+
+def observe_rows(count, query):
+    if TELEMETRY_ENABLED:
+        REPORT_STORE_ROWS.observe(count, query=query)
+
+
+def render_metrics(extra=()):
+    """Prometheus text exposition of every metric, plus unlabelled (name, type, help, value) samples
+    read from elsewhere at scrape time (cache and batcher stats)."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    for name, kind, documentation, value in extra:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,95 @@
+import os
+import sys
+import logging
+
+# Thread pools of one worker process. TensorFlow, OpenCV and the BLAS/OpenMP runtime behind numpy
+# and scikit-learn each size their pool to every core by default, so W workers on one machine
+# run W x cores threads and mostly wait on each other. Give each worker a share instead:
+#
+#   XAI_TF_INTRA_OP_THREADS   threads a single TensorFlow op (conv, matmul) may use; 0 = all cores
+#   XAI_TF_INTER_OP_THREADS   independent TensorFlow ops run at once; 0 = TensorFlow's default
+#   XAI_CV2_THREADS           OpenCV's pool (resize, colormaps, encoding); -1 = OpenCV's default
+#   XAI_BLAS_THREADS          OpenMP/OpenBLAS/MKL threads (LIME's ridge fits); 0 = library default
+#   XAI_THREADS_PER_WORKER    default for all four when they are unset (serve.py sets it to
+#                             cores / workers); 0 = leave the library defaults
+#
+# Settings are read from the environment when applied, so serve.py and benchmarks/autotune.py can
+# set them for the processes they start. benchmarks/autotune.py measures which split is fastest.
+
+logger = logging.getLogger(__name__)
+
+BLAS_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                 "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+_applied = {}
+
+
+def _env_int(name, default):
+    value = os.environ.get(name, "")
+    return int(value) if value.strip() else default
+
+
+def thread_settings():
+    """Configured thread counts (see the table above); 0 / -1 mean library default."""
+    per_worker = _env_int("XAI_THREADS_PER_WORKER", 0)
+    return {
+        "tfIntraOpThreads": _env_int("XAI_TF_INTRA_OP_THREADS", per_worker),
+        # one op at a time is enough for a sequential CNN once intra-op is capped
+        "tfInterOpThreads": _env_int("XAI_TF_INTER_OP_THREADS", 1 if per_worker else 0),
+        "cv2Threads": _env_int("XAI_CV2_THREADS", per_worker or -1),
+        "blasThreads": _env_int("XAI_BLAS_THREADS", per_worker),
+    }
+
+
+def blas_environment(threads):
+    """Environment variables that cap the BLAS/OpenMP pools; they only work before numpy loads."""
+    return {name: str(threads) for name in BLAS_ENV_VARS} if threads > 0 else {}
+
+
+def configure_process():
+    """Apply the BLAS and OpenCV settings to this process. Call as early as possible: the BLAS
+    variables are read when numpy first loads; later, threadpoolctl (if installed) is used."""
+    settings = thread_settings()
+    blas = settings["blasThreads"]
+    if blas > 0:
+        for name, value in blas_environment(blas).items():
+            # an explicit OMP_NUM_THREADS etc. wins; spawned /explain workers inherit these
+            os.environ.setdefault(name, value)
+        if "numpy" in sys.modules:
+            try:
+                from threadpoolctl import threadpool_limits
+            except ImportError:
+                logger.debug("numpy already loaded and threadpoolctl missing; BLAS threads left as they are")
+            else:
+                threadpool_limits(limits=blas)
+        _applied["blasThreads"] = blas
+    if settings["cv2Threads"] >= 0:
+        import cv2
+        cv2.setNumThreads(settings["cv2Threads"])
+        _applied["cv2Threads"] = settings["cv2Threads"]
+    return settings
+
+
+def configure_tensorflow():
+    """Apply the TensorFlow pool sizes. Only possible before TensorFlow runs its first op, so
+    model/registry.py calls it right before loading a model."""
+    if "tfIntraOpThreads" in _applied:
+        return
+    settings = thread_settings()
+    import tensorflow as tf
+
+    try:
+        if settings["tfIntraOpThreads"] > 0:
+            tf.config.threading.set_intra_op_parallelism_threads(settings["tfIntraOpThreads"])
+        if settings["tfInterOpThreads"] > 0:
+            tf.config.threading.set_inter_op_parallelism_threads(settings["tfInterOpThreads"])
+    except RuntimeError as e:
+        # the runtime is already up (something ran an op first); the pools keep their sizes
+        logger.warning("TensorFlow thread settings not applied: %s", e)
+    _applied["tfIntraOpThreads"] = tf.config.threading.get_intra_op_parallelism_threads()
+    _applied["tfInterOpThreads"] = tf.config.threading.get_inter_op_parallelism_threads()
+
+
+def thread_report():
+    """Configured and applied thread counts of this process, for /model/report."""
+    return {"cpuCount": os.cpu_count(), "configured": thread_settings(), "applied": dict(_applied)}
@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import argparse
+import threading
+
+from model.telemetry import span, observe_rows, REPORT_UPDATE_CONFLICTS
+
+# SQLite index over the report JSON files in static/patient_data. The JSON file stays the
+# document of record; the index holds a copy of the payload plus the columns we query on,
+# so history and "latest report for patient" lookups never scan the directory.
+#
+# Writes are safe across gunicorn workers: a JSON file is written to a temp file, fsynced and
+# swapped in with os.replace (readers see the old or the new report, never half of one), and
+# each row carries a version. update() is a read-modify-write that only commits if the version
+# is unchanged and otherwise retries on a fresh copy, so concurrent /predict and /explain
+# updates of one report never drop each other's fields. The file swap happens inside the
+# SQLite write transaction, so files and index rows change in the same order.
+
+# fsync report files (and their directory) before they replace the old version; a batch
+# of files shares one directory fsync
+REPORT_FSYNC = os.environ.get("XAI_REPORT_FSYNC", "1") == "1"
+REPORT_UPDATE_RETRIES = int(os.environ.get("XAI_REPORT_UPDATE_RETRIES", "50"))
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id   TEXT PRIMARY KEY,
+    patient_id  TEXT,
+    created_at  TEXT,
+    updated_at  TEXT,
+    diagnosis   TEXT,
+    confidence  REAL,
+    path        TEXT,
+    payload     TEXT NOT NULL,
+    version     INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_reports_patient_updated ON reports (patient_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_reports_updated ON reports (updated_at);
+CREATE INDEX IF NOT EXISTS idx_reports_diagnosis_updated ON reports (diagnosis COLLATE NOCASE, updated_at);
+"""
+
+
+def _patient_id(payload):
+    return payload.get("patientId") or payload.get("patient_id")
+
+
+def _updated_at(payload):
+    # same precedence _find_latest_report_file used when it scanned files
+    return payload.get("updatedAt") or payload.get("createdAt") or payload.get("timestamp") or ""
+
+
+class ReportConflict(RuntimeError):
+    """update() kept losing the race against other writers of the same report."""
+
+
+def _write_temp_json(path, payload, fsync=None):
+    """Write payload next to path and return the temp file; os.replace it to publish."""
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump(payload, handle, indent=4)
+        if REPORT_FSYNC if fsync is None else fsync:
+            handle.flush()
+            os.fsync(handle.fileno())
+    return tmp_path
+
+
+def _discard(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+
+def _fsync_dirs(paths):
+    """Make the renames into these files' directories durable (one fsync per directory)."""
+    if not REPORT_FSYNC or os.name == "nt":
+        return
+    for folder in {os.path.dirname(os.path.abspath(path)) for path in paths}:
+        fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _row_values(payload, path=None, fallback_report_id=""):
+    prediction = payload.get("prediction") if isinstance(payload.get("prediction"), dict) else {}
+    confidence = prediction.get("confidence", payload.get("confidence"))
+    try:
+        confidence = float(confidence) if confidence is not None else None
+    except (TypeError, ValueError):
+        confidence = None
+    patient_id = _patient_id(payload)
+    return (
+        payload.get("reportId") or fallback_report_id,
+        str(patient_id) if patient_id is not None else None,
+        payload.get("createdAt") or payload.get("timestamp") or "",
+        _updated_at(payload),
+        prediction.get("label", payload.get("diagnosis")),
+        confidence,
+        path,
+        json.dumps(payload),
+    )
+
+
+class ReportStore:
+    """Thread-safe access to the report index; one connection per thread."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # indexes created before rows were versioned
+        if "version" not in {row[1] for row in conn.execute("PRAGMA table_info(reports)")}:
+            conn.execute("ALTER TABLE reports ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            # WAL lets gunicorn workers read while another process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close this thread's connection; serve.py calls it before forking, since an SQLite
+        connection must not be shared with a child process."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    _UPSERT_SQL = (
+        "INSERT INTO reports "
+        "(report_id, patient_id, created_at, updated_at, diagnosis, confidence, path, payload) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(report_id) DO UPDATE SET patient_id = excluded.patient_id, "
+        "created_at = excluded.created_at, updated_at = excluded.updated_at, "
+        "diagnosis = excluded.diagnosis, confidence = excluded.confidence, path = excluded.path, "
+        "payload = excluded.payload, version = reports.version + 1"
+    )
+
+    def upsert(self, payload, path=None):
+        self.upsert_many([(payload, path)])
+
+    def upsert_many(self, items, tmp_paths=None):
+        """Insert or replace the index rows of (payload, path) pairs in a single transaction.
+
+        tmp_paths: temp files (from _write_temp_json) to os.replace onto each path inside the
+        same transaction, so other writers see file and row change together.
+        """
+        rows = []
+        renames = []
+        for index, (payload, path) in enumerate(items):
+            fallback = os.path.splitext(os.path.basename(path))[0] if path else ""
+            values = _row_values(payload, path, fallback)
+            if values[0]:
+                rows.append(values)
+            if tmp_paths is not None:
+                renames.append((tmp_paths[index], path))
+        if not rows and not renames:
+            return 0
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for tmp_path, path in renames:
+                os.replace(tmp_path, path)
+            conn.executemany(self._UPSERT_SQL, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            for tmp_path, _ in renames:
+                _discard(tmp_path)
+            raise
+        return len(rows)
+
+    def save(self, payload, path):
+        """Atomically write a report's JSON file and index row (last writer wins)."""
+        return self.save_many([(payload, path)])
+
+    def save_many(self, items, map_fn=map):
+        """save() for many reports: files are written (and fsynced) through map_fn, e.g. a
+        thread pool's map, then published in one transaction with one fsync per directory."""
+        items = list(items)
+        tmp_paths = list(map_fn(lambda item: _write_temp_json(item[1], item[0]), items))
+        count = self.upsert_many(items, tmp_paths)
+        _fsync_dirs([path for _, path in items])
+        return count
+
+    def update(self, report_id, mutate, path=None):
+        """Read-modify-write of one report with optimistic versioning.
+
+        mutate(payload) changes a fresh copy of the stored payload in place; it is called again
+        if another writer committed in between, so it must only depend on its argument.
+        path is used if the row has none. Returns the saved payload, or None if there is
+        no such report; raises ReportConflict after REPORT_UPDATE_RETRIES lost races.
+        """
+        conn = self._connect()
+        for attempt in range(max(REPORT_UPDATE_RETRIES, 1)):
+            row = conn.execute(
+                "SELECT path, version, payload FROM reports WHERE report_id = ?", (report_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            path = row[0] or path
+            version = row[1]
+            payload = json.loads(row[2])
+            mutate(payload)
+            values = _row_values(payload, path, report_id)
+            # write the file before taking the write lock; only the swap happens under it
+            tmp_path = _write_temp_json(path, payload) if path else None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = conn.execute(
+                    "SELECT version FROM reports WHERE report_id = ?", (report_id,)
+                ).fetchone()
+                if current is None or current[0] != version:
+                    conn.execute("ROLLBACK")
+                    if tmp_path:
+                        _discard(tmp_path)
+                    if current is None:
+                        return None
+                    REPORT_UPDATE_CONFLICTS.inc()
+                    time.sleep(random.uniform(0, 0.002 * (attempt + 1)))
+                    continue
+                if tmp_path:
+                    os.replace(tmp_path, path)
+                conn.execute(
+                    "UPDATE reports SET patient_id = ?, created_at = ?, updated_at = ?, diagnosis = ?, "
+                    "confidence = ?, path = ?, payload = ?, version = version + 1 WHERE report_id = ?",
+                    values[1:] + (report_id,),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                if tmp_path:
+                    _discard(tmp_path)
+                raise
+            if path:
+                _fsync_dirs([path])
+            return payload
+        raise ReportConflict(f"Report {report_id} changed during {REPORT_UPDATE_RETRIES} update attempts")
+
+    def get(self, report_id):
+        row = self._connect().execute(
+            "SELECT payload FROM reports WHERE report_id = ?", (report_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def latest_for_patient(self, patient_id):
+        """(report_id, path, payload) of the patient's most recently updated report, or None."""
+        with span("report_store.latest"):
+            row = self._connect().execute(
+                "SELECT report_id, path, payload FROM reports WHERE patient_id = ? "
+                "ORDER BY updated_at DESC, rowid DESC LIMIT 1",
+                (str(patient_id),),
+            ).fetchone()
+        observe_rows(1 if row else 0, "latest")
+        if not row:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def query_reports(self, patient_id=None, diagnosis=None, updated_from=None, updated_to=None,
+                      min_confidence=None, after=None, limit=50):
+        """One page of (report_id, updated_at, payload), newest first.
+
+        after is the (updated_at, report_id) of the last row of the previous page; the
+        ordering is (updated_at DESC, report_id DESC) so pages never overlap.
+        """
+        clauses = []
+        params = []
+        if patient_id:
+            clauses.append("patient_id = ?")
+            params.append(str(patient_id))
+        if diagnosis:
+            clauses.append("diagnosis = ? COLLATE NOCASE")
+            params.append(diagnosis)
+        if updated_from:
+            clauses.append("updated_at >= ?")
+            params.append(updated_from)
+        if updated_to:
+            clauses.append("updated_at <= ?")
+            params.append(updated_to)
+        if min_confidence is not None:
+            clauses.append("confidence >= ?")
+            params.append(float(min_confidence))
+        if after:
+            clauses.append("(updated_at < ? OR (updated_at = ? AND report_id < ?))")
+            params.extend([after[0], after[0], after[1]])
+
+        sql = "SELECT report_id, updated_at, payload FROM reports"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY updated_at DESC, report_id DESC LIMIT ?"
+        params.append(int(limit))
+        with span("report_store.query"):
+            rows = [
+                (report_id, updated_at, json.loads(payload))
+                for report_id, updated_at, payload in self._connect().execute(sql, params)
+            ]
+        observe_rows(len(rows), "query")
+        return rows
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+    def migrate_json_folder(self, folder, batch_size=500):
+        """One-shot import of every <report_id>.json in folder. Returns the number indexed."""
+        if not os.path.isdir(folder):
+            return 0
+        total = 0
+        batch = []
+        for entry in sorted(os.listdir(folder)):
+            if not entry.endswith(".json"):
+                continue
+            path = os.path.join(folder, entry)
+            try:
+                with open(path, "r", encoding="utf-8") as handle:
+                    payload = json.load(handle)
+            except Exception:
+                logger.exception("Skipping unreadable report during migration: %s", path)
+                continue
+            batch.append((payload, path))
+            if len(batch) >= batch_size:
+                total += self.upsert_many(batch)
+                batch = []
+        if batch:
+            total += self.upsert_many(batch)
+        logger.info("Indexed %d report(s) from %s into %s", total, folder, self.db_path)
+        return total
+
+
+def main(argv=None):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Import report JSON files into the SQLite report index.")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--folder", default=os.path.join(base_dir, "static", "patient_data"))
+    parser.add_argument("--db", default=os.path.join(base_dir, "data", "reports.sqlite3"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    store = ReportStore(args.db)
+    count = store.migrate_json_folder(args.folder)
+    print(f"Indexed {count} report(s); index now holds {store.count()}.")
+
+
+if __name__ == "__main__":
+    main()
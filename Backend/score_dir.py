@@ -0,0 +1,229 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+import tensorflow as tf
+
+from model.predict import predict_batch, PREDICT_BATCH_SIZE
+from model.registry import get_model, model_version
+
+# Offline re-scoring of archived images. Files are streamed through a tf.data pipeline
+# (parallel decode, batching, prefetch) and results are appended to a CSV or JSONL file as
+# each batch finishes, so an interrupted run resumes where it stopped.
+#
+#   python score_dir.py /archive/xrays --output scores.csv
+#   python score_dir.py --file-list paths.txt --output scores.jsonl
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif"}
+TARGET_SIZE = (224, 224)
+OUTPUT_FIELDS = ["path", "label", "confidence", "modelVersion", "scoredAt", "error"]
+
+
+def iter_image_paths(inputs, file_list=None):
+    """Image paths under every input (directories are walked in sorted order), then file_list."""
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield os.path.abspath(os.path.join(root, name))
+        elif os.path.isfile(item):
+            yield os.path.abspath(item)
+    if file_list:
+        with open(file_list, "r", encoding="utf-8") as handle:
+            for line in handle:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield os.path.abspath(line)
+
+
+def _nearest_indices(size, target):
+    # Source index for each output pixel exactly as PIL's NEAREST resize computes it
+    # (the coordinate is accumulated in double precision from 0.5 * scale), so results
+    # match load_img(..., target_size) bit for bit.
+    size = int(size)
+    target = int(target)
+    scale = size / target
+    steps = np.full(target, scale)
+    steps[0] = 0.5 * scale
+    return np.minimum(np.floor(np.cumsum(steps)), size - 1).astype(np.int32)
+
+
+def load_image(path, target_size=TARGET_SIZE):
+    """tf.data version of predict.preprocess_image: RGB, nearest resize, scaled to [0, 1]."""
+    raw = tf.io.read_file(path)
+    img = tf.cond(
+        tf.io.is_jpeg(raw),
+        # libjpeg's accurate IDCT is what PIL decodes with
+        lambda: tf.io.decode_jpeg(raw, channels=3, dct_method="INTEGER_ACCURATE"),
+        lambda: tf.io.decode_image(raw, channels=3, expand_animations=False),
+    )
+    img.set_shape([None, None, 3])
+    shape = tf.shape(img)
+    rows = tf.numpy_function(_nearest_indices, [shape[0], target_size[0]], tf.int32)
+    cols = tf.numpy_function(_nearest_indices, [shape[1], target_size[1]], tf.int32)
+    img = tf.gather(tf.gather(img, rows, axis=0), cols, axis=1)
+    img = tf.cast(img, tf.float32) / 255.0
+    img.set_shape([target_size[0], target_size[1], 3])
+    return img
+
+
+def build_dataset(paths, batch_size, decode_threads=None):
+    dataset = tf.data.Dataset.from_generator(lambda: paths, output_signature=tf.TensorSpec([], tf.string))
+    dataset = dataset.map(lambda path: (path, load_image(path)),
+                          num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+    # unreadable files are dropped here and reported as errors once the run finishes
+    if hasattr(dataset, "ignore_errors"):
+        dataset = dataset.ignore_errors()
+    else:
+        dataset = dataset.apply(tf.data.experimental.ignore_errors())
+    dataset = dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+    if decode_threads:
+        options = tf.data.Options()
+        options.threading.private_threadpool_size = int(decode_threads)
+        dataset = dataset.with_options(options)
+    return dataset
+
+
+def _trim_partial_line(path):
+    """Drop a trailing half-written row left by an interrupted run."""
+    with open(path, "rb+") as handle:
+        handle.seek(0, os.SEEK_END)
+        end = handle.tell()
+        if end == 0:
+            return
+        handle.seek(end - 1)
+        if handle.read(1) == b"\n":
+            return
+        position = end - 1
+        while position > 0:
+            handle.seek(position - 1)
+            if handle.read(1) == b"\n":
+                break
+            position -= 1
+        handle.truncate(position)
+
+
+def read_done_paths(path, output_format, retry_errors=False):
+    if not os.path.isfile(path):
+        return set()
+    _trim_partial_line(path)
+    done = set()
+    with open(path, "r", encoding="utf-8", newline="") as handle:
+        if output_format == "csv":
+            rows = csv.DictReader(handle)
+        else:
+            rows = (json.loads(line) for line in handle if line.strip())
+        for row in rows:
+            if row.get("path") and not (retry_errors and row.get("error")):
+                done.add(row["path"])
+    return done
+
+
+class ResultWriter:
+    def __init__(self, path, output_format):
+        self.output_format = output_format
+        new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+        self._handle = open(path, "a", encoding="utf-8", newline="")
+        if output_format == "csv":
+            self._csv = csv.DictWriter(self._handle, fieldnames=OUTPUT_FIELDS)
+            if new_file:
+                self._csv.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.output_format == "csv":
+                self._csv.writerow({key: row.get(key, "") for key in OUTPUT_FIELDS})
+            else:
+                self._handle.write(json.dumps(row) + "\n")
+        self._handle.flush()
+
+    def close(self):
+        self._handle.close()
+
+
+def score(inputs, output, output_format=None, file_list=None, batch_size=PREDICT_BATCH_SIZE,
+          decode_threads=None, retry_errors=False, progress_every=10.0, log=sys.stderr):
+    output_format = output_format or ("jsonl" if output.endswith((".jsonl", ".ndjson")) else "csv")
+    done = read_done_paths(output, output_format, retry_errors)
+
+    # load before timing so images/sec reflects steady-state scoring
+    get_model()
+    version = model_version()
+
+    submitted = []
+
+    def pending():
+        for path in iter_image_paths(inputs, file_list):
+            if path not in done:
+                submitted.append(path)
+                yield path
+
+    writer = ResultWriter(output, output_format)
+    scored_paths = set()
+    started = time.perf_counter()
+    last_report = started
+    try:
+        for paths, images in build_dataset(pending(), batch_size, decode_threads).as_numpy_iterator():
+            results = predict_batch(images, batch_size)
+            now = datetime.now().isoformat()
+            rows = []
+            for path, result in zip(paths, results):
+                path = path.decode("utf-8")
+                scored_paths.add(path)
+                rows.append({"path": path, "modelVersion": version, "scoredAt": now, **result})
+            writer.write(rows)
+
+            if progress_every and time.perf_counter() - last_report >= progress_every:
+                last_report = time.perf_counter()
+                elapsed = last_report - started
+                print(f"{len(scored_paths)} image(s) scored, {len(scored_paths) / elapsed:.1f} images/sec",
+                      file=log, flush=True)
+
+        failed = [path for path in submitted if path not in scored_paths]
+        now = datetime.now().isoformat()
+        writer.write({"path": path, "modelVersion": version, "scoredAt": now,
+                      "error": "could not read or decode image"} for path in failed)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "scored": len(scored_paths),
+        "failed": len(failed),
+        "skipped": len(done),
+        "seconds": round(elapsed, 3),
+        "imagesPerSecond": round(len(scored_paths) / elapsed, 2) if elapsed > 0 else 0.0,
+        "output": output,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a directory (or list) of X-ray images offline.")
+    parser.add_argument("inputs", nargs="*", help="image files or directories (walked recursively)")
+    parser.add_argument("--file-list", help="text file with one image path per line")
+    parser.add_argument("--output", required=True, help="results file (.csv or .jsonl); appended to on resume")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the output file extension")
+    parser.add_argument("--batch-size", type=int, default=PREDICT_BATCH_SIZE)
+    parser.add_argument("--decode-threads", type=int, help="tf.data thread pool size (default: all cores)")
+    parser.add_argument("--retry-errors", action="store_true", help="re-score paths whose previous row is an error")
+    parser.add_argument("--progress-every", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.file_list:
+        parser.error("give at least one input path or --file-list")
+
+    summary = score(args.inputs, args.output, args.format, args.file_list, args.batch_size,
+                    args.decode_threads, args.retry_errors, args.progress_every)
+    print(f"Scored {summary['scored']} image(s) in {summary['seconds']}s "
+          f"({summary['imagesPerSecond']} images/sec); {summary['failed']} failed, "
+          f"{summary['skipped']} already in {summary['output']}.")
+
+
+if __name__ == "__main__":
+    main()
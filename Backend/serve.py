@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import socket
+import logging
+import argparse
+
+# Preload-and-fork server. The master binds the port and imports the app together with
+# TensorFlow/Keras (and, with --preload-explain, lime and scikit-image), then forks the HTTP
+# workers, which share all of that copy-on-write instead of each importing it for seconds.
+#
+# The model itself is loaded (and warmed up) by every worker after the fork: TensorFlow's
+# runtime is not fork-safe, and a child forked after the parent ran a single op hangs on its
+# first inference. The master therefore only imports libraries and never touches the model;
+# it restarts workers that die and stops them on SIGTERM/SIGINT.
+#
+#   python serve.py --workers 4 --port 5000
+#   python serve.py --workers 4 --startup-report        # time to ready + per-worker RSS/PSS, then exit
+#   python serve.py --workers 4 --startup-report --no-preload    # the same without the preload
+#
+# /explain jobs still run in the spawned worker processes of each HTTP worker (explain_jobs.py).
+
+logger = logging.getLogger("serve")
+
+SERVE_HOST = os.environ.get("XAI_SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.environ.get("XAI_SERVE_PORT", "5000"))
+SERVE_WORKERS = int(os.environ.get("XAI_SERVE_WORKERS", "2"))
+# threads per worker for TensorFlow/OpenCV/BLAS (model/threads.py); 0 = cores / workers
+THREADS_PER_WORKER = int(os.environ.get("XAI_THREADS_PER_WORKER", "0"))
+PRELOAD_EXPLAIN = os.environ.get("XAI_PRELOAD_EXPLAIN", "0") == "1"
+LISTEN_BACKLOG = 128
+READY_TIMEOUT_SECONDS = 300
+# pause before replacing a dead worker, so a worker that cannot start does not spin
+RESTART_DELAY_SECONDS = 1.0
+
+
+def preload(explain=False):
+    """Import everything the workers need, without starting the TensorFlow runtime."""
+    # app.py would warm the model up at import; that happens in the workers instead
+    os.environ["XAI_WARMUP_ON_BOOT"] = "0"
+    import app
+    import tensorflow  # noqa: F401  (import only; no ops run in the master)
+    from tensorflow.keras.models import load_model  # noqa: F401
+    if explain:
+        import lime.lime_image  # noqa: F401
+        import skimage.segmentation  # noqa: F401
+        from model import explainers  # noqa: F401
+    from model.registry import active_path
+    # read the weights file once so every worker loads it from the page cache
+    if os.path.isfile(active_path()):
+        with open(active_path(), "rb") as handle:
+            while handle.read(1 << 24):
+                pass
+    # the report index was opened at import; workers open their own connections
+    app.report_store.close()
+    return app
+
+
+def warm_worker(app_module):
+    """Load the model in this worker, run both inference paths once and follow model swaps."""
+    from model.registry import warm_up
+    from model.backends import prepare_backend
+
+    warm_up()
+    prepare_backend()
+    app_module._start_model_watch()
+
+
+def memory_usage(pid):
+    """RSS, PSS (shared pages split between the processes using them) and USS (private) in bytes."""
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as handle:
+            for line in handle:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                    usage[key] = int(value.split()[0]) * 1024
+    except OSError:
+        return {}
+    return {"rssBytes": usage.get("Rss", 0), "pssBytes": usage.get("Pss", 0),
+            "ussBytes": usage.get("Private_Clean", 0) + usage.get("Private_Dirty", 0)}
+
+
+def run_worker(listener, host, port, preloaded, ready_fd, started):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    from werkzeug.serving import make_server
+
+    app_module = preloaded or preload()
+    warm_worker(app_module)
+    os.write(ready_fd, (json.dumps({"pid": os.getpid(), "readySeconds": round(time.perf_counter() - started, 3)})
+                        + "\n").encode("utf-8"))
+    server = make_server(host, port, app_module.app, threaded=True, fd=listener.fileno())
+    server.serve_forever()
+
+
+class Master:
+    def __init__(self, host, port, workers, preload_libraries=True, preload_explain=False):
+        self.host = host
+        self.port = port
+        self.workers = max(int(workers), 1)
+        self.preload_libraries = preload_libraries
+        self.preload_explain = preload_explain
+        self.children = {}
+        self.stopping = False
+        self.started = time.perf_counter()
+        self.preload_seconds = 0.0
+
+    def bind(self):
+        # bound before the slow imports so a busy port fails immediately
+        listener = socket.socket(socket.AF_INET6 if ":" in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(LISTEN_BACKLOG)
+        listener.set_inheritable(True)
+        self.listener = listener
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(self.ready_read)
+                run_worker(self.listener, self.host, self.port, self.app_module, self.ready_write, self.started)
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = time.perf_counter()
+        return pid
+
+    def start(self):
+        self.bind()
+        self.app_module = None
+        if self.preload_libraries:
+            self.app_module = preload(self.preload_explain)
+        self.preload_seconds = time.perf_counter() - self.started
+        self.ready_read, self.ready_write = os.pipe()
+        for _ in range(self.workers):
+            self.spawn()
+        logger.info("Serving on %s:%d with %d worker(s) (preload %.2fs)", self.host, self.port,
+                    self.workers, self.preload_seconds)
+
+    def wait_ready(self, timeout=READY_TIMEOUT_SECONDS):
+        """Ready messages of the current workers ({pid, readySeconds})."""
+        ready = {}
+        buffer = b""
+        deadline = time.monotonic() + timeout
+        while len(ready) < len(self.children) and time.monotonic() < deadline:
+            readable, _, _ = select.select([self.ready_read], [], [], 0.5)
+            if readable:
+                buffer += os.read(self.ready_read, 65536)
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    message = json.loads(line)
+                    ready[message["pid"]] = message
+            self.reap()
+        return ready
+
+    def reap(self):
+        """Collect exited workers and replace them unless stopping."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.children.pop(pid, None) is not None and not self.stopping:
+                logger.warning("Worker %d exited (status %d); starting a new one", pid, status)
+                time.sleep(RESTART_DELAY_SECONDS)
+                self.spawn()
+
+    def stop(self, *_):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.children.clear()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping:
+            try:
+                readable, _, _ = select.select([self.ready_read], [], [], 1.0)
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            if readable:
+                os.read(self.ready_read, 65536)
+            self.reap()
+
+    def startup_report(self):
+        ready = self.wait_ready()
+        processes = [{"role": "master", "pid": os.getpid(), **memory_usage(os.getpid())}]
+        for pid, message in sorted(ready.items()):
+            processes.append({"role": "worker", **message, **memory_usage(pid)})
+        workers = processes[1:]
+        return {
+            "workers": self.workers,
+            "preload": self.preload_libraries,
+            "preloadExplain": self.preload_explain,
+            "preloadSeconds": round(self.preload_seconds, 3),
+            "allReadySeconds": max((w["readySeconds"] for w in workers), default=None),
+            "workerPssBytes": sum(w.get("pssBytes", 0) for w in workers),
+            "totalPssBytes": sum(p.get("pssBytes", 0) for p in processes),
+            "processes": processes,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the app from preloaded, forked workers.")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--preload-explain", action="store_true", default=PRELOAD_EXPLAIN,
+                        help="also import lime/scikit-image in the master (for workers that explain inline)")
+    parser.add_argument("--no-preload", action="store_true", help="import everything in each worker instead")
+    parser.add_argument("--threads-per-worker", type=int, default=THREADS_PER_WORKER,
+                        help="thread pool size per worker (default: cores / workers; "
+                             "python -m benchmarks.autotune recommends one)")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print startup time and per-process memory once all workers are ready, then exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py needs os.fork (Linux/macOS); run app.py or a WSGI server on this platform")
+
+    # before anything loads numpy or TensorFlow; the XAI_TF_*/XAI_CV2_/XAI_BLAS_ knobs still win
+    threads = args.threads_per_worker or max((os.cpu_count() or 1) // max(args.workers, 1), 1)
+    os.environ["XAI_THREADS_PER_WORKER"] = str(threads)
+
+    master = Master(args.host, args.port, args.workers, preload_libraries=not args.no_preload,
+                    preload_explain=args.preload_explain)
+    master.start()
+    if args.startup_report:
+        try:
+            print(json.dumps(master.startup_report(), indent=2))
+        finally:
+            master.stop()
+        return
+    master.run()
+
+
+if __name__ == "__main__":
+    main()
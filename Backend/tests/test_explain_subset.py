@@ -0,0 +1,87 @@
+import io
+import os
+import sys
+import time
+import importlib
+
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+pytest.importorskip("tensorflow")
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    """The app on a fresh storage directory, serving benchmarks/stand_in.py's model."""
+    from benchmarks.stand_in import save_stand_in_model
+
+    storage = tmp_path_factory.mktemp("storage")
+    model_path = save_stand_in_model(str(tmp_path_factory.mktemp("model") / "stand_in.keras"))
+    env = {"XAI_STORAGE_DIR": str(storage), "XAI_MODEL_PATH": model_path, "XAI_MODEL_DIR": ""}
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    app_module = importlib.import_module("app")
+    try:
+        yield app_module, app_module.app.test_client()
+    finally:
+        app_module._get_explain_queue().shutdown()
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _png():
+    import cv2
+
+    rng = np.random.default_rng(0)
+    ok, encoded = cv2.imencode(".png", (rng.random((224, 224, 3)) * 255).astype(np.uint8))
+    assert ok
+    return encoded.tobytes()
+
+
+def _explain(client, data, explainers=None):
+    form = {"file": (io.BytesIO(data), "xray.png"), "patientId": "SUBSET1"}
+    if explainers:
+        form["explainers"] = explainers
+    response = client.post("/explain", data=form, content_type="multipart/form-data")
+    assert response.status_code in (200, 202), response.get_json()
+    job = response.get_json()
+    deadline = time.time() + 300
+    while job["status"] not in ("done", "failed"):
+        assert time.time() < deadline, "explain job did not finish"
+        time.sleep(0.2)
+        job = client.get(f"/explain/status/{job['jobId']}").get_json()
+    assert job["status"] == "done", job.get("error")
+    return job
+
+
+def test_subset_explain_keeps_other_explainers(client):
+    app_module, test_client = client
+    data = _png()
+    predicted = test_client.post("/predict", data={"file": (io.BytesIO(data), "xray.png"), "patientId": "SUBSET1"},
+                                 content_type="multipart/form-data").get_json()
+    report_id = predicted["reportId"]
+
+    _explain(test_client, data)
+    full = app_module.report_store.get(report_id)["xai"]
+    assert all(full[name] for name in ("gradcam", "lime", "occlusion"))
+    assert set(full["thumbnails"]) == {"gradcam", "lime", "occlusion"}
+
+    # a gradcam-only quick look (different parameters, so not served from the full run's cache)
+    quick = _explain(test_client, data, explainers="gradcam")
+    assert quick.get("lime") is None
+    xai = app_module.report_store.get(report_id)["xai"]
+    assert xai["gradcam"]
+    assert xai["lime"] == full["lime"]
+    assert xai["occlusion"] == full["occlusion"]
+    assert xai["thumbnails"]["lime"] == full["thumbnails"]["lime"]
+    assert xai["thumbnails"]["occlusion"] == full["thumbnails"]["occlusion"]
+
+    # the merged maps still redraw every explainer
+    for name in ("gradcam", "lime", "occlusion"):
+        assert test_client.get(f"/reports/{report_id}/render/{name}").status_code == 200
@@ -0,0 +1,67 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import render  # noqa: E402
+
+
+def _xray_like(rng, size=224):
+    # smooth grey-level structure plus LIME-style one-pixel yellow boundaries
+    img = np.cumsum(np.cumsum(rng.random((size, size)), axis=0), axis=1)
+    img = np.repeat(((img - img.min()) / (img.max() - img.min()))[..., np.newaxis], 3, axis=2)
+    img[::37, :] = (1.0, 1.0, 0.0)
+    img[:, ::29] = (1.0, 1.0, 0.0)
+    return img
+
+
+def _occlusion_like(rng, size=224, patch=16):
+    # patch-constant score drops, as occlusion_sensitivity returns with stride == patch_size
+    cells = rng.normal(0.0, 0.05, (size // patch, size // patch))
+    return np.kron(cells, np.ones((patch, patch)))
+
+
+def _pyplot_png(*layers):
+    """The PNG generate_explanations used to write: imshow layers in a 6x6 figure, tight bbox."""
+    matplotlib = pytest.importorskip("matplotlib")
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(6, 6))
+    for data, kwargs in layers:
+        plt.imshow(data, **kwargs)
+    plt.axis("off")
+    buffer = io.BytesIO()
+    plt.savefig(buffer, format="png", bbox_inches="tight", pad_inches=0)
+    plt.close()
+    buffer.seek(0)
+    return (plt.imread(buffer)[..., :3] * 255).round().astype(np.uint8)
+
+
+def _difference(new, old):
+    assert new.shape == old.shape
+    return np.abs(new.astype(np.int64) - old.astype(np.int64))
+
+
+def test_figure_image_matches_pyplot_lime_png():
+    img = _xray_like(np.random.default_rng(0))
+    diff = _difference(render.figure_image(img), _pyplot_png((img, {})))
+    # Agg's filter weights are fixed-point; the crossings of the boundary lines can round apart
+    assert diff.mean() < 0.1
+    assert diff.max() <= 3
+
+
+def test_figure_heatmap_overlay_matches_pyplot_occlusion_png():
+    rng = np.random.default_rng(1)
+    img, occ_map = _xray_like(rng), _occlusion_like(rng)
+    old = _pyplot_png((img, {}), (occ_map, {"cmap": "hot", "alpha": 0.5}))
+    # drawn from the stored uint8 map, as generate_explanations and /render do
+    diff = _difference(render.figure_heatmap_overlay(img, render.quantize_map(occ_map)), old)
+    # pixels on patch edges and boundary lines can land on a neighbouring colormap entry
+    assert diff.mean() < 1.0
+    assert (diff > 1).mean() < 0.05
+    assert diff.max() <= 8
@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import report_store  # noqa: E402
+from report_store import ReportStore  # noqa: E402
+
+
+def test_concurrent_updates_are_not_lost(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_store, "REPORT_FSYNC", False)
+    db_path = str(tmp_path / "reports.db")
+    path = str(tmp_path / "r1.json")
+    ReportStore(db_path).save({"reportId": "r1", "patientId": "p1", "counter": 0, "writers": []}, path)
+
+    # two stores on one database, like two gunicorn workers, each updated from several threads
+    stores = [ReportStore(db_path), ReportStore(db_path)]
+    threads_per_store = 4
+    updates_per_thread = 25
+    errors = []
+
+    def mutate_for(name):
+        def mutate(payload):
+            payload["counter"] += 1
+            payload["writers"].append(name)
+        return mutate
+
+    def worker(store, name):
+        try:
+            for _ in range(updates_per_thread):
+                assert store.update("r1", mutate_for(name)) is not None
+        except Exception as e:  # surfaced by the assertion below
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(store, f"{index}-{thread}"))
+               for index, store in enumerate(stores) for thread in range(threads_per_store)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    expected = len(stores) * threads_per_store * updates_per_thread
+    stored = stores[0].get("r1")
+    assert stored["counter"] == expected
+    assert len(stored["writers"]) == expected
+    with open(path, "r", encoding="utf-8") as handle:
+        assert json.load(handle) == stored
@@ -3,7 +3,7 @@ import AnalysisPage from './pages/AnalysisPage'
 import PatientHistoryPage from './pages/PatientHistoryPage'
 import PredictionForm from './pages/PredictionForm'
 import XaiReportPage from './pages/XaiReportPage'
-import { explainDiagnosis, fetchPatientHistory, predictDiagnosis } from './lib/api'
+import { fetchPatientHistory, predictDiagnosis, streamExplanation } from './lib/api'
 
 const defaultReport = {
   patientName: 'Unknown',
@@ -30,6 +30,7 @@ function App() {
   const [historyLoading, setHistoryLoading] = useState(false)
   const [historyError, setHistoryError] = useState('')
   const [historyPatientId, setHistoryPatientId] = useState('')
+  const [historyNextCursor, setHistoryNextCursor] = useState(null)
   const [historyReturnPage, setHistoryReturnPage] = useState('form')
   const [isXaiLoading, setIsXaiLoading] = useState(false)
   const [xaiProgress, setXaiProgress] = useState(0)
@@ -85,37 +86,55 @@ function App() {
     setFormError('')
     setXaiProgress(2)
     setXaiStage('Preparing image...')
+    setReport((prev) => ({ ...prev, gradcam: '', lime: '', occlusion: '' }))
     const startedAt = Date.now()
 
-    const intervalId = setInterval(() => {
-      setXaiProgress((prev) => {
-        const next = Math.min(prev + Math.floor(Math.random() * 5 + 2), 95)
+    const raiseProgress = (value) => setXaiProgress((prev) => Math.max(prev, value))
+    const imageTitles = { gradcam: 'Grad-CAM', occlusion: 'Occlusion', lime: 'LIME' }
 
-        if (next < 25) setXaiStage('Preprocessing X-ray...')
-        else if (next < 55) setXaiStage('Running Grad-CAM...')
-        else if (next < 80) setXaiStage('Running LIME...')
-        else if (next < 95) setXaiStage('Running Occlusion...')
-        else setXaiStage('Finalizing report...')
-
-        return next
-      })
-    }, 4500)
+    // Images are shown as the backend streams them: label, Grad-CAM, occlusion, then LIME
+    const handleExplainEvent = (event, data) => {
+      if (event === 'job') {
+        raiseProgress(5)
+        setXaiStage('Running Grad-CAM...')
+      } else if (event === 'label') {
+        raiseProgress(15)
+        setReport((prev) => ({
+          ...prev,
+          diagnosis: data.label || prev.diagnosis,
+          confidence: data.confidence ?? prev.confidence,
+          saliencyFocus: [
+            `Model label: ${data.label || 'Unknown'}`,
+            `Prediction confidence: ${data.confidence ?? 0}%`,
+            `XAI outputs generated for patient ${prev.patientId}`,
+          ],
+        }))
+      } else if (event === 'progress') {
+        const fraction = data.total ? data.done / data.total : 0
+        if (data.explainer === 'lime') {
+          raiseProgress(40 + fraction * 55)
+          setXaiStage(`Running LIME (${data.done}/${data.total} samples)...`)
+        } else {
+          raiseProgress(25 + fraction * 15)
+          setXaiStage('Running Occlusion...')
+        }
+      } else if (imageTitles[event]) {
+        raiseProgress(event === 'gradcam' ? 25 : event === 'occlusion' ? 40 : 95)
+        setXaiStage(`${imageTitles[event]} ready`)
+        setReport((prev) => ({ ...prev, [event]: data.url || '' }))
+      }
+    }
 
     try {
-      const explainResult = await explainDiagnosis(lastPayload)
+      const explainResult = await streamExplanation(lastPayload, handleExplainEvent)
 
       setReport((prev) => ({
         ...prev,
         diagnosis: explainResult?.label || prev.diagnosis,
         confidence: explainResult?.confidence ?? prev.confidence,
-        saliencyFocus: [
-          `Model label: ${explainResult?.label || 'Unknown'}`,
-          `Prediction confidence: ${explainResult?.confidence ?? 0}%`,
-          `XAI outputs generated for patient ${prev.patientId}`,
-        ],
-        gradcam: explainResult?.gradcam || '',
-        lime: explainResult?.lime || '',
-        occlusion: explainResult?.occlusion || '',
+        gradcam: explainResult?.gradcam || prev.gradcam,
+        lime: explainResult?.lime || prev.lime,
+        occlusion: explainResult?.occlusion || prev.occlusion,
       }))
       setXaiProgress(100)
       setXaiStage('XAI report ready')
@@ -123,7 +142,6 @@ function App() {
       setFormError(error.message || 'Failed to generate explanation report')
       setXaiStage('XAI generation failed')
     } finally {
-      clearInterval(intervalId)
       const elapsed = Date.now() - startedAt
       const minVisibleMs = 1500
       if (elapsed < minVisibleMs) {
@@ -156,9 +174,26 @@ function App() {
     try {
       const result = await fetchPatientHistory(patientId)
       setHistoryReports(result?.reports || [])
+      setHistoryNextCursor(result?.nextCursor || null)
     } catch (error) {
       setHistoryError(error.message || 'Failed to fetch patient history')
       setHistoryReports([])
+      setHistoryNextCursor(null)
+    } finally {
+      setHistoryLoading(false)
+    }
+  }
+
+  const handleLoadMoreHistory = async () => {
+    if (!historyNextCursor) return
+    setHistoryLoading(true)
+
+    try {
+      const result = await fetchPatientHistory(historyPatientId, { cursor: historyNextCursor })
+      setHistoryReports((current) => [...current, ...(result?.reports || [])])
+      setHistoryNextCursor(result?.nextCursor || null)
+    } catch (error) {
+      setHistoryError(error.message || 'Failed to fetch patient history')
     } finally {
       setHistoryLoading(false)
     }
@@ -215,6 +250,8 @@ function App() {
           errorMessage={historyError}
           initialPatientId={historyPatientId}
           onSearch={handleOpenHistory}
+          onLoadMore={handleLoadMoreHistory}
+          hasMore={Boolean(historyNextCursor)}
           onBack={handleBackFromHistory}
         />
       ) : null}
@@ -36,20 +36,94 @@ export async function predictDiagnosis(payload) {
   return parseJsonResponse(response)
 }
 
+const EXPLAIN_POLL_INTERVAL_MS = 1000
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms))
+}
+
 export async function explainDiagnosis(payload) {
   const response = await fetch(`${API_BASE_URL}/explain`, {
     method: 'POST',
     body: buildFormData(payload),
   })
 
-  return parseJsonResponse(response)
+  // /explain queues a background job; poll its status until the images are ready
+  let job = await parseJsonResponse(response)
+  while (job.status === 'queued' || job.status === 'running') {
+    await sleep(EXPLAIN_POLL_INTERVAL_MS)
+    job = await parseJsonResponse(await fetch(`${API_BASE_URL}/explain/status/${job.jobId}`))
+  }
+
+  if (job.status === 'failed') {
+    throw new Error(job.error || 'Explanation failed')
+  }
+
+  return job
+}
+
+function parseServerSentEvent(block) {
+  let event = 'message'
+  const dataLines = []
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) event = line.slice(6).trim()
+    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim())
+  }
+  // comment-only blocks are keep-alives
+  return dataLines.length ? { event, data: JSON.parse(dataLines.join('\n')) } : null
 }
 
-export async function fetchPatientHistory(patientId = '') {
+// /explain/stream answers the upload with server-sent events: job, label, then gradcam,
+// occlusion and lime as each image is ready, progress while LIME/occlusion run, and done or error.
+// onEvent(event, data) sees every event; resolves with the finished job.
+export async function streamExplanation(payload, onEvent) {
+  const response = await fetch(`${API_BASE_URL}/explain/stream`, {
+    method: 'POST',
+    body: buildFormData(payload),
+  })
+  if (!response.ok) {
+    await parseJsonResponse(response)
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+  let buffer = ''
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buffer += value
+
+    let boundary = buffer.indexOf('\n\n')
+    while (boundary !== -1) {
+      const message = parseServerSentEvent(buffer.slice(0, boundary))
+      buffer = buffer.slice(boundary + 2)
+      boundary = buffer.indexOf('\n\n')
+      if (!message) continue
+
+      if (message.event === 'error') {
+        throw new Error(message.data?.error || 'Explanation failed')
+      }
+      onEvent?.(message.event, message.data)
+      if (message.event === 'done') {
+        reader.cancel()
+        return message.data
+      }
+    }
+  }
+
+  throw new Error('Explanation stream ended before the report was ready')
+}
+
+export async function fetchPatientHistory(patientId = '', { cursor = '', limit } = {}) {
   const query = new URLSearchParams()
   if (patientId) {
     query.set('patientId', patientId)
   }
+  if (cursor) {
+    query.set('cursor', cursor)
+  }
+  if (limit) {
+    query.set('limit', String(limit))
+  }
 
   const queryString = query.toString()
   const endpoint = queryString ? `/patients/history?${queryString}` : '/patients/history'
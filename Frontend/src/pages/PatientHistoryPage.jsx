@@ -64,6 +64,9 @@ function ReportPreviewModal({ report, onClose }) {
           <p><span className="font-medium">Diagnosis:</span> {report.diagnosis || 'Pending inference'}</p>
           <p><span className="font-medium">Confidence:</span> {report.confidence ?? 0}%</p>
           <p className="break-all"><span className="font-medium">Image:</span> {report.imageFilename || 'N/A'}</p>
+          {report.modelVersion ? (
+            <p className="break-all"><span className="font-medium">Model version:</span> {report.modelVersion}</p>
+          ) : null}
         </div>
 
         <div className="grid gap-3 md:grid-cols-4">
@@ -125,7 +128,7 @@ function ReportPreviewModal({ report, onClose }) {
   )
 }
 
-function PatientHistoryPage({ reports, isLoading, errorMessage, initialPatientId, onSearch, onBack }) {
+function PatientHistoryPage({ reports, isLoading, errorMessage, initialPatientId, onSearch, onLoadMore, hasMore, onBack }) {
   const [patientId, setPatientId] = useState(initialPatientId || '')
   const [selectedReportId, setSelectedReportId] = useState('')
   const [isModalOpen, setIsModalOpen] = useState(false)
@@ -255,6 +258,15 @@ function PatientHistoryPage({ reports, isLoading, errorMessage, initialPatientId
                     <Eye className="mr-1 h-4 w-4" />
                     View Report
                   </Button>
+                  {['gradcam', 'occlusion', 'lime'].filter((key) => report.thumbnails?.[key]).map((key) => (
+                    <img
+                      key={key}
+                      src={report.thumbnails[key]}
+                      alt={`${key} thumbnail`}
+                      loading="lazy"
+                      className="h-12 w-12 rounded border border-slate-200 object-cover"
+                    />
+                  ))}
                   <Badge tone={report.gradcam || report.lime || report.occlusion ? 'success' : 'neutral'}>
                     {report.gradcam || report.lime || report.occlusion ? 'XAI available' : 'XAI pending'}
                   </Badge>
@@ -263,6 +275,14 @@ function PatientHistoryPage({ reports, isLoading, errorMessage, initialPatientId
               </div>
             )
           })}
+
+          {hasMore ? (
+            <div className="flex justify-center pt-2">
+              <Button variant="secondary" onClick={onLoadMore} disabled={isLoading}>
+                {isLoading ? 'Loading...' : 'Load more'}
+              </Button>
+            </div>
+          ) : null}
         </CardContent>
       </Card>
 
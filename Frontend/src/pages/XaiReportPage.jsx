@@ -22,6 +22,8 @@ function XaiReportPage({
     { key: 'occlusion', label: 'Occlusion', src: report.occlusion },
   ]
   const completedSteps = Math.round((xaiProgress / 100) * totalXaiSteps)
+  // streamed images appear while the remaining explainers are still running
+  const hasImages = xaiImages.some((image) => image.src)
 
   return (
     <div className="mx-auto max-w-6xl px-4 py-10">
@@ -75,7 +77,9 @@ function XaiReportPage({
               <p className="text-sm font-semibold text-sky-700">Progress: {Math.round(xaiProgress)}%</p>
               <p className="text-center text-xs text-slate-500">Backend warnings may appear in terminal while this runs.</p>
             </div>
-          ) : (
+          ) : null}
+
+          {!isLoading || hasImages ? (
             <div className="grid gap-3 md:grid-cols-3">
               {xaiImages.map((image) => (
                 <div key={image.key} className="overflow-hidden rounded-lg border border-slate-200 bg-slate-50">
@@ -86,13 +90,13 @@ function XaiReportPage({
                     {image.src ? (
                       <img src={image.src} alt={`${image.label} explanation`} className="h-full w-full rounded object-cover" />
                     ) : (
-                      <span className="text-xs text-slate-400">No image returned by backend</span>
+                      <span className="text-xs text-slate-400">{isLoading ? 'Rendering...' : 'No image returned by backend'}</span>
                     )}
                   </div>
                 </div>
               ))}
             </div>
-          )}
+          ) : null}
 
           {errorMessage ? (
             <div className="space-y-3 rounded-lg border border-rose-200 bg-rose-50 p-3">